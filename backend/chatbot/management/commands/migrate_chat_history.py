@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from services.history import migrate_string_dates
+from services.mongo import chats_collection, conversations_collection, ensure_indexes
+
+
+class Command(BaseCommand):
+	help = 'Create the chat history indexes and convert ISO-string timestamps to BSON datetimes'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=1000, help='documents per bulk update')
+		parser.add_argument('--indexes-only', action='store_true', help='skip the timestamp conversion')
+
+	def handle(self, *args, **options):
+		try:
+			for name in ensure_indexes(force=True):
+				self.stdout.write(f'index ready: {name}')
+			if options['indexes_only']:
+				return
+			chats = migrate_string_dates(chats_collection(), ('created_at',), options['batch_size'])
+			convs = migrate_string_dates(conversations_collection(), ('created_at', 'updated_at'), options['batch_size'])
+		except Exception as e:
+			raise CommandError(f'Mongo unavailable: {e}')
+		self.stdout.write(self.style.SUCCESS(f'converted {chats} chat record(s) and {convs} conversation timestamp(s)'))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from services.mock_llm import MockLLMConfig, MockLLMServer
+
+
+class Command(BaseCommand):
+	help = 'Run a local mock OpenAI/Gemini provider for load tests (no real provider quota used)'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--host', default='127.0.0.1')
+		parser.add_argument('--port', type=int, default=8900)
+		parser.add_argument('--latency', default='lognormal:300,0.5', help='time to first token in ms: fixed:V | uniform:LO,HI | normal:M,SD | lognormal:MEDIAN,SIGMA | exp:MEAN')
+		parser.add_argument('--completion-tokens', default='uniform:32,256', help='tokens per completion, same distribution syntax')
+		parser.add_argument('--tokens-per-sec', type=float, default=60.0, help='generation throughput (0 = instant)')
+		parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with HTTP 500')
+		parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='fraction of requests answered with HTTP 429')
+		parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After seconds sent with 429s')
+		parser.add_argument('--rpm', type=float, default=0.0, help='hard requests/min cap before 429s (0 = none)')
+		parser.add_argument('--seed', type=int, default=None)
+		parser.add_argument('--verbose', action='store_true', help='log every request')
+
+	def handle(self, *args, **options):
+		try:
+			config = MockLLMConfig(
+				latency=options['latency'],
+				completion_tokens=options['completion_tokens'],
+				tokens_per_sec=options['tokens_per_sec'],
+				error_rate=options['error_rate'],
+				rate_limit_rate=options['rate_limit_rate'],
+				retry_after=options['retry_after'],
+				rpm=options['rpm'],
+				seed=options['seed'],
+			)
+		except ValueError as e:
+			raise CommandError(str(e))
+		server = MockLLMServer((options['host'], options['port']), config, verbose=options['verbose'])
+		base = server.base_url
+		self.stdout.write(self.style.SUCCESS(f'Mock LLM provider listening on {base}'))
+		self.stdout.write(f'  OPENAI_API_BASE={base}/v1')
+		self.stdout.write(f'  GEMINI_API_BASE={base}/v1beta')
+		self.stdout.write(f'  stats: GET {base}/stats')
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			server.server_close()
+			self.stdout.write(str(server.stats.snapshot()))
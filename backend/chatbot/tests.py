@@ -1,3 +1,1042 @@
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+
+from bson import ObjectId
+import requests
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
+from rest_framework.test import APIClient
+from rest_framework.throttling import UserRateThrottle
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from django.conf import settings
+from django.test import override_settings
+
+from services import ai
+from services.ai_cache import CompletionCache, LRUTTLCache, cache_key
+from services.ai_router import OPEN, ProviderRouter
+from pymongo.errors import ServerSelectionTimeoutError
+
+from services.chat_writer import WriteBehindWriter
+from services.ai_limits import KeyLimiter, acquire
+from services.mock_llm import MockLLMConfig, start_in_thread
+from services.context import estimate_tokens, pack_messages
+from services.transport import close_transports, get_async_transport, reset_transports, transport_stats
+
+
+class ChatStreamTests(TestCase):
+	def setUp(self):
+		self.user = get_user_model().objects.create_user(username='streamer', password='pw-12345678')
+		self.client = APIClient()
+		self.client.force_authenticate(self.user)
+
+	def test_stream_emits_deltas_then_done_record(self):
+		events = iter([
+			{'type': 'delta', 'content': 'Hel'},
+			{'type': 'delta', 'content': 'lo'},
+			{'type': 'done', 'response': {'provider': 'openai', 'model': 'm', 'content': 'Hello'}},
+		])
+		with mock.patch('chatbot.views.chat_complete', return_value=events), \
+			mock.patch('services.conversations._insert_conversation'), \
+			mock.patch('chatbot.views._persist_chat') as persist:
+			resp = self.client.post('/api/chat/', {'messages': [{'role': 'user', 'content': 'hi'}], 'stream': True}, format='json', secure=True)
+			self.assertEqual(resp.status_code, 200)
+			self.assertEqual(resp['Content-Type'], 'text/event-stream')
+			body = b''.join(resp.streaming_content).decode('utf-8')
+		payloads = [json.loads(line[6:]) for line in body.split('\n\n') if line.startswith('data: ')]
+		self.assertEqual([p['type'] for p in payloads], ['delta', 'delta', 'done'])
+		self.assertEqual(payloads[-1]['record']['response']['content'], 'Hello')
+		persist.assert_called_once()
+
+
+class ContextPackingTests(TestCase):
+	def test_keeps_system_and_most_recent_turns(self):
+		msgs = [{'role': 'system', 'content': 'be brief'}]
+		msgs += [{'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'turn {i} ' + 'x' * 400} for i in range(40)]
+		packed, report = pack_messages(msgs, budget=1000)
+		self.assertEqual(packed[0]['role'], 'system')
+		self.assertEqual(packed[-1], msgs[-1])
+		self.assertLessEqual(report['tokens_sent'], 1000)
+		self.assertGreater(report['messages_dropped'], 0)
+		self.assertEqual(report['messages_sent'] + report['messages_dropped'], len(msgs))
+
+	def test_oversized_last_turn_is_truncated_not_dropped(self):
+		packed, report = pack_messages([{'role': 'user', 'content': 'y' * 100000}], budget=500)
+		self.assertEqual(len(packed), 1)
+		self.assertTrue(report['truncated'])
+		self.assertLessEqual(estimate_tokens(packed[0]['content']) + 4, 500)
+
+	def test_chat_view_reports_context(self):
+		user = get_user_model().objects.create_user(username='packer', password='pw-12345678')
+		client = APIClient()
+		client.force_authenticate(user)
+		msgs = [{'role': 'user', 'content': str(i)} for i in range(30)]
+		with mock.patch('chatbot.views.chat_complete', return_value={'content': 'ok'}) as call, \
+			mock.patch('services.conversations._insert_conversation'), \
+			mock.patch('chatbot.views._persist_chat'):
+			resp = client.post('/api/chat/', {'messages': msgs}, format='json', secure=True)
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(len(call.call_args[0][0]), 30)  # no longer cut at 20
+		self.assertEqual(resp.json()['context']['tokens_dropped'], 0)
+
+
+class AsyncChatTests(TestCase):
+	def test_async_chat_requires_auth(self):
+		resp = self.client.post('/api/chat/async/', {'messages': []}, content_type='application/json', secure=True)
+		self.assertEqual(resp.status_code, 401)
+
+	def test_async_chat_awaits_provider(self):
+		user = get_user_model().objects.create_user(username='async-user', password='pw-12345678')
+		token = str(RefreshToken.for_user(user).access_token)
+		reply = {'provider': 'openai', 'model': 'm', 'content': 'pong'}
+		with mock.patch('chatbot.views.chat_complete_async', new=mock.AsyncMock(return_value=reply)), \
+			mock.patch('services.conversations._ainsert_conversation', new=mock.AsyncMock()), \
+			mock.patch('chatbot.views._apersist_chat', new=mock.AsyncMock()):
+			resp = self.client.post('/api/chat/async/', {'messages': [{'role': 'user', 'content': 'ping'}]}, content_type='application/json', secure=True, HTTP_AUTHORIZATION=f'Bearer {token}')
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resp.json()['response']['content'], 'pong')
+
+	def test_async_chat_is_throttled_like_drf_views(self):
+		user = get_user_model().objects.create_user(username='async-throttled', password='pw-12345678')
+		token = str(RefreshToken.for_user(user).access_token)
+		reply = {'provider': 'openai', 'model': 'm', 'content': 'pong'}
+		cache.clear()
+		self.addCleanup(cache.clear)
+		with mock.patch.object(UserRateThrottle, 'THROTTLE_RATES', {'user': '2/min', 'anon': '2/min'}), \
+			mock.patch('chatbot.views.chat_complete_async', new=mock.AsyncMock(return_value=reply)) as provider, \
+			mock.patch('services.conversations._ainsert_conversation', new=mock.AsyncMock()), \
+			mock.patch('chatbot.views._apersist_chat', new=mock.AsyncMock()):
+			codes = [self.client.post('/api/chat/async/', {'messages': [{'role': 'user', 'content': 'ping'}]}, content_type='application/json', secure=True, HTTP_AUTHORIZATION=f'Bearer {token}').status_code for _ in range(3)]
+		self.assertEqual(codes, [200, 200, 429])
+		self.assertEqual(provider.await_count, 2)
+
+
+class CompletionCacheTests(TestCase):
+	def test_key_ignores_outer_whitespace_and_role_case(self):
+		a = cache_key([{'role': 'User', 'content': ' hello world\n'}], 'openai', 'm', 0)
+		b = cache_key([{'role': 'user', 'content': 'hello world'}], 'openai', 'm', 0.0)
+		self.assertEqual(a, b)
+		# Inner whitespace can be meaningful (code, tables, poetry): it must not share a cached answer
+		self.assertNotEqual(b, cache_key([{'role': 'user', 'content': 'hello  world'}], 'openai', 'm', 0))
+		self.assertNotEqual(b, cache_key([{'role': 'user', 'content': 'hello\nworld'}], 'openai', 'm', 0))
+		self.assertNotEqual(a, cache_key([{'role': 'user', 'content': 'hello world'}], 'gemini', 'm', 0))
+
+	def test_concurrent_identical_calls_are_coalesced(self):
+		cache = CompletionCache(LRUTTLCache(max_entries=4, ttl=60))
+		calls = []
+
+		def upstream():
+			calls.append(1)
+			time.sleep(0.2)
+			return {'content': 'once'}
+
+		results = []
+		threads = [threading.Thread(target=lambda: results.append(cache.get_or_call('k', upstream))) for _ in range(5)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		self.assertEqual(len(calls), 1)
+		self.assertEqual({r['content'] for r in results}, {'once'})
+		self.assertTrue(cache.get_or_call('k', upstream)['cached'])
+
+	def test_hits_are_private_copies_without_per_call_metadata(self):
+		cache = CompletionCache(LRUTTLCache(max_entries=4, ttl=60))
+		first = cache.get_or_call('k', lambda: {'content': 'x', 'usage': {'total_tokens': 3}, 'hedge': {'winner': 'secondary'}, 'routing': {'attempts': []}})
+		first['usage']['total_tokens'] = 99
+		hit = cache.get_or_call('k', mock.Mock())
+		self.assertEqual(hit['usage'], {'total_tokens': 3})
+		self.assertNotIn('hedge', hit)
+		self.assertNotIn('routing', hit)
+		hit['usage']['total_tokens'] = 42
+		self.assertEqual(cache.get_or_call('k', mock.Mock())['usage'], {'total_tokens': 3})
+		self.assertEqual({k: cache.stats()[k] for k in ('hits', 'misses', 'stores')}, {'hits': 2, 'misses': 1, 'stores': 1})
+
+	def test_errors_are_not_cached(self):
+		cache = CompletionCache(LRUTTLCache(max_entries=4, ttl=60))
+		cache.get_or_call('k', lambda: {'error': 'boom'})
+		self.assertEqual(cache.get_or_call('k', lambda: {'content': 'ok'})['content'], 'ok')
+
+
+@override_settings(OPENAI_API_KEY='sk-test', OPENAI_MODEL='gpt-4o-mini', GEMINI_API_KEY='g-test', AI_CACHE_ENABLED=False)
+class AutoRoutingTests(TestCase):
+	def setUp(self):
+		self.router = ProviderRouter(failure_threshold=2, cooldown=60)
+		patcher = mock.patch('services.ai.get_router', return_value=self.router)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_fails_over_on_transient_error(self):
+		with mock.patch('services.ai.openai_chat', return_value={'provider': 'openai', 'error': '503 Service Unavailable', 'status_code': 503}), \
+			mock.patch('services.ai.gemini_chat', return_value={'provider': 'gemini', 'content': 'ok'}):
+			resp = ai.chat_complete([{'role': 'user', 'content': 'hi'}], provider='auto')
+		self.assertEqual(resp['provider'], 'gemini')
+		self.assertEqual([a['provider'] for a in resp['routing']['attempts']], ['openai', 'gemini'])
+
+	def test_failing_provider_is_demoted(self):
+		failing = mock.Mock(return_value={'provider': 'openai', 'error': '429 Too Many Requests', 'status_code': 429})
+		with mock.patch('services.ai.openai_chat', failing), \
+			mock.patch('services.ai.gemini_chat', return_value={'provider': 'gemini', 'content': 'ok'}):
+			for _ in range(3):
+				resp = ai.chat_complete([{'role': 'user', 'content': 'hi'}], provider='auto')
+		self.assertEqual(resp['provider'], 'gemini')
+		self.assertEqual(failing.call_count, 1)
+
+	def test_open_breaker_is_skipped(self):
+		for _ in range(2):
+			self.router.record('openai', 'gpt-4o-mini', 5.0, ok=False, status=503)
+		self.assertEqual(self.router.stats_for('openai', 'gpt-4o-mini').state, OPEN)
+		failing = mock.Mock()
+		with mock.patch('services.ai.openai_chat', failing), \
+			mock.patch('services.ai.gemini_chat', return_value={'provider': 'gemini', 'content': 'ok'}):
+			resp = ai.chat_complete([{'role': 'user', 'content': 'hi'}], provider='auto')
+		failing.assert_not_called()
+		self.assertEqual([a['provider'] for a in resp['routing']['attempts']], ['gemini'])
+
+	def _half_open(self):
+		# openai only, so the half-open target is the one tried
+		self.enterContext(override_settings(GEMINI_API_KEY=''))
+		self.router.cooldown = 0
+		for _ in range(2):
+			self.router.record('openai', 'gpt-4o-mini', 5.0, ok=False, status=503)
+		return self.router.stats_for('openai', 'gpt-4o-mini')
+
+	def test_probe_without_verdict_is_released(self):
+		st = self._half_open()
+		bad_request = {'provider': 'openai', 'error': '400 Bad Request', 'status_code': 400}
+		with mock.patch('services.ai.openai_chat', return_value=bad_request):
+			ai.chat_complete([{'role': 'user', 'content': 'hi'}], provider='auto')
+		self.assertFalse(st.probing)
+		self.assertTrue(self.router.allow('openai', 'gpt-4o-mini'))
+		self.router.release_probe('openai', 'gpt-4o-mini')
+		# Rejected by the local limiter: the provider was never asked
+		with mock.patch('services.ai.get_limiter', return_value=KeyLimiter('t', rpm=1, tpm=0, max_in_flight=0)), \
+			mock.patch('services.ai.acquire', return_value=None):
+			ai.chat_complete([{'role': 'user', 'content': 'hi'}], provider='auto')
+		self.assertFalse(st.probing)
+
+	def test_abandoned_stream_releases_probe(self):
+		st = self._half_open()
+		events = iter([{'type': 'delta', 'content': 'a'}, {'type': 'delta', 'content': 'b'}])
+		with mock.patch('services.ai.openai_chat_stream', return_value=events):
+			stream = ai.chat_complete([{'role': 'user', 'content': 'hi'}], provider='auto', stream=True)
+			self.assertEqual(next(stream)['content'], 'a')
+			self.assertTrue(st.probing)
+			stream.close()
+		self.assertFalse(st.probing)
+		self.assertTrue(self.router.allow('openai', 'gpt-4o-mini'))
+
+
+class AdmissionControlTests(TestCase):
+	def test_waiters_are_admitted_in_arrival_order(self):
+		limiter = KeyLimiter('t', rpm=0, tpm=0, max_in_flight=1)
+		first = acquire(limiter, 10)
+		order = []
+
+		def waiter(n):
+			ticket = acquire(limiter, 10)
+			order.append(n)
+			limiter.release(ticket)
+		threads = []
+		for n in range(3):
+			threads.append(threading.Thread(target=waiter, args=(n,)))
+			threads[-1].start()
+			time.sleep(0.02)  # enqueue in a known order
+		self.assertEqual(limiter.snapshot()['queue_depth'], 3)
+		limiter.release(first)
+		for t in threads:
+			t.join(2)
+		self.assertEqual(order, [0, 1, 2])
+		self.assertEqual(limiter.snapshot()['in_flight'], 0)
+
+	@override_settings(AI_LIMIT_QUEUE_TIMEOUT=0.05)
+	def test_exhausted_bucket_rejects_after_deadline(self):
+		limiter = KeyLimiter('t', rpm=1, tpm=0, max_in_flight=0)
+		self.assertIsNotNone(acquire(limiter, 1))
+		self.assertIsNone(acquire(limiter, 1))
+		self.assertEqual(limiter.snapshot()['rejected'], 1)
+
+	@override_settings(OPENAI_API_KEY='sk-limits-test', AI_LIMIT_OPENAI_RPM=1, AI_LIMIT_QUEUE_TIMEOUT=0.05, AI_CACHE_ENABLED=False)
+	def test_chat_complete_returns_local_429_when_throttled(self):
+		with mock.patch('services.ai.get_router', return_value=ProviderRouter()), \
+			mock.patch('services.ai.openai_chat', return_value={'provider': 'openai', 'content': 'ok'}) as call:
+			ai.chat_complete([{'role': 'user', 'content': 'hi'}], provider='openai')
+			resp = ai.chat_complete([{'role': 'user', 'content': 'hi'}], provider='openai')
+		self.assertEqual(call.call_count, 1)
+		self.assertEqual(resp['status_code'], 429)
+		self.assertTrue(resp['local_limit'])
+
+	@override_settings(AI_LIMITS_ENABLED=True)
+	def test_provider_429_is_not_retried_when_limits_enabled(self):
+		throttled = requests.Response()
+		throttled.status_code, throttled.reason = 429, 'Too Many Requests'
+		throttled.headers['Retry-After'] = '7'
+		transport = mock.Mock()
+		transport.post.return_value = throttled
+		with mock.patch('services.ai.time.sleep') as sleep:
+			with self.assertRaises(requests.HTTPError) as caught:
+				ai._post_with_retries('https://provider.test/v1', {}, transport=transport)
+		self.assertEqual(transport.post.call_count, 1)
+		sleep.assert_not_called()
+		self.assertEqual(ai._retry_after(caught.exception), '7')
+
+	@override_settings(OPENAI_API_KEY='sk-probe-test', AI_LIMIT_OPENAI_RPM=1, AI_LIMIT_QUEUE_TIMEOUT=0.05, AI_CACHE_ENABLED=True)
+	def test_health_probe_bypasses_cache_and_limits(self):
+		with mock.patch('services.ai.get_router', return_value=ProviderRouter()), \
+			mock.patch('services.ai.openai_chat', return_value={'provider': 'openai', 'content': 'ok'}) as call:
+			ai.chat_complete([{'role': 'user', 'content': 'hi'}], provider='openai')
+			results = [ai.probe('openai') for _ in range(2)]
+		self.assertEqual(call.call_count, 3)
+		self.assertFalse(any(r.get('error') or r.get('cached') for r in results))
+
+
+@override_settings(OPENAI_API_KEY='sk-test', GEMINI_API_KEY='g-test', AI_CACHE_ENABLED=False,
+	AI_HEDGE_MIN_DELAY_MS=20, AI_HEDGE_DEFAULT_DELAY_MS=20)
+class HedgedRequestTests(TestCase):
+	def setUp(self):
+		self.router = ProviderRouter()
+		patcher = mock.patch('services.ai.get_router', return_value=self.router)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_slow_failing_primary_is_hedged_to_secondary(self):
+		threads = []
+
+		def slow_openai(*_args):
+			threads.append(threading.current_thread())
+			time.sleep(0.3)
+			return {'provider': 'openai', 'error': 'timed out'}
+
+		def gemini(*_args):
+			threads.append(threading.current_thread())
+			return {'provider': 'gemini', 'content': 'fast'}
+
+		with mock.patch('services.ai.openai_chat', side_effect=slow_openai), \
+			mock.patch('services.ai.gemini_chat', side_effect=gemini):
+			resp = ai.chat_complete([{'role': 'user', 'content': 'hi'}], provider='openai', hedge=True)
+		self.assertEqual(resp['content'], 'fast')
+		self.assertTrue(resp['hedge']['fired'])
+		self.assertEqual(resp['hedge']['winner'], 'secondary')
+		# Both calls ran on the hedge pool, and the slow primary was not waited for
+		self.assertNotIn(threading.current_thread(), threads)
+		self.assertLess(resp['hedge']['elapsed_ms'], 300)
+
+	def test_faster_secondary_beats_slow_successful_primary(self):
+		def slow_openai(*_args):
+			time.sleep(0.5)
+			return {'provider': 'openai', 'content': 'late'}
+
+		with mock.patch('services.ai.openai_chat', side_effect=slow_openai), \
+			mock.patch('services.ai.gemini_chat', return_value={'provider': 'gemini', 'content': 'fast'}):
+			resp = ai.chat_complete([{'role': 'user', 'content': 'hi'}], provider='openai', hedge=True)
+		self.assertEqual(resp['content'], 'fast')
+		self.assertTrue(resp['hedge']['fired'])
+		self.assertEqual(resp['hedge']['winner'], 'secondary')
+		self.assertLess(resp['hedge']['elapsed_ms'], 500)
+
+	def test_secondary_error_falls_back_to_primary(self):
+		def slow_openai(*_args):
+			time.sleep(0.1)
+			return {'provider': 'openai', 'content': 'late'}
+
+		with mock.patch('services.ai.openai_chat', side_effect=slow_openai), \
+			mock.patch('services.ai.gemini_chat', return_value={'provider': 'gemini', 'error': 'boom', 'status_code': 500}):
+			resp = ai.chat_complete([{'role': 'user', 'content': 'hi'}], provider='openai', hedge=True)
+		self.assertEqual(resp['content'], 'late')
+		self.assertEqual(resp['hedge']['winner'], 'primary')
+
+	def test_secondary_outcome_is_reported_to_router(self):
+		def slow_openai(*_args):
+			time.sleep(0.1)
+			return {'provider': 'openai', 'error': 'timed out'}
+
+		with mock.patch('services.ai.openai_chat', side_effect=slow_openai), \
+			mock.patch('services.ai.gemini_chat', return_value={'provider': 'gemini', 'error': 'unavailable', 'status_code': 503}):
+			resp = ai.chat_complete([{'role': 'user', 'content': 'hi'}], provider='openai', hedge=True)
+		self.assertEqual(resp['error'], 'timed out')
+		st = self.router.stats_for('gemini', settings.GEMINI_MODEL)
+		self.assertEqual((st.requests, st.failures), (1, 1))
+
+	def test_no_hedge_to_secondary_with_open_breaker(self):
+		for _ in range(self.router.failure_threshold):
+			self.router.record('gemini', settings.GEMINI_MODEL, 10, False, 503)
+		secondary = mock.Mock()
+
+		def slow_openai(*_args):
+			time.sleep(0.1)
+			return {'provider': 'openai', 'content': 'late'}
+
+		with mock.patch('services.ai.openai_chat', side_effect=slow_openai), \
+			mock.patch('services.ai.gemini_chat', secondary):
+			resp = ai.chat_complete([{'role': 'user', 'content': 'hi'}], provider='openai', hedge=True)
+		self.assertEqual(resp['content'], 'late')
+		self.assertNotIn('hedge', resp)
+		secondary.assert_not_called()
+
+	def test_secondary_passes_its_breaker_when_fired(self):
+		self.router.record('gemini', settings.GEMINI_MODEL, 10, True)
+
+		def slow_openai(*_args):
+			# The secondary's breaker opens after the targets were picked
+			for _ in range(self.router.failure_threshold):
+				self.router.record('gemini', settings.GEMINI_MODEL, 10, False, 503)
+			time.sleep(0.1)
+			return {'provider': 'openai', 'error': 'timed out'}
+
+		secondary = mock.Mock()
+		with mock.patch('services.ai.openai_chat', side_effect=slow_openai), \
+			mock.patch('services.ai.gemini_chat', secondary):
+			resp = ai.chat_complete([{'role': 'user', 'content': 'hi'}], provider='openai', hedge=True)
+		self.assertTrue(resp['hedge']['fired'])
+		self.assertEqual((resp['error'], resp['hedge']['winner']), ('timed out', 'primary'))
+		secondary.assert_not_called()
+
+	def test_fast_primary_does_not_fire_hedge(self):
+		secondary = mock.Mock()
+		with mock.patch('services.ai.openai_chat', return_value={'provider': 'openai', 'content': 'quick'}), \
+			mock.patch('services.ai.gemini_chat', secondary):
+			resp = ai.chat_complete([{'role': 'user', 'content': 'hi'}], provider='openai', hedge=True)
+		self.assertEqual(resp['hedge']['winner'], 'primary')
+		self.assertFalse(resp['hedge']['fired'])
+		secondary.assert_not_called()
+
+
+@override_settings(OPENAI_API_KEY='sk-mock', GEMINI_API_KEY='g-mock', AI_CACHE_ENABLED=False)
+class MockProviderServerTests(TestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.server = start_in_thread(MockLLMConfig(latency='fixed:0', completion_tokens='fixed:5', tokens_per_sec=0, seed=1))
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.server.shutdown()
+		cls.server.server_close()
+		super().tearDownClass()
+
+	def setUp(self):
+		for name, value in (('OPENAI_API_BASE', self.server.base_url + '/v1'), ('GEMINI_API_BASE', self.server.base_url + '/v1beta')):
+			patcher = mock.patch(f'services.ai.{name}', value)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	def test_openai_buffered_and_streamed(self):
+		resp = ai.openai_chat([{'role': 'user', 'content': 'hi'}], 'gpt-mock', 0.0)
+		self.assertEqual(len(resp['content'].split()), 5)
+		self.assertEqual(resp['usage']['completion_tokens'], 5)
+		events = list(ai.openai_chat_stream([{'role': 'user', 'content': 'hi'}], 'gpt-mock', 0.0))
+		self.assertEqual([e['type'] for e in events], ['delta'] * 5 + ['done'])
+		self.assertEqual(events[-1]['response']['usage']['total_tokens'], events[-1]['response']['usage']['prompt_tokens'] + 5)
+
+	def test_gemini_buffered_and_streamed(self):
+		resp = ai.gemini_chat([{'role': 'user', 'content': 'hi'}], 'gemini-mock', 0.0)
+		self.assertEqual(len(resp['content'].split()), 5)
+		events = list(ai.gemini_chat_stream([{'role': 'user', 'content': 'hi'}], 'gemini-mock', 0.0))
+		self.assertEqual(events[-1]['type'], 'done')
+		self.assertEqual(len(events[-1]['response']['content'].split()), 5)
+
+	def test_injected_rate_limit_carries_retry_after(self):
+		self.server.config.rate_limit_rate = 1.0
+		try:
+			resp = ai.openai_chat([{'role': 'user', 'content': 'hi'}], 'gpt-mock', 0.0)
+		finally:
+			self.server.config.rate_limit_rate = 0.0
+		self.assertEqual(resp['status_code'], 429)
+		self.assertEqual(resp['retry_after'], '1')
+
+	def test_async_pool_usage_is_reported_and_clients_close_at_exit(self):
+		reset_transports()
+		loop = asyncio.new_event_loop()
+		self.addCleanup(loop.close)
+
+		async def two_calls():
+			for _ in range(2):
+				await ai.openai_chat_async([{'role': 'user', 'content': 'hi'}], 'gpt-mock', 0.0)
+			return get_async_transport('openai')
+
+		openai = loop.run_until_complete(two_calls())
+		stats = transport_stats()['openai:async']
+		self.assertEqual((stats['loops'], stats['requests'], stats['checkouts']), (1, 2, 2))
+		self.assertEqual((stats['new_connections'], stats['hits'], stats['in_use']), (1, 1, 0))
+		self.assertEqual(stats['peak_in_use'], 1)
+		close_transports()
+		self.assertTrue(openai.client.is_closed)
+		self.assertNotIn('openai:async', transport_stats())
+
+
+class _FakeChats:
+	def __init__(self, fail=False):
+		self.fail = fail
+		self.batches = []
+
+	def insert_many(self, docs, ordered=True):
+		if self.fail:
+			raise ServerSelectionTimeoutError('no servers')
+		self.batches.append((list(docs), ordered))
+		return mock.Mock(inserted_ids=[d['_id'] for d in docs])
+
+
+class WriteBehindTests(TestCase):
+	def test_batches_unordered_and_flushes(self):
+		coll = _FakeChats()
+		writer = WriteBehindWriter(lambda: coll, batch_size=3, flush_interval=0.05)
+		self.addCleanup(writer.close)
+		for i in range(7):
+			self.assertEqual(writer.submit({'_id': i}), 'queued')
+		self.assertTrue(writer.flush(timeout=2))
+		self.assertEqual(sorted(d['_id'] for docs, _ in coll.batches for d in docs), list(range(7)))
+		self.assertTrue(all(len(docs) <= 3 and ordered is False for docs, ordered in coll.batches))
+		self.assertEqual(writer.snapshot()['written'], 7)
+
+	def test_unreachable_mongo_spills_then_replays(self):
+		coll = _FakeChats(fail=True)
+		spill = os.path.join(tempfile.mkdtemp(), 'spill.jsonl')
+		writer = WriteBehindWriter(lambda: coll, batch_size=10, flush_interval=0.02, spill_path=spill, replay_interval=3600)
+		self.addCleanup(writer.close)
+		writer.submit({'_id': 'a', 'n': 1})
+		writer.submit({'_id': 'b', 'n': 2})
+		writer.flush(timeout=2)
+		self.assertEqual(writer.snapshot()['spilled'], 2)
+		self.assertTrue(os.path.exists(f'{spill}.{os.getpid()}'))
+		coll.fail = False
+		self.assertEqual(writer.replay_spill(), 2)
+		self.assertEqual(os.listdir(os.path.dirname(spill)), [])
+		self.assertEqual([d['n'] for d in coll.batches[0][0]], [1, 2])
+
+	def test_replay_skips_unreadable_lines_and_takes_over_dead_workers_files(self):
+		coll = _FakeChats()
+		spill = os.path.join(tempfile.mkdtemp(), 'spill.jsonl')
+		with open(f'{spill}.{os.getpid()}', 'w') as f:
+			f.write('{"_id": "a"}\n{"_id": \n{"_id": "b"}\n')
+		with open(f'{spill}.999999999', 'w') as f:  # no such process
+			f.write('{"_id": "c"}\n')
+		writer = WriteBehindWriter(lambda: coll, batch_size=10, spill_path=spill, replay_interval=3600)
+		self.addCleanup(writer.close)
+		with mock.patch('services.chat_writer._pid_alive', side_effect=lambda pid: pid != 999999999):
+			self.assertEqual(writer.replay_spill(), 3)
+		self.assertEqual(sorted(d['_id'] for docs, _ in coll.batches for d in docs), ['a', 'b', 'c'])
+		self.assertEqual(writer.snapshot()['corrupt'], 1)
+		self.assertEqual(os.listdir(os.path.dirname(spill)), [])
+
+	def test_live_workers_spill_file_is_left_alone(self):
+		spill = os.path.join(tempfile.mkdtemp(), 'spill.jsonl')
+		other = f'{spill}.{os.getppid()}'
+		with open(other, 'w') as f:
+			f.write('{"_id": "theirs"}\n')
+		writer = WriteBehindWriter(lambda: _FakeChats(), spill_path=spill, replay_interval=3600)
+		self.addCleanup(writer.close)
+		self.assertEqual(writer.replay_spill(), 0)
+		self.assertTrue(os.path.exists(other))
+
+	def test_non_blocking_submit_spills_instead_of_waiting(self):
+		spill = os.path.join(tempfile.mkdtemp(), 'spill.jsonl')
+		writer = WriteBehindWriter(lambda: _FakeChats(), max_queue=1, policy='block', block_timeout=5, spill_path=spill)
+		writer._ensure_started = lambda: None  # no consumer: the queue stays full
+		self.assertEqual(writer.submit({'_id': 1}), 'queued')
+		started = time.monotonic()
+		self.assertEqual(writer.submit({'_id': 2}, block=False), 'spilled')
+		self.assertLess(time.monotonic() - started, 1)
+
+	def test_full_queue_drop_policy(self):
+		writer = WriteBehindWriter(lambda: _FakeChats(), max_queue=1, policy='drop', flush_interval=5)
+		writer._ensure_started = lambda: None  # no consumer: the queue stays full
+		self.assertEqual(writer.submit({'_id': 1}), 'queued')
+		self.assertEqual(writer.submit({'_id': 2}), 'dropped')
+		self.assertEqual(writer.snapshot()['dropped'], 1)
+
+
+class _FakeCursor(list):
+	def sort(self, key, direction=1):
+		keys = key if isinstance(key, list) else [(key, direction)]
+		docs = list(self)
+		for k, d in reversed(keys):
+			docs.sort(key=lambda doc: doc.get(k), reverse=d == -1)
+		return _FakeCursor(docs)
+
+	def limit(self, n):
+		return _FakeCursor(self[:n])
+
+	def batch_size(self, n):
+		return self
+
+
+class _FakeCollection:
+	"""Just enough of a pymongo collection for the conversation store."""
+
+	_OPS = {'$lt': lambda a, b: a < b, '$lte': lambda a, b: a <= b, '$gte': lambda a, b: a >= b}
+
+	def __init__(self):
+		self.docs = []
+
+	@classmethod
+	def _match(cls, doc, query):
+		for k, v in query.items():
+			if k == '$or':
+				if not any(cls._match(doc, q) for q in v):
+					return False
+			elif isinstance(v, dict) and any(op in v for op in cls._OPS):
+				if doc.get(k) is None or not all(cls._OPS[op](doc.get(k), x) for op, x in v.items()):
+					return False
+			elif doc.get(k) != v:
+				return False
+		return True
+
+	@staticmethod
+	def _project(doc, projection):
+		doc = dict(doc)
+		for k, v in (projection or {}).items():
+			if v == 0:
+				top, _, sub = k.partition('.')
+				if sub and isinstance(doc.get(top), dict):
+					doc[top] = {f: x for f, x in doc[top].items() if f != sub}
+				elif not sub:
+					doc.pop(top, None)
+		return doc
+
+	def create_index(self, *args, **kwargs):
+		return 'ok'
+
+	def insert_one(self, doc):
+		self.docs.append(dict(doc))
+
+	def update_one(self, query, update, upsert=False):
+		doc = next((d for d in self.docs if self._match(d, query)), None)
+		matched, upserted_id = doc is not None, None
+		if doc is None and upsert:
+			doc = dict(query, **update.get('$setOnInsert', {}))
+			self.docs.append(doc)
+			upserted_id = doc.get('_id')
+		if doc is not None:
+			doc.update(update.get('$set', {}))
+			for k, v in update.get('$inc', {}).items():
+				doc[k] = doc.get(k, 0) + v
+			for k, v in update.get('$max', {}).items():
+				doc[k] = max(doc.get(k, v), v)
+		return mock.Mock(matched_count=int(matched), upserted_id=upserted_id)
+
+	def find_one_and_update(self, query, update, projection=None, return_document=None):
+		if not self.update_one(query, update).matched_count:
+			return None
+		return self.find_one(query)
+
+	def find_one(self, query, projection=None):
+		return next((dict(d) for d in self.docs if self._match(d, query)), None)
+
+	def find(self, query, projection=None):
+		return _FakeCursor(self._project(d, projection) for d in self.docs if self._match(d, query))
+
+
+class _ConversationFixture:
+	"""Fake Mongo collections behind services.conversations and a deterministic chat_complete."""
+
+	def setUp(self):
+		self.user = get_user_model().objects.create_user(username='talker', password='pw-12345678')
+		self.client = APIClient()
+		self.client.force_authenticate(self.user)
+		self.chats, self.convs = _FakeCollection(), _FakeCollection()
+		for name, coll in (('chats_collection', self.chats), ('conversations_collection', self.convs), ('ensure_indexes', [])):
+			patcher = mock.patch(f'services.conversations.{name}', return_value=coll)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+		patcher = mock.patch('chatbot.views.chat_complete', side_effect=lambda msgs, **kw: {'content': f'reply {len(msgs)}'})
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+
+@override_settings(CHAT_WRITE_BEHIND=False)
+class ConversationStoreTests(_ConversationFixture, TestCase):
+	def _chat(self, messages, conversation_id=None):
+		body = {'messages': messages}
+		if conversation_id:
+			body['conversation_id'] = conversation_id
+		resp = self.client.post('/api/chat/', body, format='json', secure=True)
+		self.assertEqual(resp.status_code, 200)
+		return resp.json()
+
+	def test_follow_up_turn_stores_only_new_messages(self):
+		first = self._chat([{'role': 'user', 'content': 'hello'}])
+		cid = first['conversation_id']
+		history = [{'role': 'user', 'content': 'hello'}, {'role': 'assistant', 'content': 'reply 1'}, {'role': 'user', 'content': 'more'}]
+		second = self._chat(history, cid)
+		self.assertEqual(second['conversation_id'], cid)
+		self.assertEqual([t['messages'] for t in self.chats.docs], [[history[0]], [history[2]]])
+		self.assertEqual([t['seq'] for t in self.chats.docs], [0, 1])
+		resp = self.client.get(f'/api/chat/history/?conversation_id={cid}', secure=True)
+		self.assertEqual(resp.json()['messages'], history + [{'role': 'assistant', 'content': 'reply 3'}])
+
+	def test_diverged_history_resets_thread(self):
+		cid = self._chat([{'role': 'user', 'content': 'a'}])['conversation_id']
+		self._chat([{'role': 'user', 'content': 'edited'}], cid)
+		self.assertTrue(self.chats.docs[1].get('reset'))
+		thread = self.client.get(f'/api/chat/history/?conversation_id={cid}', secure=True).json()
+		self.assertEqual(thread['messages'][0]['content'], 'edited')
+
+	def test_stale_conversation_update_does_not_roll_back(self):
+		from services import conversations
+		cid = self._chat([{'role': 'user', 'content': 'a'}])['conversation_id']
+		self._chat([{'role': 'user', 'content': 'a'}, {'role': 'assistant', 'content': 'reply 1'}, {'role': 'user', 'content': 'b'}], cid)
+		# A spilled update from the first turn replayed after the second one landed
+		old = conversations.Turn(self.user.id, conversations.parse_id(cid), 0, [{'role': 'user', 'content': 'a'}], '', 0)
+		_, writes = conversations._turn_writes(old, {'response': {'content': 'reply 1'}})
+		for conv_filter, update, upsert in writes:
+			self.convs.update_one(conv_filter, update, upsert=upsert)
+		self.assertEqual(self.convs.docs[0]['turn_count'], 2)
+		self.assertEqual(self.convs.docs[0]['message_count'], 4)
+
+	def test_seq_comes_from_the_stored_counter_not_a_stale_hot_state(self):
+		from services import conversations
+		first = [{'role': 'user', 'content': 'a'}]
+		cid = self._chat(first)['conversation_id']
+		key = conversations._state_key(self.user.id, conversations.parse_id(cid))
+		stale = conversations._state.get(key)
+		second = first + [{'role': 'assistant', 'content': 'reply 1'}, {'role': 'user', 'content': 'b'}]
+		self._chat(second, cid)
+		conversations._state.set(key, stale)  # as on a worker that did not serve the second turn
+		self._chat(second + [{'role': 'assistant', 'content': 'reply 3'}, {'role': 'user', 'content': 'c'}], cid)
+		self.assertEqual([t['seq'] for t in self.chats.docs], [0, 1, 2])
+		self.assertEqual(self.chats.docs[2]['messages'], [{'role': 'user', 'content': 'c'}])
+		self.assertFalse(self.chats.docs[2].get('reset'))
+		self.assertEqual(self.convs.docs[0]['turn_count'], 3)
+
+	def test_turn_started_while_another_is_in_flight_is_stored_in_full(self):
+		from services import conversations
+		cid = self._chat([{'role': 'user', 'content': 'a'}])['conversation_id']
+		in_flight, _ = conversations.claim_seq(self.user.id, conversations.parse_id(cid))
+		history = [{'role': 'user', 'content': 'a'}, {'role': 'assistant', 'content': 'reply 1'}, {'role': 'user', 'content': 'b'}]
+		self._chat(history, cid)
+		self.assertEqual(in_flight, 1)
+		self.assertEqual(self.chats.docs[1]['seq'], 2)
+		self.assertTrue(self.chats.docs[1]['reset'])
+		self.assertEqual(self.chats.docs[1]['messages'], history)
+
+	def test_conversation_without_counter_continues_after_its_turns(self):
+		from services import conversations
+		oid = conversations.parse_id('a' * 24)
+		self.convs.insert_one({'_id': oid, 'user_id': self.user.id, 'digest': '', 'message_count': 0, 'turn_count': 3})
+		self.assertEqual(conversations.claim_seq(self.user.id, oid)[0], 3)
+		self.assertEqual(conversations.claim_seq(self.user.id, oid)[0], 4)
+
+	def test_rejected_update_drops_the_hot_state(self):
+		from services import conversations
+		cid = self._chat([{'role': 'user', 'content': 'a'}])['conversation_id']
+		oid = conversations.parse_id(cid)
+		self.convs.docs[0]['turn_count'] = 5  # another worker's later turns landed first
+		conversations.persist_turn(conversations.Turn(self.user.id, oid, 1, [{'role': 'user', 'content': 'b'}], '', 0), {'response': {}})
+		self.assertIsNone(conversations._state.get(conversations._state_key(self.user.id, oid)))
+		self.assertEqual(self.convs.docs[0]['turn_count'], 5)
+
+	@override_settings(CHAT_WRITE_BEHIND=True)
+	def test_new_conversation_is_visible_to_other_workers(self):
+		from services import conversations
+		writer = mock.Mock()
+		writer.submit.return_value = 'queued'
+		with mock.patch('services.conversations.get_writer', return_value=writer):
+			cid = self._chat([{'role': 'user', 'content': 'a'}])['conversation_id']
+			conversations._state.clear()  # the next turn lands on another worker
+			self._chat([{'role': 'user', 'content': 'a'}, {'role': 'assistant', 'content': 'reply 1'}, {'role': 'user', 'content': 'b'}], cid)
+		self.assertEqual([c.args[0]['seq'] for c in writer.submit.call_args_list], [0, 1])
+		self.assertEqual((self.convs.docs[0]['title'], self.convs.docs[0]['next_seq']), ('a', 2))
+		writer.flush.assert_not_called()
+
+	def test_unknown_conversation_is_404(self):
+		resp = self.client.post('/api/chat/', {'messages': [{'role': 'user', 'content': 'x'}], 'conversation_id': '0' * 24}, format='json', secure=True)
+		self.assertEqual(resp.status_code, 404)
+
+
+@override_settings(CHAT_WRITE_BEHIND=False)
+class ChatSessionTests(_ConversationFixture, TestCase):
+	def test_session_turns_send_only_the_new_message(self):
+		resp = self.client.post('/api/chat/conversations/', {'system': 'be terse'}, format='json', secure=True)
+		self.assertEqual(resp.status_code, 201)
+		cid = resp.json()['conversation_id']
+		with mock.patch('chatbot.views.chat_complete', return_value={'content': 'one'}) as call:
+			self.client.post('/api/chat/', {'conversation_id': cid, 'message': 'first'}, format='json', secure=True)
+			self.client.post('/api/chat/', {'conversation_id': cid, 'message': 'second'}, format='json', secure=True)
+		sent = call.call_args[0][0]
+		self.assertEqual([m['content'] for m in sent], ['be terse', 'first', 'one', 'second'])
+		self.assertEqual([t['messages'] for t in self.chats.docs], [[{'role': 'user', 'content': 'first'}], [{'role': 'user', 'content': 'second'}]])
+
+	def test_session_cache_miss_rebuilds_from_mongo(self):
+		from services import conversations
+		cid = self.client.post('/api/chat/conversations/', {}, format='json', secure=True).json()['conversation_id']
+		self.client.post('/api/chat/', {'conversation_id': cid, 'message': 'hi'}, format='json', secure=True)
+		conversations._state.clear()
+		with mock.patch('chatbot.views.chat_complete', return_value={'content': 'again'}) as call:
+			resp = self.client.post('/api/chat/', {'conversation_id': cid, 'message': 'still there?'}, format='json', secure=True)
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual([m['content'] for m in call.call_args[0][0]], ['hi', 'reply 1', 'still there?'])
+
+	def test_stale_session_cache_is_rebuilt(self):
+		from services import conversations
+		cid = self.client.post('/api/chat/conversations/', {}, format='json', secure=True).json()['conversation_id']
+		self.client.post('/api/chat/', {'conversation_id': cid, 'message': 'hi'}, format='json', secure=True)
+		key = conversations._state_key(self.user.id, conversations.parse_id(cid))
+		stale = conversations._state.get(key)
+		self.client.post('/api/chat/', {'conversation_id': cid, 'message': 'elsewhere'}, format='json', secure=True)
+		conversations._state.set(key, stale)  # this worker did not see the second turn
+		with mock.patch('chatbot.views.chat_complete', return_value={'content': 'ok'}) as call:
+			self.client.post('/api/chat/', {'conversation_id': cid, 'message': 'back'}, format='json', secure=True)
+		self.assertEqual([m['content'] for m in call.call_args[0][0]], ['hi', 'reply 1', 'elsewhere', 'reply 3', 'back'])
+		self.assertEqual([t['seq'] for t in self.chats.docs], [0, 1, 2])
+
+
+	@override_settings(CHAT_WRITE_BEHIND=True)
+	def test_created_conversation_is_visible_to_other_workers(self):
+		from services import conversations
+		writer = mock.Mock()
+		writer.submit.return_value = 'queued'
+		with mock.patch('services.conversations.get_writer', return_value=writer):
+			cid = self.client.post('/api/chat/conversations/', {}, format='json', secure=True).json()['conversation_id']
+			conversations._state.clear()  # the next turn lands on a worker that did not create it
+			resp = self.client.post('/api/chat/', {'conversation_id': cid, 'message': 'hi'}, format='json', secure=True)
+		self.assertEqual(resp.status_code, 200)
+		writer.flush.assert_not_called()
+
+
+	def test_async_session_turns_stay_on_the_async_mongo_layer(self):
+		from services import conversations
+		token = str(RefreshToken.for_user(self.user).access_token)
+		sync_conversations, sync_chats = mock.Mock(), mock.Mock()
+		db = {settings.MONGODB_COLLECTION_CONVERSATIONS: self.convs, settings.MONGODB_COLLECTION_CHATS: self.chats}
+		reply = mock.AsyncMock(side_effect=lambda msgs, **kw: {'content': f'reply {len(msgs)}'})
+		with mock.patch('services.mongo._async_driver', return_value=(None, None)), \
+			mock.patch('services.mongo.get_db', return_value=db), \
+			mock.patch('services.conversations.aensure_indexes', new=mock.AsyncMock()), \
+			mock.patch('services.conversations.conversations_collection', sync_conversations), \
+			mock.patch('services.conversations.chats_collection', sync_chats), \
+			mock.patch('chatbot.views.chat_complete_async', new=reply):
+			post = lambda body: self.client.post('/api/chat/async/', body, format='json', secure=True, HTTP_AUTHORIZATION=f'Bearer {token}')
+			cid = post({'message': 'hi'}).json()['conversation_id']
+			conversations._state.clear()  # rebuilt from the turn documents, awaited
+			resp = post({'conversation_id': cid, 'message': 'again'})
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual([m['content'] for m in reply.await_args[0][0]], ['hi', 'reply 1', 'again'])
+		self.assertEqual([t['seq'] for t in self.chats.docs], [0, 1])
+		sync_conversations.assert_not_called()
+		sync_chats.assert_not_called()
+
+
+class _InlineExecutor:
+	def submit(self, fn, *args):
+		fn(*args)
+
+
+@override_settings(AI_MEMORY_TRIGGER_TOKENS=40, AI_MEMORY_KEEP_TOKENS=20)
+class ConversationMemoryTests(TestCase):
+	def setUp(self):
+		patcher = mock.patch('services.memory._executor', return_value=_InlineExecutor())
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.turns = [{'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'turn {i} ' + 'word ' * 12} for i in range(8)]
+		self.prompts = []
+
+	def _summarize(self, prompt):
+		self.prompts.append(prompt)
+		return {'content': f'summary {len(self.prompts)}'}
+
+	def test_summary_replaces_older_turns_and_records_savings(self):
+		from services import memory
+		history = [{'role': 'system', 'content': 'be kind'}] + self.turns
+		self.assertTrue(memory.schedule_update('conv-a', history, self._summarize))
+		sent, info = memory.apply_memory('conv-a', history + [{'role': 'user', 'content': 'next'}])
+		self.assertTrue(info['summary_used'])
+		self.assertEqual(sent[0]['content'], 'be kind')
+		self.assertEqual(sent[1]['content'], memory.SUMMARY_PREFIX + 'summary 1')
+		self.assertEqual(sent[2:], history[1 + info['covered_messages']:] + [{'role': 'user', 'content': 'next'}])
+		self.assertGreater(info['tokens_saved'], 0)
+		memory.record_call('conv-a', info, 12.0)
+		stats = memory.memory_stats('conv-a')
+		self.assertEqual(stats['tokens_saved'], info['tokens_saved'])
+		self.assertEqual(stats['avg_latency_ms_with_summary'], 12.0)
+
+	def test_summary_is_incremental_and_ignored_for_edited_history(self):
+		from services import memory
+		memory.schedule_update('conv-b', self.turns, self._summarize)
+		longer = self.turns + [{'role': 'user', 'content': 'more ' * 30}, {'role': 'assistant', 'content': 'ok ' * 10}]
+		self.assertTrue(memory.schedule_update('conv-b', longer, self._summarize))
+		self.assertIn('summary 1', self.prompts[1][1]['content'])
+		self.assertNotIn('turn 0', self.prompts[1][1]['content'])
+		edited = [{'role': 'user', 'content': 'something else'}] + longer[1:]
+		sent, info = memory.apply_memory('conv-b', edited)
+		self.assertFalse(info['summary_used'])
+		self.assertEqual(sent, edited)
+
+	def test_short_conversations_are_not_summarized(self):
+		from services import memory
+		self.assertFalse(memory.schedule_update('conv-c', self.turns[:1], self._summarize))
+		self.assertEqual(self.prompts, [])
+
+	def test_gemini_payload_keeps_system_messages(self):
+		payload = ai._gemini_payload([{'role': 'system', 'content': 'summary'}, {'role': 'user', 'content': 'hi'}], 0.2)
+		self.assertEqual(payload['systemInstruction'], {'parts': [{'text': 'summary'}]})
+		self.assertEqual(len(payload['contents']), 1)
+
+
+class HistoryPagingTests(TestCase):
+	def setUp(self):
+		self.user = get_user_model().objects.create_user(username='pager', password='pw-12345678')
+		self.client = APIClient()
+		self.client.force_authenticate(self.user)
+		self.chats = _FakeCollection()
+		start = datetime(2026, 1, 1)
+		for i in range(5):
+			# two records share a timestamp: the _id tiebreak must keep them both
+			created = start + timedelta(minutes=min(i, 3))
+			self.chats.insert_one({'_id': ObjectId(), 'user_id': self.user.id, 'created_at': created, 'messages': [{'role': 'user', 'content': 'q'}],
+								   'response': {'content': f'a{i}', 'raw': {'big': 'payload'}}})
+		self.chats.insert_one({'_id': ObjectId(), 'user_id': self.user.id + 1, 'created_at': start, 'response': {'content': 'other'}})
+		for module in ('history', 'search'):
+			for name, value in (('chats_collection', self.chats), ('ensure_indexes', [])):
+				patcher = mock.patch(f'services.{module}.{name}', return_value=value)
+				patcher.start()
+				self.addCleanup(patcher.stop)
+
+	def test_cursor_pages_cover_history_once_without_payloads(self):
+		seen, cursor = [], None
+		while True:
+			url = '/api/chat/history/?limit=2' + (f'&cursor={cursor}' if cursor else '')
+			body = self.client.get(url, secure=True).json()
+			for item in body['results']:
+				self.assertNotIn('messages', item)
+				self.assertNotIn('raw', item['response'])
+			seen.extend(item['response']['content'] for item in body['results'])
+			cursor = body['next_cursor']
+			if not cursor:
+				break
+		self.assertEqual(seen, ['a4', 'a3', 'a2', 'a1', 'a0'])
+		self.assertTrue(body['results'][-1]['created_at'].endswith('+00:00'))
+
+	def test_export_streams_ndjson_with_date_range(self):
+		resp = self.client.get('/api/chat/export/?from=2026-01-01T00:01:00Z', secure=True)
+		self.assertEqual(resp['Content-Type'], 'application/x-ndjson')
+		lines = b''.join(resp.streaming_content).decode('utf-8').splitlines()
+		self.assertEqual([json.loads(l)['response']['content'] for l in lines], ['a1', 'a2', 'a3', 'a4'])
+		self.assertNotIn('raw', json.loads(lines[0])['response'])
+		gz = self.client.get('/api/chat/export/?gzip=1&to=2026-01-01T00:01:00', secure=True)
+		body = gzip.decompress(b''.join(gz.streaming_content)).decode('utf-8')
+		self.assertEqual([json.loads(l)['response']['content'] for l in body.splitlines()], ['a0'])
+		self.assertEqual(self.client.get('/api/chat/export/?from=yesterday', secure=True).status_code, 400)
+
+	def test_search_is_user_scoped_with_snippets_and_cursor(self):
+		from services.search import decode_cursor
+		doc = {'_id': ObjectId(), 'score': 1.5, 'created_at': datetime(2026, 1, 1), 'conversation_id': ObjectId(), 'seq': 2,
+			   'messages': [{'role': 'user', 'content': 'intro ' * 40 + 'the Kubernetes ingress question'}], 'response': {'content': 'no match here'}}
+		self.chats.aggregate = mock.Mock(return_value=[doc, dict(doc, _id=ObjectId(), score=1.0)])
+		body = self.client.get('/api/chat/search/?q=kubernetes -docker&limit=1', secure=True).json()
+		pipeline = self.chats.aggregate.call_args[0][0]
+		self.assertEqual(pipeline[0]['$match'], {'user_id': self.user.id, '$text': {'$search': 'kubernetes -docker'}})
+		self.assertEqual(len(body['results']), 1)
+		[snip] = body['results'][0]['snippets']
+		self.assertTrue(snip['text'].startswith('…'))
+		self.assertIn('Kubernetes ingress', snip['text'])
+		self.assertEqual(decode_cursor(body['next_cursor']), (1.5, doc['_id']))
+		self.client.get(f"/api/chat/search/?q=kubernetes&cursor={body['next_cursor']}", secure=True)
+		self.assertIn({'$or': [{'score': {'$lt': 1.5}}, {'score': 1.5, '_id': {'$lt': doc['_id']}}]}, [s.get('$match') for s in self.chats.aggregate.call_args[0][0]])
+		self.assertEqual(self.client.get('/api/chat/search/', secure=True).status_code, 400)
+
+	def test_async_history_pages_through_async_layer(self):
+		token = str(RefreshToken.for_user(self.user).access_token)
+		with mock.patch('services.mongo._async_driver', return_value=(None, None)), \
+			mock.patch('services.mongo.get_db', return_value={settings.MONGODB_COLLECTION_CHATS: self.chats}), \
+			mock.patch('services.history.aensure_indexes', new=mock.AsyncMock()):
+			body = self.client.get('/api/chat/history/async/?limit=3', secure=True, HTTP_AUTHORIZATION=f'Bearer {token}').json()
+			rest = self.client.get(f"/api/chat/history/async/?cursor={body['next_cursor']}", secure=True, HTTP_AUTHORIZATION=f'Bearer {token}').json()
+		self.assertEqual([i['response']['content'] for i in body['results'] + rest['results']], ['a4', 'a3', 'a2', 'a1', 'a0'])
+		self.assertNotIn('messages', body['results'][0])
+
+	def test_malformed_cursor_is_400(self):
+		resp = self.client.get('/api/chat/history/?cursor=not-a-cursor', secure=True)
+		self.assertEqual(resp.status_code, 400)
+
+	def test_string_dates_are_migrated(self):
+		from services.history import migrate_string_dates
+		coll = mock.Mock()
+		coll.find.return_value.batch_size.return_value = [{'_id': 1, 'created_at': '2026-01-01T10:00:00+02:00'}, {'_id': 2, 'created_at': 'garbage'}]
+		coll.bulk_write.return_value.modified_count = 1
+		self.assertEqual(migrate_string_dates(coll), 1)
+		op = coll.bulk_write.call_args[0][0][0]
+		self.assertEqual(op._doc['$set']['created_at'], datetime(2026, 1, 1, 8, 0))
+
+
+@override_settings(CHAT_WRITE_BEHIND=False, AI_RAW_RETENTION='compress')
+class RawPayloadTests(_ConversationFixture, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.raw = _FakeCollection()
+		patcher = mock.patch('services.raw_store.chat_raw_collection', return_value=self.raw)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def _chat(self):
+		reply = {'content': 'hi', 'raw': {'id': 'chatcmpl-1', 'choices': [{'message': {'content': 'hi'}}]}}
+		with mock.patch('chatbot.views.chat_complete', return_value=reply):
+			return self.client.post('/api/chat/', {'messages': [{'role': 'user', 'content': 'x'}]}, format='json', secure=True).json()
+
+	def test_raw_is_stored_compressed_and_loaded_on_demand(self):
+		record = self._chat()
+		self.assertNotIn('raw', record['response'])
+		self.assertTrue(record['raw_stored'])
+		self.assertNotIn('raw', self.chats.docs[0]['response'])
+		self.assertEqual(self.raw.docs[0]['codec'], 'zstd')
+		resp = self.client.get(f"/api/chat/history/{record['_id']}/raw/", secure=True)
+		self.assertEqual(resp.json()['raw']['id'], 'chatcmpl-1')
+		other = get_user_model().objects.create_user(username='other', email='other@example.com', password='pw-12345678')
+		self.client.force_authenticate(other)
+		self.assertEqual(self.client.get(f"/api/chat/history/{record['_id']}/raw/", secure=True).status_code, 404)
+
+	@override_settings(AI_RAW_RETENTION='drop')
+	def test_drop_policy_stores_nothing(self):
+		record = self._chat()
+		self.assertNotIn('raw', record['response'])
+		self.assertNotIn('raw_stored', record)
+		self.assertEqual(self.raw.docs, [])
+
+
+class MongoClientLifecycleTests(TestCase):
+	def setUp(self):
+		from services import mongo
+		self.mongo = mongo
+		patcher = mock.patch('services.mongo.MongoClient', side_effect=lambda *a, **kw: mock.Mock(options=kw))
+		self.client_cls = patcher.start()
+		self.addCleanup(patcher.stop)
+		mongo.reset_client()
+		self.addCleanup(mongo.reset_client)
+
+	@override_settings(MONGODB_MAX_POOL_SIZE=7, MONGODB_MIN_POOL_SIZE=2, MONGODB_WAIT_QUEUE_TIMEOUT_MS=500, MONGODB_COMPRESSORS='zstd,zlib')
+	def test_pool_options_come_from_settings(self):
+		options = self.mongo.get_client().options
+		self.assertEqual((options['maxPoolSize'], options['minPoolSize'], options['waitQueueTimeoutMS']), (7, 2, 500))
+		self.assertEqual(options['compressors'], 'zstd,zlib')
+
+	@override_settings(MONGODB_COMPRESSORS='zstd,zlib')
+	def test_missing_zstandard_drops_zstd_with_a_warning(self):
+		with mock.patch.dict('sys.modules', {'zstandard': None}), self.assertLogs('services.mongo', 'WARNING'):
+			self.assertEqual(self.mongo._compressors(), 'zlib')
+
+	def test_client_is_rebuilt_in_a_forked_child(self):
+		parent = self.mongo.get_client()
+		self.assertIs(self.mongo.get_client(), parent)
+		with mock.patch('services.mongo.os.getpid', return_value=os.getpid() + 1):
+			child = self.mongo.get_client()
+		self.assertIsNot(child, parent)
+		parent.close.assert_not_called()
+		self.assertEqual(self.client_cls.call_count, 2)
 
-# Create your tests here.
+	def test_pool_listener_counts_checkouts(self):
+		stats = self.mongo.PoolStats()
+		stats.connection_created(None)
+		stats.connection_checked_out(mock.Mock(duration=0.004))
+		stats.connection_checked_out(mock.Mock(duration=0.002))
+		stats.connection_checked_in(None)
+		snap = stats.snapshot()
+		self.assertEqual((snap['created'], snap['in_use'], snap['max_in_use']), (1, 1, 2))
+		self.assertEqual(snap['checkout_ms_avg'], 3.0)
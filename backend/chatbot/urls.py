@@ -1,7 +1,13 @@
 from django.urls import path
-from .views import ChatbotView, ChatHistoryView
+from .views import ChatbotView, AsyncChatbotView, AsyncChatHistoryView, ChatExportView, ChatHistoryView, ChatRawView, ChatSearchView, ConversationListView
 
 urlpatterns = [
     path('chat/', ChatbotView.as_view(), name='chatbot-chat'),
+    path('chat/async/', AsyncChatbotView.as_view(), name='chatbot-chat-async'),
     path('chat/history/', ChatHistoryView.as_view(), name='chatbot-history'),
+    path('chat/history/async/', AsyncChatHistoryView.as_view(), name='chatbot-history-async'),
+    path('chat/search/', ChatSearchView.as_view(), name='chatbot-search'),
+    path('chat/export/', ChatExportView.as_view(), name='chatbot-export'),
+    path('chat/history/<str:record_id>/raw/', ChatRawView.as_view(), name='chatbot-history-raw'),
+    path('chat/conversations/', ConversationListView.as_view(), name='chatbot-conversations'),
 ]
@@ -1,166 +1,497 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import permissions
-from services.ai import chat_complete
-from services.mongo import chats_collection
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from services.ai import chat_complete, chat_complete_async, remember_turn
+from services.context import pack_messages, prompt_budget
+from services.memory import apply_memory, memory_enabled, memory_stats
+from users.authentication import aauthorize
+from services.conversations import apersist_turn, astart_session_turn, astart_turn, create_conversation, list_conversations, persist_turn, start_session_turn, start_turn, thread
+from services.history import apage_history, buffered, export_cursor, gzip_stream, page_history, parse_time
+from services.raw_store import astore_raw, load_raw, store_raw, take_raw
+from services.search import search_chats
 from django.utils import timezone
+from datetime import datetime, timezone as dt_timezone
+import json
+import logging
 import os
+import time
+
+
+def _debug_trace(message: str):
+	"""Append a line to view-debug.log (lightweight file-based trace of the HTTP path)."""
+	try:
+		with open('view-debug.log', 'a', encoding='utf-8') as _f:
+			_f.write(message + '\n')
+	except Exception:
+		# ignore logging failures
+		pass
+
+
+def _sanitize(obj):
+	"""Ensure the record is JSON-serializable: recursively stringify unknown types."""
+	if isinstance(obj, (str, int, float, bool)) or obj is None:
+		return obj
+	if isinstance(obj, datetime):
+		# Mongo hands back naive UTC datetimes
+		return (obj if obj.tzinfo else obj.replace(tzinfo=dt_timezone.utc)).isoformat()
+	if isinstance(obj, dict):
+		return {k: _sanitize(v) for k, v in obj.items()}
+	if isinstance(obj, list):
+		return [_sanitize(v) for v in obj]
+	# fallback: stringify unknown types (ObjectId, datetimes, bytes, etc.)
+	try:
+		return str(obj)
+	except Exception:
+		return None
+
+
+def _persist_chat(record: dict, turn):
+	"""Persist a chat turn (and its conversation); Mongo errors are attached to the record instead of raised.
+	With CHAT_WRITE_BEHIND (default) the documents get their ids up front and are handed to the
+	background writer, so Mongo latency stays out of the request path. The provider's raw payload
+	never stays on the record: it is stored separately per AI_RAW_RETENTION (or dropped).
+	"""
+	raw = take_raw(record)
+	try:
+		_debug_trace(f"Before Mongo access at {timezone.now().isoformat()} SKIP_MONGO_HTTP={os.getenv('SKIP_MONGO_HTTP', 'unset')} record_keys={list(record.keys())}")
+		# Optionally skip Mongo writes for HTTP requests to isolate issues
+		if os.getenv('SKIP_MONGO_HTTP', '0') == '1':
+			_debug_trace(f"Skipping Mongo write due to SKIP_MONGO_HTTP=1 at {timezone.now().isoformat()}")
+			# indicate skipped in record and avoid DB access
+			record['mongo_error'] = 'skipped-by-SKIP_MONGO_HTTP'
+			return
+		record['_id'] = persist_turn(turn, record)
+		if store_raw(record['_id'], record.get('user_id'), raw, record.get('created_at')):
+			record['raw_stored'] = True
+		_debug_trace(f"After Mongo persist at {timezone.now().isoformat()} turn_id={record.get('_id')}")
+	except Exception as e:
+		# attach mongo error but still return the AI response
+		record['mongo_error'] = str(e)
+		logging.exception('Mongo persist error')
+
+
+async def _apersist_chat(record: dict, turn):
+	"""Async twin of _persist_chat for the async views: Mongo writes are awaited, not run in a thread."""
+	raw = take_raw(record)
+	if os.getenv('SKIP_MONGO_HTTP', '0') == '1':
+		record['mongo_error'] = 'skipped-by-SKIP_MONGO_HTTP'
+		return
+	try:
+		record['_id'] = await apersist_turn(turn, record)
+		if await astore_raw(record['_id'], record.get('user_id'), raw, record.get('created_at')):
+			record['raw_stored'] = True
+	except Exception as e:
+		record['mongo_error'] = str(e)
+		logging.exception('Mongo persist error')
+
+
+def _normalize_chat_messages(messages):
+	"""Keep well-formed {role, content} messages (the most recent AI_CONTEXT_MAX_MESSAGES)."""
+	# Hard cap on the number of messages we even look at; packing trims further by tokens
+	max_messages = int(getattr(settings, 'AI_CONTEXT_MAX_MESSAGES', 500))
+	norm_msgs = []
+	for m in (messages or [])[-max_messages:]:
+		if not isinstance(m, dict):
+			continue
+		role = m.get('role')
+		content = (m.get('content') or '')
+		if role not in ['user', 'assistant', 'system']:
+			continue
+		norm_msgs.append({'role': role, 'content': str(content)})
+	return norm_msgs
+
+
+def _parse_chat_options(data):
+	"""(provider, model, temperature) from the request body."""
+	provider = data.get('provider') or 'openai'  # openai | gemini | auto
+	model = data.get('model')
+	temperature = data.get('temperature')
+	try:
+		temperature = float(temperature) if temperature is not None else None
+	except (TypeError, ValueError):
+		temperature = None
+	return provider, model, temperature
+
+
+def _chat_input(data):
+	"""('session', [new message]) with a `message`, ('full', messages) otherwise, or (None, error body)."""
+	message = data.get('message')
+	if message is None:
+		return 'full', _normalize_chat_messages(data.get('messages'))
+	# Session mode: only the new message is sent; history comes from the server-side session
+	if isinstance(message, str):
+		message = {'role': 'user', 'content': message}
+	new_msgs = _normalize_chat_messages([message])
+	if not new_msgs:
+		return None, {'error': 'message must be a string or {role, content}'}
+	return 'session', new_msgs
+
+
+def _prepare_chat(user, data):
+	"""Normalize, place in its conversation and pack a chat request.
+	Either `messages` (full history, deduplicated against the stored conversation) or, with a
+	`conversation_id`, just the new `message` (session mode: history is rebuilt server-side).
+	Returns (record, turn, packed messages, provider, model, temperature) or (None, error body, status).
+	Messages are packed into the model's prompt budget (system prompt + most recent turns);
+	record['context'] reports how many tokens/messages were sent and dropped.
+	With `memory` (or AI_MEMORY_ENABLED), turns already folded into the conversation's rolling
+	summary are replaced by it before packing; record['memory'] reports the token savings.
+	"""
+	mode, msgs = _chat_input(data)
+	if mode is None:
+		return None, msgs, 400
+	conversation_id = data.get('conversation_id')
+	try:
+		if mode == 'session' and conversation_id:
+			turn = start_session_turn(user.id, conversation_id, msgs)
+		else:
+			turn = start_turn(user.id, conversation_id if mode == 'full' else None, msgs)
+	except Exception as e:
+		logging.exception('Conversation lookup failed')
+		return None, {'error': f'conversation store unavailable: {str(e)}'}, 503
+	return _pack_chat(user, data, turn, msgs)
+
+
+async def _aprepare_chat(user, data):
+	"""Async twin of _prepare_chat: conversation lookups are awaited on the async Mongo layer."""
+	mode, msgs = _chat_input(data)
+	if mode is None:
+		return None, msgs, 400
+	conversation_id = data.get('conversation_id')
+	try:
+		if mode == 'session' and conversation_id:
+			turn = await astart_session_turn(user.id, conversation_id, msgs)
+		else:
+			turn = await astart_turn(user.id, conversation_id if mode == 'full' else None, msgs)
+	except Exception as e:
+		logging.exception('Conversation lookup failed')
+		return None, {'error': f'conversation store unavailable: {str(e)}'}, 503
+	return _pack_chat(user, data, turn, msgs)
+
+
+def _pack_chat(user, data, turn, msgs):
+	"""The prepared-chat tuple for a placed turn (see _prepare_chat)."""
+	if turn is None:
+		return None, {'error': 'conversation not found'}, 404
+	provider, model, temperature = _parse_chat_options(data)
+	norm_msgs = turn.context_messages() if turn.history is not None else msgs
+	sent = norm_msgs
+	if memory_enabled(_optional_flag(data.get('memory'))):
+		key = str(turn.conversation_id)
+		sent, info = apply_memory(key, norm_msgs)
+		turn.memory = (key, norm_msgs, info)
+	packed, context = pack_messages(sent, prompt_budget(provider, model))
+	record = _new_record(user, packed, provider, context)
+	record['conversation_id'] = str(turn.conversation_id)
+	if turn.memory is not None:
+		record['memory'] = turn.memory[2]
+	return record, turn, packed, provider, model, temperature
+
+
+def _remember(record, turn, provider, model, started):
+	"""Record the memory savings for this turn and queue a summary refresh if the conversation grew past the trigger."""
+	if turn.memory is None:
+		return
+	key, full, info = turn.memory
+	try:
+		remember_turn(key, full, record.get('response'), info, (time.monotonic() - started) * 1000, provider, model)
+		record['memory'] = dict(info, conversation=memory_stats(key))
+	except Exception:
+		logging.exception('Conversation memory update failed')
+
+
+def _optional_flag(value):
+	"""Tri-state request flag: None when absent, else a bool."""
+	if value is None:
+		return None
+	return value is True or str(value).lower() in ('1', 'true', 'yes')
+
+
+def _new_record(user, norm_msgs, provider, context=None):
+	record = {
+		'user_id': user.id,
+		'username': user.username,
+		'messages': norm_msgs,
+		'provider': provider or 'auto',
+		'response': None,
+		'created_at': timezone.now(),
+	}
+	if context is not None:
+		record['context'] = context
+	return record
+
+
+def _sse(event: dict) -> str:
+	return f"data: {json.dumps(_sanitize(event))}\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+	"""Lets clients negotiate `Accept: text/event-stream`; plain responses are sent as a single event."""
+	media_type = 'text/event-stream'
+	format = 'sse'
+	charset = 'utf-8'
+
+	def render(self, data, accepted_media_type=None, renderer_context=None):
+		return _sse(data if isinstance(data, dict) else {'data': data}).encode('utf-8')
+
+
+def _wants_stream(request) -> bool:
+	return bool(_optional_flag(request.data.get('stream', request.GET.get('stream'))))
 
 
 class ChatbotView(APIView):
 	# Temporarily allow any for debugging; revert to IsAuthenticated after diagnosis
 	permission_classes = [permissions.IsAuthenticated]
+	renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, EventStreamRenderer]
 
 	def post(self, request):
 		# Top-level guard: catch any unexpected exception and return a diagnostic JSON
 		try:
-			# lightweight file-based trace for debugging HTTP path
-			try:
-				with open('view-debug.log', 'a', encoding='utf-8') as _f:
-					_f.write(f"Entered ChatbotView.post at {timezone.now().isoformat()} user={getattr(request.user, 'username', None)}\n")
-			except Exception:
-				# ignore logging failures
-				pass
+			_debug_trace(f"Entered ChatbotView.post at {timezone.now().isoformat()} user={getattr(request.user, 'username', None)}")
 			user = request.user
 			messages = request.data.get('messages') or []
 			if not isinstance(messages, list):
 				return Response({'error': 'messages must be a list'}, status=400)
-			# Basic normalization & caps to avoid oversized payloads
-			norm_msgs = []
-			for m in messages[:20]:  # cap to last 20 messages
-				if not isinstance(m, dict):
-					continue
-				role = m.get('role')
-				content = (m.get('content') or '')
-				if role not in ['user', 'assistant', 'system']:
-					continue
-				norm_msgs.append({'role': role, 'content': str(content)[:8000]})
-			provider = request.data.get('provider') or 'openai'  # openai | gemini | auto
-			model = request.data.get('model')
-			temperature = request.data.get('temperature')
-			try:
-				temperature = float(temperature) if temperature is not None else None
-			except (TypeError, ValueError):
-				temperature = None
+			prepared = _prepare_chat(user, request.data)
+			if prepared[0] is None:
+				return Response(prepared[1], status=prepared[2])
+			record, turn, norm_msgs, provider, model, temperature = prepared
+			if _wants_stream(request):
+				events = self._stream(record, turn, norm_msgs, model, temperature, provider)
+				resp = StreamingHttpResponse(events, content_type='text/event-stream')
+				resp['Cache-Control'] = 'no-cache'
+				resp['X-Accel-Buffering'] = 'no'  # disable proxy buffering (nginx) so deltas flush immediately
+				return resp
 			# Call AI service with defensive error handling so a provider failure doesn't 500
 			ai_response = None
+			started = time.monotonic()
 			try:
-				ai_response = chat_complete(norm_msgs, model=model, temperature=temperature, provider=provider)
+				ai_response = chat_complete(norm_msgs, model=model, temperature=temperature, provider=provider, cache=_optional_flag(request.data.get('cache')), hedge=_optional_flag(request.data.get('hedge')))
 			except Exception as e:
 				# Log and return a helpful error blob instead of crashing
-				import traceback, logging
+				import traceback
 				logging.exception('AI provider error')
 				ai_response = {'error': f'AI provider error: {str(e)}', 'trace': traceback.format_exc()}
-			# Prepare record and attempt to persist chat; handle Mongo errors gracefully
-			record = {
-				'user_id': user.id,
-				'username': user.username,
-				'messages': norm_msgs,
-				'provider': provider or 'auto',
-				'response': ai_response,
-				'created_at': timezone.now().isoformat(),
-			}
-			try:
-				# mark before Mongo access
-				try:
-					with open('view-debug.log', 'a', encoding='utf-8') as _f:
-						_f.write(f"Before Mongo access at {timezone.now().isoformat()}\n")
-				except Exception:
-					pass
-				# immediate checkpoint after before-mongo
-				try:
-					with open('view-debug.log', 'a', encoding='utf-8') as _f:
-						_f.write("checkpoint_after_before_mongo\n")
-				except Exception:
-					pass
-				# Optionally skip Mongo writes for HTTP requests to isolate issues
-				# Debug: log SKIP_MONGO_HTTP and record snapshot
-				try:
-					with open('view-debug.log', 'a', encoding='utf-8') as _f:
-						_f.write(f"SKIP_MONGO_HTTP={os.getenv('SKIP_MONGO_HTTP', 'unset')} record_keys={list(record.keys())}\n")
-				except Exception:
-					pass
-				if os.getenv('SKIP_MONGO_HTTP', '1') == '1':
-					try:
-						with open('view-debug.log', 'a', encoding='utf-8') as _f:
-							_f.write(f"Skipping Mongo write due to SKIP_MONGO_HTTP=1 at {timezone.now().isoformat()}\n")
-					except Exception:
-						pass
-					# indicate skipped in record and avoid DB access
-					record['mongo_error'] = 'skipped-by-SKIP_MONGO_HTTP'
-				else:
-					coll = chats_collection()
-					try:
-						r = coll.insert_one(record)
-						# attach inserted id as string to avoid ObjectId serialization errors
-						try:
-							record['_id'] = str(r.inserted_id)
-						except Exception:
-							pass
-						# post-insert debug mark
-						try:
-							with open('view-debug.log', 'a', encoding='utf-8') as _f:
-								_f.write(f"After Mongo insert at {timezone.now().isoformat()} inserted_id={record.get('_id')}\n")
-						except Exception:
-							pass
-					except Exception as e:
-						# attach mongo error but still return the AI response
-						record['mongo_error'] = str(e)
-						import logging
-						logging.exception('Mongo insert error')
-			except Exception as e:
-				# If obtaining the collection fails (bad URI, auth), don't 500
-				record['mongo_error'] = f'Failed to access chats collection: {str(e)}'
-				import logging
-				logging.exception('Mongo access error')
-			# Ensure the record is JSON-serializable: recursively stringify unknown types
-			def _sanitize(obj):
-				if isinstance(obj, (str, int, float, bool)) or obj is None:
-					return obj
-				if isinstance(obj, dict):
-					return {k: _sanitize(v) for k, v in obj.items()}
-				if isinstance(obj, list):
-					return [_sanitize(v) for v in obj]
-				# fallback: stringify unknown types (ObjectId, datetimes, bytes, etc.)
-				try:
-					return str(obj)
-				except Exception:
-					return None
+			record['response'] = ai_response
+			_remember(record, turn, provider, model, started)
+			_persist_chat(record, turn)
 			safe_record = _sanitize(record)
 			try:
 				return Response(safe_record)
 			except Exception as e:
-				try:
-					with open('view-debug.log', 'a', encoding='utf-8') as _f:
-						_f.write(f"Response serialization failed at {timezone.now().isoformat()}: {str(e)}\n")
-				except Exception:
-					pass
+				_debug_trace(f"Response serialization failed at {timezone.now().isoformat()}: {str(e)}")
 				return Response({'error': 'serialization_failed', 'detail': str(e)}, status=500)
 		except Exception as e:
 			# Catch any unexpected/unhandled exception and return trace to client for diagnostics
-			import traceback, logging
+			import traceback
 			logging.exception('Unhandled exception in ChatbotView.post')
 			return Response({'error': 'unhandled_exception', 'detail': str(e), 'trace': traceback.format_exc()}, status=500)
 
+	def _stream(self, record, turn, norm_msgs, model, temperature, provider):
+		"""Server-sent events: one `delta` event per chunk, then a `done` event carrying the persisted record.
+		The assembled response is persisted once the provider stream closes (or the client disconnects).
+		"""
+		parts = []
+		response = None
+		started = time.monotonic()
+		try:
+			for event in chat_complete(norm_msgs, model=model, temperature=temperature, provider=provider, stream=True):
+				kind = event.get('type')
+				if kind == 'delta':
+					parts.append(event.get('content') or '')
+				elif kind == 'done':
+					response = event.get('response')
+					continue
+				elif kind == 'error':
+					response = {k: v for k, v in event.items() if k != 'type'}
+				yield _sse(event)
+		except GeneratorExit:
+			record['response'] = response or {'error': 'client disconnected', 'content': ''.join(parts)}
+			_persist_chat(record, turn)
+			raise
+		except Exception as e:
+			logging.exception('AI provider stream error')
+			response = {'error': f'AI provider error: {str(e)}', 'content': ''.join(parts)}
+			yield _sse({'type': 'error', 'error': response['error']})
+		record['response'] = response or {'error': 'empty stream', 'content': ''.join(parts)}
+		_remember(record, turn, provider, model, started)
+		_persist_chat(record, turn)
+		yield _sse({'type': 'done', 'record': record})
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncChatbotView(View):
+	"""Async twin of ChatbotView for ASGI deployments.
+	The provider call is awaited on the shared httpx.AsyncClient, so one worker can hold many
+	in-flight completions instead of parking a thread per request. Buffered responses only.
+	"""
+	http_method_names = ['post', 'options']
+
+	async def post(self, request):
+		user, error = await aauthorize(request)
+		if error:
+			return error
+		try:
+			data = json.loads(request.body or b'{}')
+		except ValueError:
+			return JsonResponse({'error': 'invalid JSON body'}, status=400)
+		if not isinstance(data, dict) or not isinstance(data.get('messages') or [], list):
+			return JsonResponse({'error': 'messages must be a list'}, status=400)
+		prepared = await _aprepare_chat(user, data)
+		if prepared[0] is None:
+			return JsonResponse(prepared[1], status=prepared[2])
+		record, turn, norm_msgs, provider, model, temperature = prepared
+		started = time.monotonic()
+		try:
+			record['response'] = await chat_complete_async(norm_msgs, model=model, temperature=temperature, provider=provider, cache=_optional_flag(data.get('cache')), hedge=_optional_flag(data.get('hedge')))
+		except Exception as e:
+			logging.exception('AI provider error')
+			record['response'] = {'error': f'AI provider error: {str(e)}'}
+		_remember(record, turn, provider, model, started)
+		await _apersist_chat(record, turn)
+		return JsonResponse(_sanitize(record))
+
+
+def _history_limit(request) -> int:
+	try:
+		limit = int(request.GET.get('limit', 50))
+	except ValueError:
+		limit = 50
+	return max(1, min(limit, 200))
+
 
 class ChatHistoryView(APIView):
+	"""GET: the user's chat records, newest first, without prompts or raw provider payloads.
+	Page with `?cursor=<next_cursor>`; `?conversation_id=` returns one rebuilt thread instead.
+	"""
 	permission_classes = [permissions.IsAuthenticated]
 
 	def get(self, request):
-		coll = chats_collection()
+		conversation_id = request.GET.get('conversation_id')
+		if conversation_id:
+			# Thread view: the conversation rebuilt from its per-turn documents
+			data = thread(request.user.id, conversation_id)
+			if data is None:
+				return Response({'detail': 'Not found'}, status=404)
+			return Response(_sanitize(data))
+		limit = _history_limit(request)
+		before = request.GET.get('before')
 		try:
-			limit = int(request.GET.get('limit', 50))
-		except ValueError:
-			limit = 50
-		limit = max(1, min(limit, 200))
-		query = {'user_id': request.user.id}
+			items, next_cursor = page_history(request.user.id, limit=limit, cursor=request.GET.get('cursor'), before=before)
+		except ValueError as e:
+			return Response({'error': str(e)}, status=400)
+		return Response({'results': _sanitize(items), 'count': len(items), 'limit': limit, 'before': before, 'next_cursor': next_cursor})
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncChatHistoryView(View):
+	"""Async twin of ChatHistoryView's list mode: the page query is awaited on the async Mongo driver."""
+	http_method_names = ['get', 'options']
+
+	async def get(self, request):
+		user, error = await aauthorize(request)
+		if error:
+			return error
+		limit = _history_limit(request)
 		before = request.GET.get('before')
-		if before:
-			# 'created_at' stored as ISO-8601 string; lexical order matches chronological
-			query['created_at'] = {'$lt': before}
-		cursor = coll.find(query).sort('created_at', -1).limit(limit)
-		items = []
-		for c in cursor:
-			c['_id'] = str(c.get('_id'))
-			items.append({k: c[k] for k in c if k not in ['raw']})  # omit raw provider payload
-		return Response({'results': items, 'count': len(items), 'limit': limit, 'before': before})
+		try:
+			items, next_cursor = await apage_history(user.id, limit=limit, cursor=request.GET.get('cursor'), before=before)
+		except ValueError as e:
+			return JsonResponse({'error': str(e)}, status=400)
+		return JsonResponse({'results': _sanitize(items), 'count': len(items), 'limit': limit, 'before': before, 'next_cursor': next_cursor})
+
+
+class ChatSearchView(APIView):
+	"""GET ?q=: full-text search over the user's chat records, best match first, with snippets.
+	Page with `?cursor=<next_cursor>`. Supports Mongo text syntax ("exact phrase", -exclude).
+	"""
+	permission_classes = [permissions.IsAuthenticated]
+
+	def get(self, request):
+		q = (request.GET.get('q') or '').strip()
+		if not q:
+			return Response({'error': 'q is required'}, status=400)
+		limit = max(1, min(_history_limit(request), 50))
+		try:
+			results, next_cursor = search_chats(request.user.id, q[:256], limit=limit, cursor=request.GET.get('cursor'))
+		except ValueError as e:
+			return Response({'error': str(e)}, status=400)
+		except Exception as e:
+			logging.exception('Chat search failed')
+			return Response({'error': f'search unavailable: {str(e)}'}, status=503)
+		return Response({'results': _sanitize(results), 'count': len(results), 'q': q, 'next_cursor': next_cursor})
+
+
+class ChatExportView(APIView):
+	"""GET: the user's whole chat history as NDJSON (one record per line, oldest first), streamed
+	straight from a Mongo cursor so memory stays flat however long the history is.
+	`?from=`/`?to=` (ISO timestamps, inclusive/exclusive) limit the range; `?gzip=1` compresses.
+	"""
+	permission_classes = [permissions.IsAuthenticated]
+
+	def get(self, request):
+		try:
+			start = parse_time(request.GET['from']) if request.GET.get('from') else None
+			end = parse_time(request.GET['to']) if request.GET.get('to') else None
+		except ValueError:
+			return Response({'error': 'from/to must be ISO-8601 timestamps'}, status=400)
+		batch_size = int(getattr(settings, 'CHAT_EXPORT_BATCH_SIZE', 500))
+		cursor = export_cursor(request.user.id, start, end, batch_size=batch_size)
+		chunks = buffered((json.dumps(_sanitize(doc), ensure_ascii=False) + '\n').encode('utf-8') for doc in cursor)
+		filename = f'chats-{request.user.id}.ndjson'
+		if _optional_flag(request.GET.get('gzip')):
+			resp = StreamingHttpResponse(gzip_stream(chunks), content_type='application/gzip')
+			filename += '.gz'
+		else:
+			resp = StreamingHttpResponse(chunks, content_type='application/x-ndjson')
+		resp['Content-Disposition'] = f'attachment; filename="{filename}"'
+		resp['X-Accel-Buffering'] = 'no'
+		return resp
+
+
+class ChatRawView(APIView):
+	"""GET: the provider's raw payload for one of the user's chat records, if it was retained."""
+	permission_classes = [permissions.IsAuthenticated]
+
+	def get(self, request, record_id):
+		try:
+			raw = load_raw(request.user.id, record_id)
+		except Exception as e:
+			logging.exception('Raw payload load failed')
+			return Response({'error': f'raw payload unavailable: {str(e)}'}, status=503)
+		if raw is None:
+			return Response({'detail': 'Not found'}, status=404)
+		return Response({'_id': record_id, 'raw': _sanitize(raw)})
+
+
+class ConversationListView(APIView):
+	"""GET: the user's conversations, most recently active first (`?cursor=<next_cursor>` pages back).
+	POST: create one (optional `title`, `system` prompt).
+	"""
+	permission_classes = [permissions.IsAuthenticated]
+
+	def get(self, request):
+		limit = _history_limit(request)
+		try:
+			items, next_cursor = list_conversations(request.user.id, limit=limit, cursor=request.GET.get('cursor'))
+		except ValueError as e:
+			return Response({'error': str(e)}, status=400)
+		return Response({'results': _sanitize(items), 'count': len(items), 'limit': limit, 'next_cursor': next_cursor})
+
+	def post(self, request):
+		"""Start a conversation for session-mode chat: then POST /api/chat/ with {conversation_id, message}."""
+		title = str(request.data.get('title') or '')
+		system = str(request.data.get('system') or '')
+		try:
+			cid = create_conversation(request.user.id, title=title, system=system, created_at=timezone.now())
+		except Exception as e:
+			logging.exception('Conversation create failed')
+			return Response({'error': f'conversation store unavailable: {str(e)}'}, status=503)
+		return Response({'conversation_id': cid, 'title': title, 'system': system}, status=201)
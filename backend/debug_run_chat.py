@@ -30,7 +30,7 @@ def run_test():
         'messages': messages,
         'provider': resp.get('provider') if isinstance(resp, dict) else 'unknown',
         'response': resp,
-        'created_at': timezone.now().isoformat(),
+        'created_at': timezone.now(),
     }
     try:
         coll = chats_collection()
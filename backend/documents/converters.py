@@ -0,0 +1,220 @@
+"""Streaming input side of ``convert_document``.
+
+Uploads are never read into one bytes object. Django spools anything larger than
+``FILE_UPLOAD_MAX_MEMORY_SIZE`` to a temp file, and this module reads it back in
+``CONVERT_CHUNK_SIZE`` pieces:
+
+- ``sniff_encoding`` runs an incremental UTF-8 decoder over the file and keeps none of the
+  output. It answers 'latin-1' at the first invalid byte, so a file is never half-decoded one
+  way and half the other.
+- ``iter_text`` decodes chunk by chunk with that encoding; ``iter_text_lines`` splits the
+  decoded stream into lines, carrying partial lines across chunk boundaries. Only each new
+  chunk is split, and a line longer than ``CONVERT_MAX_LINE_CHARS`` is emitted in pieces of
+  that size, so a file without newlines is not accumulated in memory.
+- ``iter_blocks`` groups lines into blank-line separated blocks, keeping only each block's
+  first ``title_chars`` characters.
+
+Output writers consume these iterators directly. ``convert_stream`` yields txt/json/pdf output
+as it is produced, and ``convert_to`` writes any target format to a file. Uploads over
+``CONVERT_MAX_UPLOAD_BYTES`` are rejected with a 413 before anything is decoded.
+"""
+import codecs
+import itertools
+import json
+import logging
+import tempfile
+from typing import BinaryIO, Iterable, Iterator, List, Optional
+
+from django.conf import settings
+
+from .pdfstream import stream_pdf
+from .renderers import write_docx, write_pptx
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('txt', 'json', 'pdf', 'docx', 'pptx')
+STREAMED = ('txt', 'json', 'pdf')  # written incrementally; docx/pptx libraries build the whole file
+PPTX_TITLE_CHARS = 200
+
+
+def max_upload_bytes() -> int:
+	return int(getattr(settings, 'CONVERT_MAX_UPLOAD_BYTES', 50 * 1024 * 1024))
+
+
+def chunk_size() -> int:
+	return int(getattr(settings, 'CONVERT_CHUNK_SIZE', 64 * 1024))
+
+
+def max_line_chars() -> int:
+	return int(getattr(settings, 'CONVERT_MAX_LINE_CHARS', 64 * 1024))
+
+
+def _chunks(f: BinaryIO) -> Iterator[bytes]:
+	f.seek(0)
+	size = chunk_size()
+	while True:
+		chunk = f.read(size)
+		if not chunk:
+			return
+		yield chunk
+
+
+def sniff_encoding(f: BinaryIO) -> str:
+	"""'utf-8' if the whole file is valid UTF-8, else 'latin-1' (which decodes any byte)."""
+	decoder = codecs.getincrementaldecoder('utf-8')('strict')
+	try:
+		for chunk in _chunks(f):
+			decoder.decode(chunk)
+		decoder.decode(b'', final=True)
+	except UnicodeDecodeError:
+		return 'latin-1'
+	return 'utf-8'
+
+
+def iter_text(f: BinaryIO, encoding: Optional[str] = None) -> Iterator[str]:
+	"""Decoded text of `f` in chunks, sniffing the encoding first when none is given."""
+	decoder = codecs.getincrementaldecoder(encoding or sniff_encoding(f))('strict')
+	for chunk in _chunks(f):
+		text = decoder.decode(chunk)
+		if text:
+			yield text
+	tail = decoder.decode(b'', final=True)
+	if tail:
+		yield tail
+
+
+def _cut(line: str, limit: int) -> Iterator[str]:
+	if len(line) <= limit:
+		yield line
+		return
+	for i in range(0, len(line), limit):
+		yield line[i:i + limit]
+
+
+def iter_text_lines(chunks: Iterable[str], max_chars: Optional[int] = None) -> Iterator[str]:
+	"""Lines (without line endings) of a chunked text stream, like str.splitlines() for \\n and \\r\\n.
+	Lines longer than `max_chars` (default CONVERT_MAX_LINE_CHARS) come out in pieces of that length.
+	"""
+	limit = max(1, max_chars or max_line_chars())
+	head: List[str] = []  # the current unfinished line, as received
+	size = 0
+	for chunk in chunks:
+		parts = chunk.split('\n')
+		if len(parts) > 1:
+			head.append(parts[0])
+			yield from _cut(''.join(head).rstrip('\r'), limit)
+			for line in parts[1:-1]:
+				yield from _cut(line.rstrip('\r'), limit)
+			head, size = [parts[-1]], len(parts[-1])
+		else:
+			head.append(chunk)
+			size += len(chunk)
+		if size > limit:
+			partial = ''.join(head)
+			while len(partial) > limit:
+				yield partial[:limit]
+				partial = partial[limit:]
+			head, size = [partial], len(partial)
+	tail = ''.join(head)
+	if tail:
+		yield from _cut(tail.rstrip('\r'), limit)
+
+
+def iter_blocks(lines: Iterable[str], title_chars: int) -> Iterator[str]:
+	"""Blank-line separated blocks, each cut to its first `title_chars` characters.
+	An input with no text still gives one (empty) block.
+	"""
+	head, length, emitted = [], 0, False
+	for line in lines:
+		if not line.strip():
+			if head:
+				yield '\n'.join(head)[:title_chars]
+				head, length, emitted = [], 0, True
+			continue
+		if length < title_chars:
+			head.append(line[:title_chars - length])
+		length += len(line) + 1
+	if head or not emitted:
+		yield '\n'.join(head)[:title_chars]
+
+
+def docx_lines(f: BinaryIO) -> Iterator[str]:
+	"""Text of a .docx upload: non-empty paragraphs separated by blank lines."""
+	import docx as _docx
+	f.seek(0)
+	first = True
+	for p in _docx.Document(f).paragraphs:
+		if p.text:
+			if not first:
+				yield ''
+			yield p.text
+			first = False
+
+
+def json_stream(chunks: Iterable[str], **fields) -> Iterator[bytes]:
+	"""A JSON object with `fields` plus a "content" string built from text chunks, emitted incrementally."""
+	head = json.dumps(fields)[:-1]
+	yield (head + (', ' if fields else '') + '"content": "').encode('utf-8')
+	for chunk in chunks:
+		yield json.dumps(chunk)[1:-1].encode('utf-8')
+	yield b'"}'
+
+
+def spool(chunks: Iterable[bytes]):
+	"""Write chunks to an anonymous temp file and return it rewound (the caller closes it)."""
+	f = tempfile.TemporaryFile()
+	try:
+		for chunk in chunks:
+			f.write(chunk)
+		f.seek(0)
+	except BaseException:
+		f.close()
+		raise
+	return f
+
+
+def source_lines(f: BinaryIO, filename: str) -> Iterator[str]:
+	"""Lines of an upload: extracted paragraphs for a .docx with text, decoded text otherwise."""
+	if filename.lower().endswith('.docx'):
+		lines = docx_lines(f)
+		try:
+			first = next(lines, None)
+		except Exception:
+			logger.exception('DOCX text extraction failed; using raw bytes')
+			first = None
+		if first is not None:
+			return itertools.chain([first], lines)
+	return iter_text_lines(iter_text(f))
+
+
+def source_text(f: BinaryIO, filename: str) -> Iterator[str]:
+	"""Decoded text of an upload in chunks (docx: its extracted paragraphs)."""
+	if not filename.lower().endswith('.docx'):
+		return iter_text(f)
+	return (line if i == 0 else '\n' + line for i, line in enumerate(source_lines(f, filename)))
+
+
+def convert_stream(f: BinaryIO, filename: str, target: str) -> Iterator[bytes]:
+	"""Output for a streamed target (txt, json, pdf), chunk by chunk."""
+	if target == 'txt':
+		return (chunk.encode('utf-8') for chunk in source_text(f, filename))
+	if target == 'json':
+		return json_stream(source_text(f, filename), filename=filename)
+	if target == 'pdf':
+		return stream_pdf(source_lines(f, filename))
+	raise ValueError(f'{target} output is not streamed')
+
+
+def convert_to(f: BinaryIO, filename: str, target: str, out: BinaryIO):
+	"""Write the upload converted to `target` into the binary file `out`.
+	Raises RendererUnavailable when the library for docx/pptx is missing.
+	"""
+	if target in STREAMED:
+		for chunk in convert_stream(f, filename, target):
+			out.write(chunk)
+	elif target == 'docx':
+		write_docx(source_lines(f, filename), out)
+	elif target == 'pptx':
+		write_pptx(iter_blocks(source_lines(f, filename), PPTX_TITLE_CHARS), out, PPTX_TITLE_CHARS)
+	else:
+		raise ValueError(f'Unsupported target format: {target}')
@@ -0,0 +1,221 @@
+"""Process-pool conversion engine behind the conversion job API.
+
+Conversions are CPU-bound pure Python (layout, PDF writing, python-docx/pptx), so running them
+on request threads serializes them on the GIL and ties up web workers. A job's upload is saved
+under ``MEDIA_ROOT/conversion-jobs/``. Then ``run_conversion`` (source path in, output path out,
+no ORM) is submitted to a ``ProcessPoolExecutor`` with ``CONVERT_WORKERS`` processes, one per
+core by default. When the child finishes, a done-callback in the web process stores the output
+as a ConvertedFile and marks the job done or failed.
+
+Workers are started with ``CONVERT_START_METHOD`` ('spawn' by default: a fresh interpreter never
+inherits the web process's threads, sockets or Mongo client). Each web process has its own pool;
+with several web workers, set ``CONVERT_WORKERS`` to cores / web workers. If a child dies (e.g.
+OOM-killed), the executor is broken for good; the next submit replaces it.
+
+A submitted job records its owner (``claimed_by``, host:pid) and a ``heartbeat_at`` that the
+owning process refreshes every ``CONVERT_HEARTBEAT_INTERVAL`` seconds while the job is on its pool.
+Any web worker answering a status poll reports the job failed once that heartbeat is older than
+``CONVERT_JOB_TIMEOUT`` (e.g. its web process restarted). Jobs only leave 'queued' through a
+conditional update, so a late result cannot overwrite an expiry, nor an expiry a fresh heartbeat.
+"""
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from typing import Dict, Optional, Set
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_pid: Optional[int] = None
+_lock = threading.Lock()
+_stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'in_flight': 0}
+_running: Set[int] = set()  # ids of the jobs this process has on its pool (heartbeated)
+_heartbeat_pid: Optional[int] = None
+
+
+def _init_worker():
+	# spawn/forkserver children start without Django configured; the settings module comes from the environment
+	import django
+	from django.apps import apps
+	if not apps.ready:
+		django.setup()
+
+
+def run_conversion(src_path: str, filename: str, target: str, out_path: str) -> int:
+	"""Runs in a worker process: convert the file at `src_path` into `out_path`; returns bytes written."""
+	from documents.converters import convert_to
+	with open(src_path, 'rb') as src, open(out_path, 'wb') as out:
+		convert_to(src, filename, target, out)
+		return out.tell()
+
+
+def pool_size() -> int:
+	return int(getattr(settings, 'CONVERT_WORKERS', 0) or os.cpu_count() or 1)
+
+
+def _executor() -> ProcessPoolExecutor:
+	global _pool, _pool_pid
+	if _pool is None or _pool_pid != os.getpid():
+		with _lock:
+			if _pool is None or _pool_pid != os.getpid():
+				ctx = multiprocessing.get_context(getattr(settings, 'CONVERT_START_METHOD', 'spawn'))
+				_pool = ProcessPoolExecutor(max_workers=pool_size(), mp_context=ctx, initializer=_init_worker)
+				_pool_pid = os.getpid()
+	return _pool
+
+
+def _discard(pool: ProcessPoolExecutor):
+	"""Drop a broken pool (a worker died, e.g. OOM-killed) so the next _executor() builds a fresh one."""
+	global _pool
+	with _lock:
+		if _pool is pool:
+			_pool = None
+	pool.shutdown(wait=False, cancel_futures=True)
+
+
+def owner_id() -> str:
+	return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _beat():
+	"""Refresh heartbeat_at of the queued jobs on this process's pool."""
+	from .models import ConversionJob
+	with _lock:
+		ids = list(_running)
+	if ids:
+		ConversionJob.objects.filter(pk__in=ids, status='queued').update(heartbeat_at=timezone.now())
+
+
+def _heartbeat_loop():
+	interval = float(getattr(settings, 'CONVERT_HEARTBEAT_INTERVAL', 30))
+	while True:
+		time.sleep(interval)
+		close_old_connections()
+		try:
+			_beat()
+		except Exception:
+			logger.exception('Could not refresh conversion job heartbeats')
+		finally:
+			close_old_connections()
+
+
+def _ensure_heartbeat():
+	global _heartbeat_pid
+	with _lock:
+		if _heartbeat_pid == os.getpid():
+			return
+		_heartbeat_pid = os.getpid()
+	threading.Thread(target=_heartbeat_loop, name='convert-heartbeat', daemon=True).start()
+
+
+def _output_path(job) -> str:
+	root = os.path.join(settings.MEDIA_ROOT, 'conversion-jobs', 'out')
+	os.makedirs(root, exist_ok=True)
+	return os.path.join(root, f'{job.pk}.{job.target_format}')
+
+
+def submit(job):
+	"""Queue a saved ConversionJob (its `source` already stored) on the process pool and claim it for this process."""
+	from .models import ConversionJob
+	ConversionJob.objects.filter(pk=job.pk, status='queued').update(claimed_by=owner_id(), heartbeat_at=timezone.now())
+	out_path = _output_path(job)
+	args = (run_conversion, job.source.path, job.original_name, job.target_format, out_path)
+	pool = _executor()
+	try:
+		future = pool.submit(*args)
+	except BrokenProcessPool:
+		logger.warning('Conversion pool is broken; starting a new one')
+		_discard(pool)
+		future = _executor().submit(*args)
+	# Counted only once the pool has the job; a failed submit raises to the caller with nothing in flight
+	with _lock:
+		_stats['submitted'] += 1
+		_stats['in_flight'] += 1
+		_running.add(job.pk)
+	_ensure_heartbeat()
+	future.add_done_callback(lambda f: _finish(job.pk, out_path, f))
+	return future
+
+
+def _finish(job_id: int, out_path: str, future: Future):
+	"""Done-callback (a pool thread in the web process): store the output and settle the job.
+	A job that was expired meanwhile stays failed; its output is thrown away.
+	"""
+	from .models import ConversionJob, ConvertedFile
+	close_old_connections()
+	try:
+		job = ConversionJob.objects.get(pk=job_id)
+		error = future.exception()
+		stored = None
+		fields = {'finished_at': timezone.now(), 'source': ''}
+		if error is None:
+			stored = ConvertedFile.objects.create(owner_id=job.owner_id, original_name=job.original_name, target_format=job.target_format, meta={'retention_hours': 24, 'job_id': job.pk})
+			with open(out_path, 'rb') as f:
+				stored.file.save(f'converted-{stored.pk}.{job.target_format}', File(f), save=True)
+			fields.update(status='done', result=stored)
+		else:
+			logger.warning('Conversion job %s failed: %r', job_id, error)
+			fields.update(status='failed', error=f'{type(error).__name__}: {error}')
+		if job.source:
+			job.source.delete(save=False)
+		settled = ConversionJob.objects.filter(pk=job_id, status='queued').update(**fields)
+		if not settled:
+			logger.warning('Conversion job %s finished after it was expired; discarding its output', job_id)
+			ConversionJob.objects.filter(pk=job_id).update(source='')
+			if stored is not None:
+				stored.file.delete(save=False)
+				stored.delete()
+		with _lock:
+			_stats['completed' if settled and error is None else 'failed'] += 1
+	except Exception:
+		logger.exception('Could not record the result of conversion job %s', job_id)
+		with _lock:
+			_stats['failed'] += 1
+	finally:
+		with _lock:
+			_stats['in_flight'] -= 1
+			_running.discard(job_id)
+		try:
+			os.unlink(out_path)
+		except OSError:
+			pass
+		close_old_connections()
+
+
+def expire_stale(job) -> bool:
+	"""Fail a queued job whose owner has not heartbeated for CONVERT_JOB_TIMEOUT seconds (a job
+	never claimed counts from its creation); True if it was expired. Ownership lives in the
+	database, so it does not matter which web process answers the poll.
+	"""
+	from .models import ConversionJob
+	cutoff = timezone.now() - timedelta(seconds=float(getattr(settings, 'CONVERT_JOB_TIMEOUT', 600)))
+	if job.status != 'queued' or (job.heartbeat_at or job.created_at) >= cutoff:
+		return False
+	stale = Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, created_at__lt=cutoff)
+	now = timezone.now()
+	if not ConversionJob.objects.filter(stale, pk=job.pk, status='queued').update(status='failed', error='timed out', finished_at=now):
+		job.refresh_from_db()  # settled or heartbeated in the meantime
+		return False
+	logger.warning('Conversion job %s expired (owner %s stopped heartbeating)', job.pk, job.claimed_by or 'unknown')
+	if job.source:
+		job.source.delete(save=False)
+		ConversionJob.objects.filter(pk=job.pk).update(source='')
+	job.status, job.error, job.finished_at = 'failed', 'timed out', now
+	return True
+
+
+def engine_stats() -> Dict:
+	with _lock:
+		return dict(_stats, workers=pool_size(), started=_pool is not None and _pool_pid == os.getpid())
@@ -0,0 +1,132 @@
+"""On-disk cache of rendered document exports.
+
+Rendering PDF/DOCX/PPTX is CPU-heavy and the same (usually finalized) document is downloaded
+again and again. An export is keyed by document id, ``updated_at``, a hash of the rendered
+content and the format, so any edit produces a new key and stale files are never served. The key
+doubles as the HTTP ETag. Files live under ``DOCUMENT_EXPORT_CACHE_DIR``. Once the directory
+grows past ``DOCUMENT_EXPORT_CACHE_MAX_BYTES``, the least recently served files are evicted.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from typing import Iterable, Optional
+
+from django.conf import settings
+
+# Bump when renderer output changes so old cached files are not served
+RENDER_VERSION = 3
+
+
+def export_key(doc, fmt: str) -> str:
+	h = hashlib.sha256()
+	h.update(f"{RENDER_VERSION}\x1f{doc.pk}\x1f{doc.updated_at.isoformat() if doc.updated_at else ''}\x1f{fmt}\x1f".encode('utf-8'))
+	h.update((doc.content or '').encode('utf-8'))
+	return h.hexdigest()[:40]
+
+
+class ExportCache:
+	def __init__(self, root: str, max_bytes: int):
+		self.root = str(root)
+		self.max_bytes = max_bytes
+		self.lock = threading.Lock()
+		self.size: Optional[int] = None  # bytes on disk, scanned lazily
+		self.stats = {'hits': 0, 'misses': 0, 'stored': 0, 'evicted': 0}
+
+	def path(self, key: str, fmt: str) -> str:
+		return os.path.join(self.root, key[:2], f'{key}.{fmt}')
+
+	def get(self, key: str, fmt: str) -> Optional[str]:
+		"""Path of the cached file (its mtime refreshed for LRU), or None."""
+		path = self.path(key, fmt)
+		try:
+			os.utime(path)
+		except OSError:
+			self.stats['misses'] += 1
+			return None
+		self.stats['hits'] += 1
+		return path
+
+	def put(self, key: str, fmt: str, data: bytes) -> str:
+		return self.put_stream(key, fmt, [data])
+
+	def put_stream(self, key: str, fmt: str, chunks: Iterable[bytes]) -> str:
+		"""Write chunks to a temp file, rename it into place atomically and evict if over budget."""
+		path = self.path(key, fmt)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+		written = 0
+		try:
+			with os.fdopen(fd, 'wb') as f:
+				for chunk in chunks:
+					f.write(chunk)
+					written += len(chunk)
+			os.replace(tmp, path)
+		except BaseException:
+			try:
+				os.unlink(tmp)
+			except OSError:
+				pass
+			raise
+		with self.lock:
+			self.stats['stored'] += 1
+			if self.size is not None:
+				self.size += written
+		self._evict()
+		return path
+
+	def _files(self):
+		for dirpath, _, names in os.walk(self.root):
+			for name in names:
+				if name.endswith('.tmp'):
+					continue
+				full = os.path.join(dirpath, name)
+				try:
+					st = os.stat(full)
+				except OSError:
+					continue
+				yield st.st_mtime, st.st_size, full
+
+	def _evict(self):
+		with self.lock:
+			if self.size is None:
+				self.size = sum(size for _, size, _ in self._files())
+			if self.size <= self.max_bytes:
+				return
+			# Oldest-served first, down to 90% of the budget so we don't rescan on every put
+			target = int(self.max_bytes * 0.9)
+			for _, size, full in sorted(self._files()):
+				if self.size <= target:
+					break
+				try:
+					os.unlink(full)
+				except OSError:
+					continue
+				self.size -= size
+				self.stats['evicted'] += 1
+
+	def snapshot(self):
+		with self.lock:
+			return dict(self.stats, bytes=self.size, max_bytes=self.max_bytes)
+
+
+_cache: Optional[ExportCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_export_cache() -> Optional[ExportCache]:
+	"""The process-wide cache, or None when DOCUMENT_EXPORT_CACHE_ENABLED is off."""
+	global _cache
+	if not getattr(settings, 'DOCUMENT_EXPORT_CACHE_ENABLED', True):
+		return None
+	root = str(getattr(settings, 'DOCUMENT_EXPORT_CACHE_DIR', os.path.join(settings.MEDIA_ROOT, 'export-cache')))
+	if _cache is None or _cache.root != root:
+		with _cache_lock:
+			if _cache is None or _cache.root != root:
+				_cache = ExportCache(root, int(getattr(settings, 'DOCUMENT_EXPORT_CACHE_MAX_BYTES', 256 * 1024 * 1024)))
+	return _cache
+
+
+def export_cache_stats():
+	cache = _cache
+	return cache.snapshot() if cache is not None else None
@@ -0,0 +1,179 @@
+"""Text flow for PDF export: word wrapping, paragraph spacing and pagination.
+
+Widths come from per-font glyph tables: the font's 256 WinAnsi advance widths are loaded from
+reportlab's font metrics once per font, and per-character and per-word widths are memoized on top
+of that. Measuring a line is then a few dict lookups instead of a stringWidth() call per
+candidate break. Without reportlab every glyph is assumed to be 0.556 em (Helvetica's digit
+width), which is close enough to keep lines on the page.
+
+Layout is a single pass over the input lines. Each input line is a paragraph, wrapped greedily
+to the page's text width. Runs of blank lines become one ``paragraph_spacing`` gap, which is
+dropped at the top of a page. Geometry is a frozen PageGeometry, computed once and shared by
+every page, so cost is linear in the text length.
+"""
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+DEFAULT_GLYPH_WIDTH = 556  # 1/1000 em
+WORD_CACHE_SIZE = 10000
+
+
+@dataclass(frozen=True)
+class PageGeometry:
+	width: float = 595.2756  # A4 in points
+	height: float = 841.8898
+	left: float = 40
+	right: float = 40
+	top: float = 800  # baseline of the first line
+	bottom: float = 40  # lowest baseline allowed
+	font: str = 'Helvetica'
+	size: float = 12
+	leading: float = 14
+	paragraph_spacing: float = 6
+
+	@property
+	def text_width(self) -> float:
+		return self.width - self.left - self.right
+
+	@property
+	def lines_per_page(self) -> int:
+		"""Lines that fit on a page when there are no paragraph gaps."""
+		return int((self.top - self.bottom) // self.leading) + 1
+
+
+DEFAULT_GEOMETRY = PageGeometry()
+
+
+class FontMetrics:
+	"""Advance widths for one font (WinAnsi), in 1/1000 em."""
+
+	def __init__(self, name: str):
+		self.name = name
+		self.table = _glyph_table(name)
+		self.widest = max(self.table)
+		self.chars: Dict[str, int] = {}
+		self.words: Dict[str, int] = {}
+
+	def char_width(self, ch: str) -> int:
+		w = self.chars.get(ch)
+		if w is None:
+			try:
+				code = ch.encode('cp1252')[0]
+			except (UnicodeEncodeError, IndexError):
+				code = ord('?')  # what pdfstream.pdf_string substitutes
+			w = self.chars[ch] = self.table[code]
+		return w
+
+	def text_width(self, text: str) -> int:
+		w = self.words.get(text)
+		if w is None:
+			w = sum(self.char_width(ch) for ch in text)
+			if len(self.words) >= WORD_CACHE_SIZE:
+				self.words.clear()
+			self.words[text] = w
+		return w
+
+	def line_width(self, text: str) -> int:
+		"""Width of a whole line, built from cached word widths (words repeat; lines rarely do)."""
+		words = self.words
+		total = text.count(' ') * self.char_width(' ')
+		for word in text.split(' '):
+			w = words.get(word)
+			total += self.text_width(word) if w is None else w
+		return total
+
+	def width(self, text: str, size: float) -> float:
+		return self.line_width(text) * size / 1000.0
+
+
+def _glyph_table(name: str) -> Tuple[int, ...]:
+	try:
+		from reportlab.pdfbase import pdfmetrics
+		widths = pdfmetrics.getFont(name).widths
+		if len(widths) == 256:
+			return tuple(int(w) for w in widths)
+	except Exception:
+		pass
+	return (DEFAULT_GLYPH_WIDTH,) * 256
+
+
+@lru_cache(maxsize=None)
+def get_metrics(font: str) -> FontMetrics:
+	return FontMetrics(font)
+
+
+def _break_word(word: str, metrics: FontMetrics, limit: int) -> List[str]:
+	"""Split a word wider than the line into line-sized pieces (limit in 1/1000 em units)."""
+	pieces, current, used = [], [], 0
+	for ch in word:
+		w = metrics.char_width(ch)
+		if current and used + w > limit:
+			pieces.append(''.join(current))
+			current, used = [], 0
+		current.append(ch)
+		used += w
+	if current:
+		pieces.append(''.join(current))
+	return pieces
+
+
+def wrap(text: str, geometry: PageGeometry = DEFAULT_GEOMETRY) -> List[str]:
+	"""Greedy word wrap of one paragraph to the geometry's text width. Leading indentation is kept."""
+	metrics = get_metrics(geometry.font)
+	limit = int(geometry.text_width * 1000 / geometry.size)
+	text = text.expandtabs(4).rstrip()
+	if len(text) * metrics.widest <= limit or metrics.line_width(text) <= limit:
+		return [text]
+	stripped = text.lstrip(' ')
+	indent = text[:len(text) - len(stripped)]
+	space = metrics.char_width(' ')
+	lines: List[str] = []
+	current: List[str] = []
+	used = metrics.text_width(indent) if indent and metrics.text_width(indent) < limit // 2 else 0
+	prefix = indent if used else ''
+	for word in stripped.split():
+		w = metrics.text_width(word)
+		needed = w + (space if current else 0)
+		if current and used + needed <= limit:
+			current.append(word)
+			used += needed
+			continue
+		if current:
+			lines.append(prefix + ' '.join(current))
+			prefix, used = '', 0
+		if w > limit:
+			prefix, used = '', 0
+			pieces = _break_word(word, metrics, limit)
+			lines.extend(pieces[:-1])
+			word, w = pieces[-1], metrics.text_width(pieces[-1])
+		current = [word]
+		used += w
+	if current:
+		lines.append(prefix + ' '.join(current))
+	return lines
+
+
+def paginate(lines: Iterable[str], geometry: PageGeometry = DEFAULT_GEOMETRY) -> Iterator[List[Tuple[float, str]]]:
+	"""Pages of (advance, text): `advance` is how far below the previous baseline the line sits
+	(0 for the first line on a page). Always yields at least one (possibly empty) page.
+	"""
+	page: List[Tuple[float, str]] = []
+	y = geometry.top
+	gap = False
+	emitted = False
+	for paragraph in lines:
+		if not paragraph.strip():
+			gap = bool(page)
+			continue
+		for line in wrap(paragraph, geometry):
+			advance = geometry.leading + (geometry.paragraph_spacing if gap else 0) if page else 0
+			gap = False
+			if page and y - advance < geometry.bottom:
+				yield page
+				emitted = True
+				page, y, advance = [], geometry.top, 0
+			page.append((advance, line))
+			y -= advance
+	if page or not emitted:
+		yield page
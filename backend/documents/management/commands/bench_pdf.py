@@ -0,0 +1,74 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from documents.layout import paginate
+from documents.pdfstream import iter_lines, stream_pdf
+
+
+def _reportlab_pdf(text: str) -> int:
+	"""The pre-streaming renderer: whole document in a canvas, then BytesIO.getvalue()."""
+	from io import BytesIO
+	from reportlab.pdfgen import canvas
+	buffer = BytesIO()
+	p = canvas.Canvas(buffer)
+	y = 800
+	for line in text.splitlines() or ['']:
+		if y < 40:
+			p.showPage()
+			y = 800
+		p.drawString(40, y, line)
+		y -= 14
+	p.save()
+	return len(buffer.getvalue())
+
+
+def _streamed_pdf(text: str) -> int:
+	# Chunks are dropped as they come, as they would be once written to the socket
+	return sum(len(chunk) for chunk in stream_pdf(iter_lines(text)))
+
+
+class Command(BaseCommand):
+	help = 'Compare PDF rendering throughput and peak memory: streaming writer vs. reportlab canvas'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--mb', type=float, default=4.0, help='size of the generated text input')
+		parser.add_argument('--repeat', type=int, default=3, help='timed runs per renderer (best is reported)')
+		parser.add_argument('--paragraph-words', type=int, default=0, help='generate wrapped paragraphs of this many words instead of short lines')
+		parser.add_argument('--skip-reportlab', action='store_true')
+
+	def handle(self, *args, **options):
+		line = 'The quick brown fox jumps over the lazy dog; 0123456789 (sample) text line.'
+		if options['paragraph_words']:
+			words = line.split()
+			line = ' '.join(words[i % len(words)] for i in range(options['paragraph_words']))
+		count = max(1, int(options['mb'] * 1024 * 1024 / (len(line) + 1)))
+		text = '\n'.join(f'{i:08d} {line}' for i in range(count))
+		size_mb = len(text.encode('utf-8')) / (1024 * 1024)
+		pages = sum(1 for _ in paginate(iter_lines(text)))
+		self.stdout.write(f'input: {size_mb:.1f} MB, {count} lines, {pages} pages after layout')
+		renderers = [('stream', _streamed_pdf)]
+		if not options['skip_reportlab']:
+			try:
+				import reportlab  # noqa: F401
+				renderers.append(('reportlab', _reportlab_pdf))
+			except ImportError:
+				self.stdout.write('reportlab not installed; skipping the baseline')
+		for name, fn in renderers:
+			best = None
+			out = 0
+			for _ in range(max(1, options['repeat'])):
+				started = time.perf_counter()
+				out = fn(text)
+				elapsed = time.perf_counter() - started
+				best = elapsed if best is None else min(best, elapsed)
+			# Peak memory is measured on a separate run: tracemalloc slows allocation-heavy code
+			tracemalloc.start()
+			fn(text)
+			_, peak = tracemalloc.get_traced_memory()
+			tracemalloc.stop()
+			self.stdout.write(
+				f'{name:>9}: {best * 1000:8.1f} ms  {size_mb / best:7.1f} MB/s in  '
+				f'output {out / (1024 * 1024):6.1f} MB  peak {peak / (1024 * 1024):7.1f} MB above input'
+			)
@@ -1,11 +1,11 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import timedelta
-from documents.models import ConvertedFile
+from documents.models import ConversionJob, ConvertedFile
 
 
 class Command(BaseCommand):
-	help = 'Delete converted files older than 24 hours'
+	help = 'Delete converted files and conversion jobs older than 24 hours'
 
 	def handle(self, *args, **options):
 		cutoff = timezone.now() - timedelta(hours=24)
@@ -21,4 +21,13 @@ class Command(BaseCommand):
 			except Exception:
 				# Swallow exceptions to ensure bulk delete continues
 				pass
-		self.stdout.write(self.style.SUCCESS(f'Purged {count} converted file(s).'))
+		jobs = ConversionJob.objects.filter(created_at__lt=cutoff)
+		job_count = jobs.count()
+		for job in jobs:
+			try:
+				if job.source:
+					job.source.delete(save=False)
+				job.delete()
+			except Exception:
+				pass
+		self.stdout.write(self.style.SUCCESS(f'Purged {count} converted file(s) and {job_count} conversion job(s).'))
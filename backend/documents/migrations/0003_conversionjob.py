@@ -0,0 +1,29 @@
+from django.db import migrations, models
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+	dependencies = [
+		('documents', '0002_convertedfile'),
+		migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+	]
+
+	operations = [
+		migrations.CreateModel(
+			name='ConversionJob',
+			fields=[
+				('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+				('original_name', models.CharField(max_length=255)),
+				('target_format', models.CharField(max_length=16)),
+				('source', models.FileField(blank=True, upload_to='conversion-jobs/')),
+				('status', models.CharField(choices=[('queued', 'Queued'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=16)),
+				('error', models.TextField(blank=True, default='')),
+				('created_at', models.DateTimeField(auto_now_add=True)),
+				('finished_at', models.DateTimeField(blank=True, null=True)),
+				('owner', models.ForeignKey(on_delete=models.deletion.CASCADE, related_name='conversion_jobs', to=settings.AUTH_USER_MODEL)),
+				('result', models.ForeignKey(blank=True, null=True, on_delete=models.deletion.SET_NULL, related_name='jobs', to='documents.convertedfile')),
+			],
+			options={'ordering': ['-created_at']},
+		),
+	]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+	dependencies = [
+		('documents', '0003_conversionjob'),
+	]
+
+	operations = [
+		migrations.AddField(
+			model_name='conversionjob',
+			name='claimed_by',
+			field=models.CharField(blank=True, default='', max_length=128),
+		),
+		migrations.AddField(
+			model_name='conversionjob',
+			name='heartbeat_at',
+			field=models.DateTimeField(blank=True, null=True),
+		),
+	]
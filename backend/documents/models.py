@@ -44,3 +44,30 @@ class ConvertedFile(models.Model):
 
 	def __str__(self):
 		return f"Converted {self.original_name} -> {self.target_format}"
+
+
+class ConversionJob(models.Model):
+	"""A conversion queued on the process pool (documents/engine.py); the output lands in a ConvertedFile."""
+	STATUS_CHOICES = [
+		("queued", "Queued"),
+		("done", "Done"),
+		("failed", "Failed"),
+	]
+	owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='conversion_jobs')
+	original_name = models.CharField(max_length=255)
+	target_format = models.CharField(max_length=16)
+	source = models.FileField(upload_to='conversion-jobs/', blank=True)
+	status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='queued')
+	error = models.TextField(blank=True, default='')
+	result = models.ForeignKey(ConvertedFile, null=True, blank=True, on_delete=models.SET_NULL, related_name='jobs')
+	created_at = models.DateTimeField(auto_now_add=True)
+	finished_at = models.DateTimeField(null=True, blank=True)
+	# host:pid of the web process whose pool has the job, refreshed while it runs (engine.expire_stale)
+	claimed_by = models.CharField(max_length=128, blank=True, default='')
+	heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+	class Meta:
+		ordering = ['-created_at']
+
+	def __str__(self):
+		return f"Job {self.pk}: {self.original_name} -> {self.target_format} ({self.status})"
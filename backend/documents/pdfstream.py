@@ -0,0 +1,125 @@
+"""Incremental PDF writer for plain-text documents.
+
+reportlab's canvas keeps every page object in memory until ``save()``, and the views then copied
+the finished file out of a BytesIO. That put the whole PDF in memory twice before the first byte
+went out. This writer emits each page (content stream + page object) as soon as it is full.
+Between pages it keeps only the byte offsets needed for the cross-reference table, about 20
+bytes per page. The page tree, catalog and xref are written at the end. Memory is therefore one
+page of text no matter how long the document is, and the output can go straight into a
+StreamingHttpResponse or a spooled file.
+
+Text is set in a standard Type1 font (no embedding), WinAnsi-encoded. Wrapping and pagination
+come from documents.layout; the page prologue and line moves depend only on the PageGeometry,
+so they are built once per geometry and reused for every page.
+"""
+import zlib
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Tuple
+
+from .layout import DEFAULT_GEOMETRY, PageGeometry, paginate
+
+_CATALOG, _PAGES, _FONT = 1, 2, 3
+
+
+def iter_lines(text: str) -> Iterator[str]:
+	"""Lines of `text` like str.splitlines() for \\n and \\r\\n, without building the list."""
+	start, n = 0, len(text)
+	while start < n:
+		end = text.find('\n', start)
+		if end < 0:
+			end = n
+		yield text[start:end].rstrip('\r')
+		start = end + 1
+
+
+def pdf_string(text: str) -> bytes:
+	"""A PDF literal string (WinAnsi; unmappable characters become '?')."""
+	data = text.encode('cp1252', errors='replace')
+	return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)').replace(b'\r', b'') + b')'
+
+
+@lru_cache(maxsize=32)
+def _page_ops(geometry: PageGeometry) -> Tuple[bytes, bytes]:
+	"""(text-object prologue, next-line operator) for a geometry."""
+	prologue = b'BT /F1 %g Tf %g TL %g %g Td' % (geometry.size, geometry.leading, geometry.left, geometry.top)
+	return prologue, b'T* '
+
+
+class PDFStreamWriter:
+	"""Writes a PDF one page at a time: begin(), page()*, close(). Each call returns the bytes to emit."""
+
+	def __init__(self, compress: bool = True, geometry: PageGeometry = DEFAULT_GEOMETRY):
+		self.compress = compress
+		self.geometry = geometry
+		self.pos = 0
+		self.offsets = {}
+		self.page_ids: List[int] = []
+		self.next_id = _FONT + 1
+
+	def _emit(self, data: bytes) -> bytes:
+		self.pos += len(data)
+		return data
+
+	def _obj(self, num: int, body: bytes) -> bytes:
+		self.offsets[num] = self.pos
+		return self._emit(b'%d 0 obj\n%s\nendobj\n' % (num, body))
+
+	def _stream(self, num: int, data: bytes) -> bytes:
+		if self.compress:
+			data = zlib.compress(data, 6)
+			head = b'<< /Length %d /Filter /FlateDecode >>' % len(data)
+		else:
+			head = b'<< /Length %d >>' % len(data)
+		return self._obj(num, head + b'\nstream\n' + data + b'\nendstream')
+
+	def begin(self) -> bytes:
+		header = self._emit(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+		font = b'<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>' % self.geometry.font.encode('ascii')
+		return header + self._obj(_FONT, font)
+
+	def page(self, ops: bytes) -> bytes:
+		"""One page from its content-stream operators."""
+		content, page = self.next_id, self.next_id + 1
+		self.next_id += 2
+		self.page_ids.append(page)
+		body = (b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.4f %.4f] '
+				b'/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>') % (_PAGES, self.geometry.width, self.geometry.height, _FONT, content)
+		return self._stream(content, ops) + self._obj(page, body)
+
+	def text_page(self, lines: List[Tuple[float, str]]) -> bytes:
+		"""One page of laid-out lines: (advance below the previous baseline, text), as from layout.paginate."""
+		prologue, next_line = _page_ops(self.geometry)
+		leading = self.geometry.leading
+		ops = [prologue]
+		for advance, text in lines:
+			if not advance:
+				move = b''
+			elif advance == leading:
+				move = next_line
+			else:
+				move = b'0 %g Td ' % -advance
+			ops.append(move + pdf_string(text) + b' Tj')
+		ops.append(b'ET')
+		return self.page(b'\n'.join(ops))
+
+	def close(self) -> bytes:
+		kids = b' '.join(b'%d 0 R' % n for n in self.page_ids)
+		out = self._obj(_PAGES, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self.page_ids)))
+		out += self._obj(_CATALOG, b'<< /Type /Catalog /Pages %d 0 R >>' % _PAGES)
+		xref_at = self.pos
+		size = self.next_id
+		entries = [b'0000000000 65535 f \n'] + [b'%010d 00000 n \n' % self.offsets[n] for n in range(1, size)]
+		out += self._emit(b'xref\n0 %d\n%s' % (size, b''.join(entries)))
+		out += self._emit(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (size, _CATALOG, xref_at))
+		return out
+
+
+def stream_pdf(lines: Iterable[str], compress: bool = True, geometry: PageGeometry = DEFAULT_GEOMETRY) -> Iterator[bytes]:
+	"""PDF bytes for `lines` (one paragraph each), wrapped and paginated, yielded page by page.
+	An empty input still gives one blank page.
+	"""
+	writer = PDFStreamWriter(compress=compress, geometry=geometry)
+	yield writer.begin()
+	for page in paginate(lines, geometry):
+		yield writer.text_page(page)
+	yield writer.close()
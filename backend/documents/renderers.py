@@ -0,0 +1,78 @@
+"""Document renderers for export: text in, file bytes out.
+
+PDF is written incrementally by documents.pdfstream and needs no library. DOCX and PPTX import
+their libraries lazily so those formats stay optional; a missing library raises
+RendererUnavailable, which the views turn into a 501. ``render_stream`` yields output in
+chunks: page by page for PDF, one chunk for the formats whose libraries only save whole files.
+"""
+from io import BytesIO
+from typing import BinaryIO, Iterable, Iterator
+
+from .pdfstream import iter_lines, stream_pdf
+
+CONTENT_TYPES = {
+	'pdf': 'application/pdf',
+	'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+	'pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+}
+
+
+class RendererUnavailable(Exception):
+	"""The library for a format is not installed."""
+
+
+def render_pdf(text: str) -> bytes:
+	return b''.join(stream_pdf(iter_lines(text or '')))
+
+
+def write_docx(lines: Iterable[str], out: BinaryIO):
+	"""One paragraph per line, saved to the binary file `out`."""
+	try:
+		import docx
+	except Exception as e:
+		raise RendererUnavailable('python-docx') from e
+	d = docx.Document()
+	for line in lines:
+		d.add_paragraph(line)
+	d.save(out)
+
+
+def write_pptx(blocks: Iterable[str], out: BinaryIO, title_chars: int = 50):
+	"""One title slide per text block, saved to the binary file `out`."""
+	try:
+		from pptx import Presentation
+	except Exception as e:
+		raise RendererUnavailable('python-pptx') from e
+	prs = Presentation()
+	slide_layout = prs.slide_layouts[1] if len(prs.slide_layouts) > 1 else prs.slide_layouts[0]
+	for block in blocks:
+		slide = prs.slides.add_slide(slide_layout)
+		if slide.shapes.title:
+			slide.shapes.title.text = block[:title_chars]
+	prs.save(out)
+
+
+def render_docx(text: str) -> bytes:
+	buffer = BytesIO()
+	write_docx((text or '').splitlines(), buffer)
+	return buffer.getvalue()
+
+
+def render_pptx(text: str, title_chars: int = 50) -> bytes:
+	buffer = BytesIO()
+	write_pptx((text or '').split('\n\n'), buffer, title_chars)
+	return buffer.getvalue()
+
+
+RENDERERS = {'pdf': render_pdf, 'docx': render_docx, 'pptx': render_pptx}
+
+
+def render(fmt: str, text: str) -> bytes:
+	return RENDERERS[fmt](text)
+
+
+def render_stream(fmt: str, text: str) -> Iterator[bytes]:
+	"""Output of `fmt` in chunks. RendererUnavailable is raised here, before anything is yielded."""
+	if fmt == 'pdf':
+		return stream_pdf(iter_lines(text or ''))
+	return iter([render(fmt, text)])
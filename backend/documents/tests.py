@@ -1,3 +1,382 @@
-from django.test import TestCase
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import engine, renderers
+from .converters import iter_blocks, iter_text_lines
+from .export_cache import ExportCache
+from .layout import DEFAULT_GEOMETRY, get_metrics, paginate, wrap
+from .models import ConversionJob, ConvertedFile, Document
+from .pdfstream import iter_lines, stream_pdf
+
+
+class BatchGenerateTests(TestCase):
+	def setUp(self):
+		self.user = get_user_model().objects.create_user(username='batcher', password='pw-12345678')
+		self.client = APIClient()
+		self.client.force_authenticate(self.user)
+
+	def test_partial_failure_reports_per_item_status(self):
+		def fake(messages, **kwargs):
+			if 'boom' in messages[-1]['content']:
+				return {'error': 'provider down'}
+			return {'content': 'generated'}
+		items = [
+			{'doc_type': 'email', 'title': 'A', 'prompt': 'write a'},
+			{'doc_type': 'report', 'title': 'B', 'prompt': 'boom'},
+			{'doc_type': 'summary', 'title': 'C'},
+		]
+		with mock.patch('documents.views.chat_complete', side_effect=fake):
+			resp = self.client.post('/api/documents/generate/batch/', {'items': items}, format='json', secure=True)
+		self.assertEqual(resp.status_code, 207)
+		body = resp.json()
+		self.assertEqual([r['status'] for r in body['results']], ['created', 'error', 'error'])
+		self.assertEqual(body['results'][0]['document']['title'], 'A')
+		self.assertEqual(Document.objects.filter(owner=self.user).count(), 1)
+
+	def test_non_string_prompt_is_a_per_item_400(self):
+		items = [{'title': 'A', 'prompt': ['not', 'text']}, {'title': 'B', 'prompt': 42}, 'nope']
+		with mock.patch('documents.views.chat_complete') as call:
+			resp = self.client.post('/api/documents/generate/batch/', {'items': items}, format='json', secure=True)
+		self.assertEqual(resp.status_code, 400)
+		self.assertEqual([r['status_code'] for r in resp.json()['results']], [400, 400, 400])
+		call.assert_not_called()
+
+	def test_provider_calls_run_concurrently(self):
+		active, peak = [0], [0]
+		lock = threading.Lock()
+
+		def slow(messages, **kwargs):
+			with lock:
+				active[0] += 1
+				peak[0] = max(peak[0], active[0])
+			time.sleep(0.05)
+			with lock:
+				active[0] -= 1
+			return {'content': 'ok'}
+		items = [{'doc_type': 'email', 'title': str(i), 'prompt': 'p'} for i in range(6)]
+		with mock.patch('documents.views.chat_complete', side_effect=slow):
+			resp = self.client.post('/api/documents/generate/batch/', {'items': items, 'concurrency': 3}, format='json', secure=True)
+		self.assertEqual(resp.status_code, 201)
+		self.assertEqual(resp.json()['created'], 6)
+		self.assertGreater(peak[0], 1)
+		self.assertLessEqual(peak[0], 3)
+
+
+class ExportCacheTests(TestCase):
+	def setUp(self):
+		self.user = get_user_model().objects.create_user(username='exporter', password='pw-12345678')
+		self.client = APIClient()
+		self.client.force_authenticate(self.user)
+		self.doc = Document.objects.create(owner=self.user, doc_type='report', title='T', content='line one\nline two')
+		root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, root, True)
+		patcher = override_settings(DOCUMENT_EXPORT_CACHE_DIR=root, DOCUMENT_EXPORT_CACHE_MAX_BYTES=10 * 1024 * 1024)
+		patcher.enable()
+		self.addCleanup(patcher.disable)
+
+	def _export(self, **headers):
+		return self.client.get(f'/api/documents/{self.doc.pk}/export/?format=pdf', secure=True, **headers)
+
+	def test_repeat_export_is_served_from_cache_and_revalidates(self):
+		with mock.patch('documents.views.render_stream', wraps=renderers.render_stream) as render:
+			first = self._export()
+			body = b''.join(first.streaming_content)
+			second = self._export()
+			self.assertEqual(b''.join(second.streaming_content), body)
+			self.assertEqual(render.call_count, 1)
+			self.assertTrue(body.startswith(b'%PDF'))
+			etag = first['ETag']
+			self.assertEqual(self._export(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+			self.doc.content = 'changed'
+			self.doc.save()
+			changed = self._export(HTTP_IF_NONE_MATCH=etag)
+			self.assertEqual(changed.status_code, 200)
+			self.assertNotEqual(changed['ETag'], etag)
+			self.assertEqual(render.call_count, 2)
+
+	def test_eviction_keeps_cache_under_budget(self):
+		cache = ExportCache(tempfile.mkdtemp(), max_bytes=1000)
+		self.addCleanup(shutil.rmtree, cache.root, True)
+		for i in range(5):
+			cache.put(f'{i:02d}key', 'pdf', b'x' * 400)
+			time.sleep(0.01)
+		self.assertLessEqual(cache.size, 1000)
+		self.assertIsNone(cache.get('00key', 'pdf'))
+		self.assertIsNotNone(cache.get('04key', 'pdf'))
+
+
+class PdfStreamTests(TestCase):
+	def test_xref_offsets_point_at_objects(self):
+		chunks = list(stream_pdf(f'line {i} (x) \\ y' for i in range(DEFAULT_GEOMETRY.lines_per_page * 2 + 1)))
+		self.assertGreater(len(chunks), 3)
+		data = b''.join(chunks)
+		self.assertTrue(data.startswith(b'%PDF-1.4') and data.endswith(b'%%EOF\n'))
+		xref = int(data.rsplit(b'startxref\n', 1)[1].split()[0])
+		lines = data[xref:].split(b'\n')
+		size = int(lines[1].split()[1])
+		for num in range(1, size):
+			offset = int(lines[2 + num][:10])
+			self.assertTrue(data[offset:].startswith(b'%d 0 obj' % num), num)
+		self.assertIn(b'/Count 3', data)
+
+	def test_literal_strings_are_escaped(self):
+		data = b''.join(stream_pdf(['a (b) \\ c'], compress=False))
+		self.assertIn(b'(a \\(b\\) \\\\ c) Tj', data)
+
+	def test_iter_lines_matches_splitlines(self):
+		text = 'one\r\ntwo\n\nthree\n'
+		self.assertEqual(list(iter_lines(text)), text.splitlines())
+
+	def test_convert_to_pdf_streams(self):
+		user = get_user_model().objects.create_user(username='converter', password='pw-12345678')
+		client = APIClient()
+		client.force_authenticate(user)
+		upload = SimpleUploadedFile('big.txt', ('word ' * 20 + '\n').encode('utf-8') * 2000)
+		resp = client.post('/api/documents/convert/', {'file': upload, 'format': 'pdf'}, secure=True)
+		self.assertEqual(resp.status_code, 200)
+		self.assertTrue(resp.streaming)
+		data = b''.join(resp.streaming_content)
+		self.assertTrue(data.startswith(b'%PDF'))
+		pages = len(list(paginate(['word ' * 20] * 2000)))
+		self.assertGreater(pages, 2000 // DEFAULT_GEOMETRY.lines_per_page)  # lines this long wrap
+		self.assertEqual(len(re.findall(rb'/Type /Page ', data)), pages)
+
+
+class LayoutTests(TestCase):
+	def setUp(self):
+		self.metrics = get_metrics(DEFAULT_GEOMETRY.font)
+
+	def _fits(self, line):
+		return self.metrics.width(line, DEFAULT_GEOMETRY.size) <= DEFAULT_GEOMETRY.text_width
+
+	def test_wrap_keeps_words_and_width(self):
+		text = ' '.join(f'word{i}' for i in range(200))
+		lines = wrap(text)
+		self.assertGreater(len(lines), 1)
+		self.assertTrue(all(self._fits(line) for line in lines))
+		self.assertEqual(' '.join(lines).split(), text.split())
+
+	def test_overlong_word_is_broken(self):
+		lines = wrap('x' * 500)
+		self.assertGreater(len(lines), 1)
+		self.assertTrue(all(self._fits(line) for line in lines))
+		self.assertEqual(''.join(lines), 'x' * 500)
+
+	def test_blank_lines_become_one_paragraph_gap(self):
+		g = DEFAULT_GEOMETRY
+		(page,) = list(paginate(['one', '', '', 'two', 'three']))
+		self.assertEqual([a for a, _ in page], [0, g.leading + g.paragraph_spacing, g.leading])
+		# Gaps are not carried to the top of a page
+		pages = list(paginate(['x'] * g.lines_per_page + ['', 'next']))
+		self.assertEqual(pages[1], [(0, 'next')])
+
+	def test_pages_never_run_past_the_bottom_margin(self):
+		g = DEFAULT_GEOMETRY
+		text = ['para ' * 40, ''] * 300
+		for page in paginate(text):
+			self.assertGreaterEqual(g.top - sum(a for a, _ in page), g.bottom)
+
+
+class ConvertUploadTests(TestCase):
+	def setUp(self):
+		self.user = get_user_model().objects.create_user(username='uploader', password='pw-12345678')
+		self.client = APIClient()
+		self.client.force_authenticate(self.user)
+		media = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, media, True)
+		patcher = override_settings(MEDIA_ROOT=media, CONVERT_CHUNK_SIZE=16)
+		patcher.enable()
+		self.addCleanup(patcher.disable)
+
+	def _convert(self, data: bytes, target: str, **extra):
+		return self.client.post('/api/documents/convert/', {'file': SimpleUploadedFile('in.txt', data), 'format': target, **extra}, secure=True)
+
+	def test_utf8_split_across_chunks(self):
+		text = 'héllo wörld ' * 10 + '\n€ line two'
+		resp = self._convert(text.encode('utf-8'), 'txt')
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(b''.join(resp.streaming_content).decode('utf-8'), text)
+
+	def test_invalid_utf8_late_in_file_falls_back_to_latin1(self):
+		data = b'plain ascii text, long enough to span chunks \xff\xfe end'
+		resp = self._convert(data, 'json')
+		self.assertEqual(json.loads(b''.join(resp.streaming_content)), {'filename': 'in.txt', 'content': data.decode('latin-1')})
+
+	def test_upload_over_limit_is_rejected(self):
+		with override_settings(CONVERT_MAX_UPLOAD_BYTES=100):
+			resp = self._convert(b'x' * 101, 'txt')
+		self.assertEqual(resp.status_code, 413)
+
+	def test_persisted_pptx_is_stored(self):
+		resp = self._convert(b'First slide\nmore\n\n\nSecond slide', 'pptx', persist='true')
+		self.assertEqual(resp.status_code, 200)
+		stored = ConvertedFile.objects.get(pk=int(resp['X-Converted-Id']))
+		self.assertEqual(stored.target_format, 'pptx')
+		self.assertEqual(b''.join(resp.streaming_content)[:2], b'PK')
+
+	def test_blocks_and_lines(self):
+		lines = list(iter_text_lines(['a\r', '\nb', 'c\n\n', 'd']))
+		self.assertEqual(lines, ['a', 'bc', '', 'd'])
+		self.assertEqual(list(iter_blocks(['one', 'two', '', '', 'three'], 5)), ['one\nt', 'three'])
+		self.assertEqual(list(iter_blocks([], 5)), [''])
+
+	def test_long_lines_are_cut_and_not_accumulated(self):
+		self.assertEqual(list(iter_text_lines(['abcdefg', 'hij\nk', 'l\r\n'], max_chars=4)), ['abcd', 'efgh', 'ij', 'kl'])
+		lines = iter_text_lines(('x' * 1000 for _ in range(10000)), max_chars=4096)
+		self.assertEqual(len(next(lines)), 4096)  # emitted long before the ~10 MB stream ends
+		self.assertEqual(sum(len(line) for line in lines), 10000 * 1000 - 4096)
+
+
+class _InlineExecutor:
+	def submit(self, fn, *args):
+		future = Future()
+		try:
+			future.set_result(fn(*args))
+		except Exception as e:
+			future.set_exception(e)
+		return future
+
+
+class ConversionJobTests(TestCase):
+	def setUp(self):
+		self.user = get_user_model().objects.create_user(username='jobber', password='pw-12345678')
+		self.client = APIClient()
+		self.client.force_authenticate(self.user)
+		media = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, media, True)
+		patcher = override_settings(MEDIA_ROOT=media)
+		patcher.enable()
+		self.addCleanup(patcher.disable)
+		executor = mock.patch('documents.engine._executor', return_value=_InlineExecutor())
+		executor.start()
+		self.addCleanup(executor.stop)
+		heartbeat = mock.patch('documents.engine._ensure_heartbeat')
+		self.heartbeat = heartbeat.start()
+		self.addCleanup(heartbeat.stop)
+
+	def _submit(self, data: bytes, target: str):
+		return self.client.post('/api/documents/convert/jobs/', {'file': SimpleUploadedFile('notes.txt', data), 'format': target}, secure=True)
+
+	def test_submit_poll_download(self):
+		resp = self._submit('line one\nline two'.encode('utf-8'), 'txt')
+		self.assertEqual(resp.status_code, 202)
+		job_id = resp.json()['id']
+		status = self.client.get(f'/api/documents/convert/jobs/{job_id}/', secure=True).json()
+		self.assertEqual(status['status'], 'done')
+		self.assertIsNotNone(status['result'])
+		job = ConversionJob.objects.get(pk=job_id)
+		self.assertFalse(job.source)
+		self.assertEqual(job.result.owner, self.user)
+		self.assertEqual(job.claimed_by, engine.owner_id())
+		self.assertIsNotNone(job.heartbeat_at)
+		self.heartbeat.assert_called_once()
+		download = self.client.get(f'/api/documents/convert/jobs/{job_id}/download/', secure=True)
+		self.assertEqual(b''.join(download.streaming_content), b'line one\nline two')
+
+	def test_failed_job_reports_error(self):
+		with mock.patch('documents.engine.run_conversion', side_effect=RuntimeError('boom')):
+			job_id = self._submit(b'text', 'pdf').json()['id']
+		status = self.client.get(f'/api/documents/convert/jobs/{job_id}/', secure=True).json()
+		self.assertEqual(status['status'], 'failed')
+		self.assertIn('boom', status['error'])
+		self.assertEqual(self.client.get(f'/api/documents/convert/jobs/{job_id}/download/', secure=True).status_code, 409)
+
+	def test_broken_pool_is_replaced(self):
+		from concurrent.futures.process import BrokenProcessPool
+		broken = mock.Mock(submit=mock.Mock(side_effect=BrokenProcessPool('a worker died')))
+		in_flight = engine.engine_stats()['in_flight']
+		with mock.patch('documents.engine._executor', side_effect=[broken, _InlineExecutor()]):
+			job_id = self._submit(b'text', 'txt').json()['id']
+		self.assertEqual(ConversionJob.objects.get(pk=job_id).status, 'done')
+		broken.shutdown.assert_called_once()
+		self.assertEqual(engine.engine_stats()['in_flight'], in_flight)
+
+	def test_failed_submit_does_not_leak_in_flight(self):
+		before = engine.engine_stats()
+		with mock.patch('documents.engine._executor', return_value=mock.Mock(submit=mock.Mock(side_effect=RuntimeError('cannot start workers')))):
+			resp = self._submit(b'text', 'txt')
+		self.assertEqual(resp.status_code, 503)
+		after = engine.engine_stats()
+		self.assertEqual((after['in_flight'], after['submitted']), (before['in_flight'], before['submitted']))
+
+	def test_jobs_are_private(self):
+		job_id = self._submit(b'text', 'txt').json()['id']
+		other = get_user_model().objects.create_user(username='other', email='other@example.com', password='pw-12345678')
+		self.client.force_authenticate(other)
+		self.assertEqual(self.client.get(f'/api/documents/convert/jobs/{job_id}/', secure=True).status_code, 404)
+
+	def test_stale_queued_job_expires(self):
+		job = ConversionJob.objects.create(owner=self.user, original_name='a.txt', target_format='pdf')
+		ConversionJob.objects.filter(pk=job.pk).update(created_at=timezone.now() - timedelta(hours=1))
+		status = self.client.get(f'/api/documents/convert/jobs/{job.pk}/', secure=True).json()
+		self.assertEqual((status['status'], status['error']), ('failed', 'timed out'))
+
+	def test_job_heartbeated_by_another_process_is_not_expired(self):
+		job = ConversionJob.objects.create(owner=self.user, original_name='a.txt', target_format='pdf')
+		ConversionJob.objects.filter(pk=job.pk).update(created_at=timezone.now() - timedelta(hours=1), claimed_by='web-2:4242', heartbeat_at=timezone.now())
+		status = self.client.get(f'/api/documents/convert/jobs/{job.pk}/', secure=True).json()
+		self.assertEqual(status['status'], 'queued')
+
+	def test_job_with_stale_heartbeat_expires(self):
+		job = ConversionJob.objects.create(owner=self.user, original_name='a.txt', target_format='pdf')
+		ConversionJob.objects.filter(pk=job.pk).update(claimed_by='web-2:4242', heartbeat_at=timezone.now() - timedelta(hours=1))
+		status = self.client.get(f'/api/documents/convert/jobs/{job.pk}/', secure=True).json()
+		self.assertEqual((status['status'], status['error']), ('failed', 'timed out'))
+
+	def test_heartbeat_keeps_running_jobs_fresh(self):
+		job = ConversionJob.objects.create(owner=self.user, original_name='a.txt', target_format='pdf')
+		old = timezone.now() - timedelta(hours=1)
+		ConversionJob.objects.filter(pk=job.pk).update(created_at=old, heartbeat_at=old)
+		engine._running.add(job.pk)
+		self.addCleanup(engine._running.discard, job.pk)
+		engine._beat()
+		job.refresh_from_db()
+		self.assertFalse(engine.expire_stale(job))
+		self.assertEqual(job.status, 'queued')
+
+	def test_late_result_does_not_overwrite_expired_job(self):
+		job = ConversionJob.objects.create(owner=self.user, original_name='a.txt', target_format='pdf')
+		ConversionJob.objects.filter(pk=job.pk).update(created_at=timezone.now() - timedelta(hours=1))
+		job.refresh_from_db()
+		self.assertTrue(engine.expire_stale(job))
+		out = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
+		out.write(b'%PDF-1.4 late')
+		out.close()
+		self.addCleanup(lambda: os.path.exists(out.name) and os.unlink(out.name))
+		future = Future()
+		future.set_result(13)
+		with mock.patch.dict(engine._stats, {'in_flight': 1}):
+			engine._running.add(job.pk)
+			engine._finish(job.pk, out.name, future)
+			self.assertNotIn(job.pk, engine._running)
+		job.refresh_from_db()
+		self.assertEqual((job.status, job.error, job.result_id), ('failed', 'timed out', None))
+		self.assertFalse(ConvertedFile.objects.filter(owner=self.user).exists())
+
+	def test_worker_process_converts_file(self):
+		src = tempfile.NamedTemporaryFile(suffix='.txt', delete=False)
+		src.write(b'hello from a worker process\n' * 100)
+		src.close()
+		self.addCleanup(os.unlink, src.name)
+		out = src.name + '.pdf'
+		self.addCleanup(lambda: os.path.exists(out) and os.unlink(out))
+		with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'), initializer=engine._init_worker) as pool:
+			written = pool.submit(engine.run_conversion, src.name, 'in.txt', 'pdf', out).result(timeout=120)
+		self.assertEqual(written, os.path.getsize(out))
+		with open(out, 'rb') as f:
+			self.assertTrue(f.read(8).startswith(b'%PDF'))
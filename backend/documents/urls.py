@@ -1,5 +1,7 @@
 from django.urls import path
 from .views import DocumentListCreateView, DocumentDetailView, regenerate_document, finalize_document, generate_document, export_document, convert_document, convert_capabilities, ConvertedFileListView
+from .views import generate_documents_batch, agenerate_document, aregenerate_document, afinalize_document
+from .views import submit_conversion_job, conversion_job_status, download_conversion_job
 
 urlpatterns = [
     path('documents/', DocumentListCreateView.as_view(), name='document-list-create'),
@@ -7,8 +9,17 @@ urlpatterns = [
     path('documents/<int:pk>/regenerate/', regenerate_document, name='document-regenerate'),
     path('documents/<int:pk>/finalize/', finalize_document, name='document-finalize'),
     path('documents/generate/', generate_document, name='document-generate'),
+    path('documents/generate/batch/', generate_documents_batch, name='document-generate-batch'),
+    # Async (ASGI) variants: same contract, provider call awaited instead of blocking a worker thread
+    path('documents/generate/async/', agenerate_document, name='document-generate-async'),
+    path('documents/<int:pk>/regenerate/async/', aregenerate_document, name='document-regenerate-async'),
+    path('documents/<int:pk>/finalize/async/', afinalize_document, name='document-finalize-async'),
     path('documents/<int:pk>/export/', export_document, name='document-export'),
     path('documents/convert/', convert_document, name='document-convert'),
     path('documents/convert/capabilities/', convert_capabilities, name='document-convert-capabilities'),
+    # Process-pool conversions: submit -> poll -> download
+    path('documents/convert/jobs/', submit_conversion_job, name='document-convert-job-submit'),
+    path('documents/convert/jobs/<int:pk>/', conversion_job_status, name='document-convert-job'),
+    path('documents/convert/jobs/<int:pk>/download/', download_conversion_job, name='document-convert-job-download'),
     path('converted/', ConvertedFileListView.as_view(), name='converted-file-list'),
 ]
@@ -1,16 +1,31 @@
 from rest_framework import generics, permissions
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes
-from services.ai import chat_complete
-from .models import Document, ConvertedFile
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+from django.http import FileResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from services.ai import chat_complete, chat_complete_async
+from services.history import buffered
+from users.authentication import aauthorize
+from .export_cache import export_key, get_export_cache
+from . import engine
+from .models import Document, ConvertedFile, ConversionJob
+from .converters import FORMATS, STREAMED, convert_stream, convert_to, json_stream, max_upload_bytes, source_text
+from .renderers import CONTENT_TYPES, RENDERERS, RendererUnavailable, render_stream
 from .serializers import DocumentSerializer
 from typing import TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.utils import timezone
 
 if TYPE_CHECKING:
 	# Help the type checker know common Document attributes without importing at runtime
 	from .typings import Document as _DocumentType  # type: ignore
-import os
+import json
 import logging
+import tempfile
 import traceback
 
 logger = logging.getLogger(__name__)
@@ -53,19 +68,36 @@ class ConvertedFileListView(generics.ListAPIView):
 		return Response({'results': data})
 
 
-@api_view(['POST'])
-@permission_classes([permissions.IsAuthenticated])
-def regenerate_document(request, pk: int):
-	try:
-		doc = Document.objects.get(pk=pk, owner=request.user)
-	except Document.DoesNotExist:
-		return Response({'detail': 'Not found'}, status=404)
+def _normalize_doc_type(doc_type) -> str:
+	doc_type = doc_type or 'custom'
+	# Normalize unsupported incoming types to closest allowed choice
+	allowed = {c[0] for c in getattr(Document, 'TYPE_CHOICES', [])}
+	fallback_map = {
+		'proposal': 'proposal',
+		'email': 'email',
+		'summary': 'summary',
+		'presentation': 'presentation',
+		'contract': 'contract',
+	}
+	if doc_type not in allowed:
+		# Try mapped fallback else default to 'custom'
+		doc_type = fallback_map.get(doc_type, 'custom')
+	return doc_type
+
+
+def _generation_messages(doc_type: str, prompt: str):
+	system_prompt = (
+		"You are an assistant that generates high-quality {doc_type} content. "
+		"Follow the user's prompt and keep the tone professional."
+	).format(doc_type=doc_type.replace('_', ' '))
+	user_prompt = f"{prompt}\n\nReturn only the generated content."
+	return [
+		{"role": "system", "content": system_prompt},
+		{"role": "user", "content": user_prompt},
+	]
 
-	instructions = request.data.get('instructions') or ''
-	provider = request.data.get('provider') or 'openai'
-	model = request.data.get('model')
-	temperature = request.data.get('temperature') or 0.7
 
+def _regeneration_messages(doc, instructions: str):
 	system_prompt = (
 		"You are an assistant that (re)generates high-quality {doc_type} content. "
 		"Follow the user's instructions and keep the tone professional."
@@ -75,23 +107,49 @@ def regenerate_document(request, pk: int):
 		f"Incorporate these instructions if provided: {instructions}\n\n"
 		f"Current content:\n{doc.content}\n\nReturn only the regenerated content."
 	)
-	messages = [
+	return [
 		{"role": "system", "content": system_prompt},
 		{"role": "user", "content": user_prompt},
 	]
 
-	ai_resp = chat_complete(messages, model=model, temperature=temperature, provider=provider)
-	if ai_resp.get('error'):
-		return Response({'error': ai_resp['error']}, status=502)
 
-	new_content = ai_resp.get('content') or doc.content
+def _finalize_messages(doc):
+	return [
+		{"role": "system", "content": "You are an assistant that polishes user documents for professionalism and clarity."},
+		{"role": "user", "content": f"Polish this {doc.doc_type} titled '{doc.title}'. Return only the improved content.\n\n{doc.content}"}
+	]
 
+
+def _apply_revision(doc, new_content: str, finalized: bool):
+	"""Push the current content onto the (5-deep) history and replace it; caller saves."""
+	# A regenerate records whether the replaced version was finalized; finalize always stores the draft
+	was_finalized = False if finalized else doc.meta.get('finalized', False)
 	prev_versions = doc.meta.get('history', [])
-	prev_versions.append({'content': doc.content, 'finalized': doc.meta.get('finalized', False)})
+	prev_versions.append({'content': doc.content, 'finalized': was_finalized})
 	doc.meta['history'] = prev_versions[-5:]
-	doc.meta['finalized'] = False
-
+	doc.meta['finalized'] = finalized
 	doc.content = new_content
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def regenerate_document(request, pk: int):
+	try:
+		doc = Document.objects.get(pk=pk, owner=request.user)
+	except Document.DoesNotExist:
+		return Response({'detail': 'Not found'}, status=404)
+
+	instructions = request.data.get('instructions') or ''
+	provider = request.data.get('provider') or 'openai'
+	model = request.data.get('model')
+	temperature = request.data.get('temperature') or 0.7
+
+	messages = _regeneration_messages(doc, instructions)
+	ai_resp = chat_complete(messages, model=model, temperature=temperature, provider=provider)
+	if ai_resp.get('error'):
+		return Response({'error': ai_resp['error']}, status=502)
+
+	_apply_revision(doc, ai_resp.get('content') or doc.content, finalized=False)
 	doc.save()
 	return Response(DocumentSerializer(doc).data)
 
@@ -107,20 +165,12 @@ def finalize_document(request, pk: int):
 	model = request.data.get('model')
 	provider = request.data.get('provider') or 'openai'
 	temperature = request.data.get('temperature') or 0.4
-	messages = [
-		{"role": "system", "content": "You are an assistant that polishes user documents for professionalism and clarity."},
-		{"role": "user", "content": f"Polish this {doc.doc_type} titled '{doc.title}'. Return only the improved content.\n\n{doc.content}"}
-	]
+	messages = _finalize_messages(doc)
 	ai_resp = chat_complete(messages, model=model, temperature=temperature, provider=provider)
 	if ai_resp.get('error'):
 		return Response({'error': ai_resp['error']}, status=502)
 
-	new_content = ai_resp.get('content') or doc.content
-	prev_versions = doc.meta.get('history', [])
-	prev_versions.append({'content': doc.content, 'finalized': False})
-	doc.meta['history'] = prev_versions[-5:]
-	doc.content = new_content
-	doc.meta['finalized'] = True
+	_apply_revision(doc, ai_resp.get('content') or doc.content, finalized=True)
 	doc.save()
 	return Response(DocumentSerializer(doc).data)
 
@@ -128,36 +178,14 @@ def finalize_document(request, pk: int):
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def generate_document(request):
-	doc_type = request.data.get('doc_type') or 'custom'
-	# Normalize unsupported incoming types to closest allowed choice
-	allowed = {c[0] for c in getattr(Document, 'TYPE_CHOICES', [])}
-	fallback_map = {
-		'proposal': 'proposal',
-		'email': 'email',
-		'summary': 'summary',
-		'presentation': 'presentation',
-		'contract': 'contract',
-	}
-	if doc_type not in allowed:
-		# Try mapped fallback else default to 'custom'
-		doc_type = fallback_map.get(doc_type, 'custom')
+	doc_type = _normalize_doc_type(request.data.get('doc_type'))
 	title = request.data.get('title') or ''
 	prompt = request.data.get('prompt') or ''
 	provider = request.data.get('provider') or 'openai'
 	model = request.data.get('model')
 	temperature = request.data.get('temperature') or 0.7
 
-	system_prompt = (
-		"You are an assistant that generates high-quality {doc_type} content. "
-		"Follow the user's prompt and keep the tone professional."
-	).format(doc_type=doc_type.replace('_', ' '))
-
-	user_prompt = f"{prompt}\n\nReturn only the generated content."
-	messages = [
-		{"role": "system", "content": system_prompt},
-		{"role": "user", "content": user_prompt},
-	]
-
+	messages = _generation_messages(doc_type, prompt)
 	ai_resp = chat_complete(messages, model=model, temperature=temperature, provider=provider)
 	if ai_resp.get('error'):
 		return Response({'error': ai_resp['error']}, status=502)
@@ -168,8 +196,201 @@ def generate_document(request):
 	return Response(DocumentSerializer(doc).data, status=201)
 
 
+def _generate_batch_item(spec: dict, defaults: dict) -> dict:
+	"""Run one batch item's provider call (no DB access, safe off the request thread)."""
+	doc_type = _normalize_doc_type(spec.get('doc_type'))
+	prompt = spec.get('prompt') or ''
+	messages = _generation_messages(doc_type, prompt)
+	try:
+		ai_resp = chat_complete(
+			messages,
+			model=spec.get('model') or defaults['model'],
+			temperature=spec.get('temperature') or defaults['temperature'],
+			provider=spec.get('provider') or defaults['provider'],
+		)
+	except Exception as e:
+		logger.exception('Batch generate provider error')
+		ai_resp = {'error': f'AI provider error: {str(e)}'}
+	if ai_resp.get('error'):
+		return {'status': 'error', 'error': ai_resp['error']}
+	content = ai_resp.get('content') or ai_resp.get('text') or prompt
+	return {'status': 'created', 'doc_type': doc_type, 'title': spec.get('title') or '', 'content': content or ''}
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def generate_documents_batch(request):
+	"""Generate several documents in one request.
+	Body: {"items": [{doc_type, title, prompt}, ...], provider?, model?, temperature?, concurrency?}.
+	Provider calls run concurrently (bounded by AI_BATCH_CONCURRENCY); successful items are inserted
+	with one bulk_create. Each item reports its own status so a failed item does not fail the batch;
+	an invalid item (missing or non-string prompt) reports status_code 400.
+	"""
+	items = request.data.get('items')
+	max_items = int(getattr(settings, 'AI_BATCH_MAX_ITEMS', 50))
+	if not isinstance(items, list) or not items:
+		return Response({'error': 'items must be a non-empty list'}, status=400)
+	if len(items) > max_items:
+		return Response({'error': f'at most {max_items} items per batch'}, status=400)
+	defaults = {
+		'provider': request.data.get('provider') or 'openai',
+		'model': request.data.get('model'),
+		'temperature': request.data.get('temperature') or 0.7,
+	}
+	limit = int(getattr(settings, 'AI_BATCH_CONCURRENCY', 8))
+	try:
+		concurrency = max(1, min(int(request.data.get('concurrency') or limit), limit))
+	except (TypeError, ValueError):
+		concurrency = limit
+
+	results = [None] * len(items)
+	jobs = []
+	for i, spec in enumerate(items):
+		prompt = spec.get('prompt') if isinstance(spec, dict) else None
+		if not isinstance(prompt, str) or not prompt.strip():
+			results[i] = {'status': 'error', 'error': 'prompt must be a non-empty string', 'status_code': 400}
+		else:
+			jobs.append((i, spec))
+	if jobs:
+		with ThreadPoolExecutor(max_workers=min(concurrency, len(jobs)), thread_name_prefix='doc-batch') as pool:
+			for (i, _), outcome in zip(jobs, pool.map(lambda job: _generate_batch_item(job[1], defaults), jobs)):
+				results[i] = outcome
+
+	created = [i for i, r in enumerate(results) if r['status'] == 'created']
+	docs = Document.objects.bulk_create([
+		Document(owner=request.user, doc_type=results[i]['doc_type'], title=results[i]['title'], content=results[i]['content'])
+		for i in created
+	])
+	report = [{'index': i, 'status': r['status'], 'error': r.get('error'), 'status_code': r.get('status_code')} for i, r in enumerate(results)]
+	for i, doc in zip(created, docs):
+		report[i]['document'] = DocumentSerializer(doc).data
+	failed = len(results) - len(created)
+	invalid = all(r.get('status_code') == 400 for r in results)
+	status = 201 if not failed else (207 if created else (400 if invalid else 502))
+	return Response({'results': report, 'created': len(created), 'failed': failed}, status=status)
+
+
+async def _async_request(request):
+	"""Authenticate and throttle a plain async view and decode its JSON body -> (user, data, error_response)."""
+	user, error = await aauthorize(request)
+	if error:
+		return None, None, error
+	try:
+		data = json.loads(request.body or b'{}')
+	except ValueError:
+		return user, None, JsonResponse({'error': 'invalid JSON body'}, status=400)
+	if not isinstance(data, dict):
+		return user, None, JsonResponse({'error': 'JSON object expected'}, status=400)
+	return user, data, None
+
+
+@csrf_exempt
+@require_POST
+async def agenerate_document(request):
+	"""Async twin of generate_document (ASGI): awaits the provider call instead of holding a thread."""
+	user, data, error = await _async_request(request)
+	if error:
+		return error
+	doc_type = _normalize_doc_type(data.get('doc_type'))
+	prompt = data.get('prompt') or ''
+	ai_resp = await chat_complete_async(_generation_messages(doc_type, prompt), model=data.get('model'), temperature=data.get('temperature') or 0.7, provider=data.get('provider') or 'openai')
+	if ai_resp.get('error'):
+		return JsonResponse({'error': ai_resp['error']}, status=502)
+	content = ai_resp.get('content') or ai_resp.get('text') or prompt
+	doc = await Document.objects.acreate(owner=user, doc_type=doc_type, title=data.get('title') or '', content=content or '')
+	return JsonResponse(DocumentSerializer(doc).data, status=201)
+
+
+@csrf_exempt
+@require_POST
+async def aregenerate_document(request, pk: int):
+	"""Async twin of regenerate_document."""
+	user, data, error = await _async_request(request)
+	if error:
+		return error
+	try:
+		doc = await Document.objects.aget(pk=pk, owner=user)
+	except Document.DoesNotExist:
+		return JsonResponse({'detail': 'Not found'}, status=404)
+	messages = _regeneration_messages(doc, data.get('instructions') or '')
+	ai_resp = await chat_complete_async(messages, model=data.get('model'), temperature=data.get('temperature') or 0.7, provider=data.get('provider') or 'openai')
+	if ai_resp.get('error'):
+		return JsonResponse({'error': ai_resp['error']}, status=502)
+	_apply_revision(doc, ai_resp.get('content') or doc.content, finalized=False)
+	await doc.asave()
+	return JsonResponse(DocumentSerializer(doc).data)
+
+
+@csrf_exempt
+@require_POST
+async def afinalize_document(request, pk: int):
+	"""Async twin of finalize_document."""
+	user, data, error = await _async_request(request)
+	if error:
+		return error
+	try:
+		doc = await Document.objects.aget(pk=pk, owner=user)
+	except Document.DoesNotExist:
+		return JsonResponse({'detail': 'Not found'}, status=404)
+	ai_resp = await chat_complete_async(_finalize_messages(doc), model=data.get('model'), temperature=data.get('temperature') or 0.4, provider=data.get('provider') or 'openai')
+	if ai_resp.get('error'):
+		return JsonResponse({'error': ai_resp['error']}, status=502)
+	_apply_revision(doc, ai_resp.get('content') or doc.content, finalized=True)
+	await doc.asave()
+	return JsonResponse(DocumentSerializer(doc).data)
+
+
+class _DownloadRenderer(BaseRenderer):
+	"""Lets `?format=<ext>` reach export_document: DRF treats `format` as a renderer override and
+	404s when no renderer claims it. The view sets the real content type; bodies pass through.
+	"""
+	media_type = '*/*'
+
+	def render(self, data, accepted_media_type=None, renderer_context=None):
+		if isinstance(data, bytes):
+			return data
+		if isinstance(data, str):
+			return data.encode('utf-8')
+		return json.dumps(data).encode('utf-8')
+
+
+_DOWNLOAD_RENDERERS = [type(f'{fmt.title()}DownloadRenderer', (_DownloadRenderer,), {'format': fmt}) for fmt in ('txt', 'pdf', 'docx', 'pptx')]
+
+
+def _binary_export(request, doc, fmt: str):
+	"""PDF/DOCX/PPTX download, served from the export cache when this exact version was rendered before.
+	The cache key is the ETag, so a client that already has this version gets a 304.
+	"""
+	key = export_key(doc, fmt)
+	etag = f'"{key}"'
+	if etag in [t.strip() for t in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+		resp = HttpResponseNotModified()
+		resp['ETag'] = etag
+		return resp
+	headers = {'Content-Disposition': f'attachment; filename="document-{doc.pk}.{fmt}"', 'ETag': etag, 'Cache-Control': 'private, no-cache'}
+	cache = get_export_cache()
+	path = cache.get(key, fmt) if cache is not None else None
+	if path is None:
+		try:
+			chunks = render_stream(fmt, doc.content or '')
+		except RendererUnavailable as e:
+			return Response({'error': f'{fmt.upper()} export not available: install {e}'}, status=501)
+		if cache is None:
+			return StreamingHttpResponse(buffered(chunks), content_type=CONTENT_TYPES[fmt], headers=headers)
+		try:
+			path = cache.put_stream(key, fmt, chunks)
+		except OSError:
+			logger.exception('Export cache write failed')
+			return StreamingHttpResponse(buffered(render_stream(fmt, doc.content or '')), content_type=CONTENT_TYPES[fmt], headers=headers)
+	resp = FileResponse(open(path, 'rb'), content_type=CONTENT_TYPES[fmt])
+	for name, value in headers.items():
+		resp[name] = value
+	return resp
+
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@renderer_classes([*api_settings.DEFAULT_RENDERER_CLASSES, *_DOWNLOAD_RENDERERS])
 def export_document(request, pk: int):
 	try:
 		doc = Document.objects.get(pk=pk, owner=request.user)
@@ -191,240 +412,180 @@ def export_document(request, pk: int):
 		content = doc.content or ''
 		return Response(content, content_type='text/plain; charset=utf-8', headers={'Content-Disposition': f'attachment; filename="document-{doc_id}.txt"'})
 
-	if fmt == 'pdf':
-		try:
-			from io import BytesIO
-			from reportlab.pdfgen import canvas
-		except Exception:
-			return Response({'error': 'PDF export not available: install reportlab'}, status=501)
-		buffer = BytesIO()
-		p = canvas.Canvas(buffer)
-		y = 800
-		for line in (doc.content or '').splitlines() or ['']:
-			if y < 40:
-				p.showPage()
-				y = 800
-			p.drawString(40, y, line)
-			y -= 14
-		p.save()
-		buffer.seek(0)
-		return Response(buffer.getvalue(), content_type='application/pdf', headers={'Content-Disposition': f'attachment; filename="document-{doc_id}.pdf"'})
-
-	if fmt == 'docx':
-		try:
-			from io import BytesIO
-			import docx
-		except Exception:
-			return Response({'error': 'DOCX export not available: install python-docx'}, status=501)
-		buffer = BytesIO()
-		d = docx.Document()
-		for line in (doc.content or '').splitlines():
-			d.add_paragraph(line)
-		d.save(buffer)
-		buffer.seek(0)
-		return Response(buffer.getvalue(), content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document', headers={'Content-Disposition': f'attachment; filename="document-{doc_id}.docx"'})
-
-	if fmt == 'pptx':
-		try:
-			from io import BytesIO
-			from pptx import Presentation
-		except Exception:
-			return Response({'error': 'PPTX export not available: install python-pptx'}, status=501)
-		prs = Presentation()
-		slide_layout = prs.slide_layouts[1] if len(prs.slide_layouts) > 1 else prs.slide_layouts[0]
-		for line in (doc.content or '').split('\n\n'):
-			slide = prs.slides.add_slide(slide_layout)
-			title = slide.shapes.title
-			title.text = line[:50]
-		buffer = BytesIO()
-		prs.save(buffer)
-		buffer.seek(0)
-		return Response(buffer.getvalue(), content_type='application/vnd.openxmlformats-officedocument.presentationml.presentation', headers={'Content-Disposition': f'attachment; filename="document-{doc_id}.pptx"'})
+	if fmt in RENDERERS:
+		return _binary_export(request, doc, fmt)
 
 	return Response({'error': 'Format not supported'}, status=400)
 
 
+def _declared_too_large(request) -> bool:
+	"""Content-Length already over the upload limit (with some room for the multipart envelope)."""
+	try:
+		declared = int(request.META.get('CONTENT_LENGTH') or 0)
+	except ValueError:
+		return False
+	return declared > max_upload_bytes() + 64 * 1024
+
+
+def _too_large():
+	return Response({'error': f'Upload too large (limit {max_upload_bytes()} bytes)'}, status=413)
+
+
+def _upload_error(upload, target: str):
+	"""Error response for a conversion upload that cannot be accepted, else None."""
+	if not upload:
+		return Response({'error': 'No file uploaded'}, status=400)
+	if upload.size > max_upload_bytes():
+		return _too_large()
+	if target not in FORMATS:
+		return Response({'error': f'Unsupported target format: {target}'}, status=400)
+	return None
+
+
+def _converted_content_type(target: str) -> str:
+	return {'txt': 'text/plain; charset=utf-8', 'json': 'application/json'}.get(target) or CONTENT_TYPES[target]
+
+
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def convert_document(request):
-	"""Convert an uploaded file to a desired format. Supports txt/json and attempts pdf/docx/pptx when libs are installed."""
+	"""Convert an uploaded file to a desired format. Supports txt/json/pdf and attempts docx/pptx when libs are installed.
+	The upload is read in chunks from Django's spooled upload file; txt/json/pdf responses stream as they are produced.
+	"""
+	# Checked before request.FILES/POST so an oversized body is never parsed
+	if _declared_too_large(request):
+		return _too_large()
 	upload = request.FILES.get('file')
 	target = (request.POST.get('format') or 'txt').lower()
 	persist = request.POST.get('persist') == 'true'
-	if not upload:
-		return Response({'error': 'No file uploaded'}, status=400)
-	if target not in {'txt','json','pdf','docx','pptx'}:
-		return Response({'error': f'Unsupported target format: {target}'}, status=400)
+	error = _upload_error(upload, target)
+	if error:
+		return error
 
 	logger.info('convert_document called: filename=%s, target=%s, size=%s', getattr(upload, 'name', None), target, getattr(upload, 'size', None))
 
-	try:
-		content_bytes = upload.read()
-	except Exception as e:
-		logger.exception('Failed to read uploaded file')
-		return Response({'error': 'Failed to read uploaded file', 'detail': str(e)}, status=500)
-
-	# If DOCX, try to extract text first
 	filename = getattr(upload, 'name', '') or 'upload'
-	_, ext = os.path.splitext(filename.lower())
-	if ext == '.docx':
-		try:
-			from io import BytesIO
-			import docx as _docx
-			docx_file = _docx.Document(BytesIO(content_bytes))
-			paragraphs = [p.text for p in docx_file.paragraphs]
-			extracted = '\n\n'.join([p for p in paragraphs if p])
-			if extracted:
-				content_bytes = extracted.encode('utf-8')
-		except Exception:
-			logger.exception('DOCX text extraction failed; using raw bytes')
-
-	# Helper to optionally persist bytes
-	def _persist_bytes(data: bytes, out_ext: str, original_name: str):
-		if not persist or not request.user.is_authenticated:
-			return None
-		from django.core.files.base import ContentFile
-		cf = ContentFile(data)
-		try:
-			stored = ConvertedFile.objects.create(
-				owner=request.user,
-				original_name=original_name,
-				target_format=out_ext.lstrip('.'),
-				file=cf,
-				meta={'retention_hours': 24}
-			)
-			stored.file.save(f"converted-{stored.pk}.{out_ext.lstrip('.')}", cf, save=True)
-			return stored
-		except Exception:
-			return None
-
-	# txt
-	if target == 'txt':
-		try:
-			text = content_bytes.decode('utf-8')
-		except Exception:
-			text = content_bytes.decode('latin1', errors='ignore')
-		data = text.encode('utf-8')
-		stored = _persist_bytes(data, 'txt', filename)
-		resp = Response(text, content_type='text/plain; charset=utf-8', headers={'Content-Disposition': f'attachment; filename="converted-{filename}.txt"'})
-		if stored:
-			resp.data = {'id': stored.id, 'download_url': stored.file.url, 'filename': stored.file.name}
-		return resp
+	headers = {'Content-Disposition': f'attachment; filename="converted-{filename}.{target}"'}
+	content_type = _converted_content_type(target)
+
+	if target in STREAMED and not persist:
+		return StreamingHttpResponse(buffered(convert_stream(upload, filename, target)), content_type=content_type, headers=headers)
 
-	# json
+	# Spool to disk once so the same bytes are both stored and sent back
+	out = tempfile.TemporaryFile()
+	try:
+		convert_to(upload, filename, target, out)
+	except RendererUnavailable as e:
+		out.close()
+		logger.exception('%s conversion library missing', target.upper())
+		return Response({'error': f'{target.upper()} conversion not available: install {e}'}, status=501)
+	except Exception as e:
+		out.close()
+		logger.exception('Failed to convert uploaded file')
+		return Response({'error': 'Failed to convert uploaded file', 'detail': str(e)}, status=500)
+	out.seek(0)
+	stored = _persist_converted(request.user, out, target, filename) if persist else None
+
+	if target == 'txt' and stored:
+		out.close()
+		return Response({'id': stored.id, 'download_url': stored.file.url, 'filename': stored.file.name})
 	if target == 'json':
-		try:
-			text = content_bytes.decode('utf-8')
-		except Exception:
-			text = content_bytes.decode('latin1', errors='ignore')
-		data = text.encode('utf-8')
-		stored = _persist_bytes(data, 'json', filename)
-		payload = {'filename': filename, 'content': text}
-		if stored:
-			payload.update({'id': stored.id, 'download_url': stored.file.url})
-		return Response(payload)
-
-	# pdf
-	if target == 'pdf':
-		try:
-			from io import BytesIO
-			from reportlab.pdfgen import canvas
-		except Exception as e:
-			logger.exception('PDF conversion library missing')
-			return Response({'error': 'PDF conversion not available: install reportlab', 'detail': str(e)}, status=501)
-		buffer = BytesIO()
-		p = canvas.Canvas(buffer)
-		y = 800
-		try:
-			text = content_bytes.decode('utf-8')
-		except Exception:
-			text = content_bytes.decode('latin1', errors='ignore')
-		for line in text.splitlines() or ['']:
-			if y < 40:
-				p.showPage()
-				y = 800
-			p.drawString(40, y, line)
-			p.drawString(40, y, line)
-			y -= 14
-		p.save()
-		buffer.seek(0)
-		pdf_bytes = buffer.getvalue()
-		stored = _persist_bytes(pdf_bytes, 'pdf', filename)
-		resp = Response(pdf_bytes, content_type='application/pdf', headers={'Content-Disposition': f'attachment; filename="converted-{filename}.pdf"'})
-		if stored:
-			resp['X-Converted-Id'] = str(stored.id)
-		return resp
+		out.close()
+		extra = {'id': stored.id, 'download_url': stored.file.url} if stored else {}
+		return StreamingHttpResponse(buffered(json_stream(source_text(upload, filename), filename=filename, **extra)), content_type=content_type)
+	out.seek(0)
+	resp = FileResponse(out, content_type=content_type, headers=headers)
+	if stored:
+		resp['X-Converted-Id'] = str(stored.id)
+	return resp
+
+
+def _persist_converted(user, f, target: str, original_name: str):
+	"""Store a converted file for the user; None if that fails."""
+	if not user.is_authenticated:
+		return None
+	from django.core.files import File
+	try:
+		stored = ConvertedFile.objects.create(owner=user, original_name=original_name, target_format=target, meta={'retention_hours': 24})
+		stored.file.save(f'converted-{stored.pk}.{target}', File(f), save=True)
+		return stored
+	except Exception:
+		logger.exception('Failed to store converted file')
+		return None
+
+
+def _job_payload(job) -> dict:
+	return {
+		'id': job.id,
+		'status': job.status,
+		'original_name': job.original_name,
+		'target_format': job.target_format,
+		'error': job.error or None,
+		'created_at': job.created_at.isoformat(),
+		'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+		'result': {'id': job.result.id, 'download_url': job.result.file.url} if job.result else None,
+	}
 
-	# docx
-	if target == 'docx':
-		try:
-			from io import BytesIO
-			import docx
-		except Exception as e:
-			logger.exception('DOCX conversion library missing')
-			return Response({'error': 'DOCX conversion not available: install python-docx', 'detail': str(e)}, status=501)
-		buffer = BytesIO()
-		try:
-			text = content_bytes.decode('utf-8')
-		except Exception:
-			text = content_bytes.decode('latin1', errors='ignore')
-		doc = docx.Document()
-		for line in text.splitlines():
-			doc.add_paragraph(line)
-		doc.save(buffer)
-		buffer.seek(0)
-		docx_bytes = buffer.getvalue()
-		stored = _persist_bytes(docx_bytes, 'docx', filename)
-		resp = Response(docx_bytes, content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document', headers={'Content-Disposition': f'attachment; filename="converted-{filename}.docx"'})
-		if stored:
-			resp['X-Converted-Id'] = str(stored.id)
-		return resp
 
-	# pptx
-	if target == 'pptx':
-		try:
-			from io import BytesIO
-			from pptx import Presentation
-		except Exception as e:
-			logger.exception('PPTX conversion library missing')
-			return Response({'error': 'PPTX conversion not available: install python-pptx', 'detail': str(e)}, status=501)
-		prs = Presentation()
-		slide_layout = prs.slide_layouts[1] if len(prs.slide_layouts) > 1 else prs.slide_layouts[0]
-		try:
-			text = content_bytes.decode('utf-8')
-		except Exception:
-			text = content_bytes.decode('latin1', errors='ignore')
-		for block in text.split('\n\n'):
-			slide = prs.slides.add_slide(slide_layout)
-			if slide.shapes.title:
-				slide.shapes.title.text = (block or '')[:200]
-		buffer = BytesIO()
-		prs.save(buffer)
-		buffer.seek(0)
-		pptx_bytes = buffer.getvalue()
-		stored = _persist_bytes(pptx_bytes, 'pptx', filename)
-		resp = Response(pptx_bytes, content_type='application/vnd.openxmlformats-officedocument.presentationml.presentation', headers={'Content-Disposition': f'attachment; filename="converted-{filename}.pptx"'})
-		if stored:
-			resp['X-Converted-Id'] = str(stored.id)
-		return resp
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def submit_conversion_job(request):
+	"""Queue a conversion on the process pool (documents/engine.py). Same form fields as convert_document.
+	Returns 202 with the job id; poll the job, then download its ConvertedFile.
+	"""
+	# Checked before request.FILES/POST so an oversized body is never parsed
+	if _declared_too_large(request):
+		return _too_large()
+	upload = request.FILES.get('file')
+	target = (request.POST.get('format') or 'txt').lower()
+	error = _upload_error(upload, target)
+	if error:
+		return error
+	filename = getattr(upload, 'name', '') or 'upload'
+	job = ConversionJob.objects.create(owner=request.user, original_name=filename, target_format=target)
+	job.source.save(f'{job.pk}-source', upload, save=True)
+	try:
+		engine.submit(job)
+	except Exception as e:
+		logger.exception('Could not queue conversion job %s', job.pk)
+		job.status, job.error, job.finished_at = 'failed', f'could not queue: {e}', timezone.now()
+		job.source.delete(save=False)
+		job.save(update_fields=['status', 'error', 'finished_at', 'source'])
+		return Response(_job_payload(job), status=503)
+	job.refresh_from_db()
+	return Response(_job_payload(job), status=202, headers={'Location': f'/api/documents/convert/jobs/{job.pk}/'})
 
-	# unsupported
-	return Response({'error': 'Conversion for requested format not available on server. Install appropriate libraries (python-docx, reportlab, python-pptx) to enable.'}, status=501)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def conversion_job_status(request, pk: int):
+	try:
+		job = ConversionJob.objects.select_related('result').get(pk=pk, owner=request.user)
+	except ConversionJob.DoesNotExist:
+		return Response({'detail': 'Not found'}, status=404)
+	engine.expire_stale(job)
+	return Response(_job_payload(job))
 
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def download_conversion_job(request, pk: int):
+	try:
+		job = ConversionJob.objects.select_related('result').get(pk=pk, owner=request.user)
+	except ConversionJob.DoesNotExist:
+		return Response({'detail': 'Not found'}, status=404)
+	if job.status != 'done' or job.result is None or not job.result.file:
+		return Response({'error': f'job is {job.status}', 'status': job.status}, status=409)
+	name = f'converted-{job.original_name}.{job.target_format}'
+	return FileResponse(job.result.file.open('rb'), content_type=_converted_content_type(job.target_format), as_attachment=True, filename=name)
 
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 def convert_capabilities(request):
 	"""Report which conversion formats are available on the server."""
-	formats = ['txt', 'json']
+	formats = ['txt', 'json', 'pdf']
 	# optional libraries
-	try:
-		import reportlab  # type: ignore
-		formats.append('pdf')
-	except Exception:
-		pass
 	try:
 		import docx as _docx  # type: ignore
 		formats.append('docx')
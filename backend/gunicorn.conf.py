@@ -0,0 +1,33 @@
+"""Gunicorn settings (picked up automatically from the working directory).
+
+Workers must not share the Mongo client: with `--preload` (or `preload_app = True`) the app is
+imported in the master, so anything created there would be inherited by every worker.
+services.mongo drops an inherited client after fork; this file also warms each worker's pool
+once the app is loaded, so the first request doesn't pay connection setup.
+"""
+import logging
+import os
+import sys
+
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+preload_app = os.getenv('GUNICORN_PRELOAD', 'false').lower() == 'true'
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    mongo = sys.modules.get('services.mongo')
+    if mongo is not None:  # preloaded app: forget the master's client
+        mongo.reset_client()
+
+
+def post_worker_init(worker):
+    if os.getenv('MONGODB_WARM_ON_BOOT', 'true').lower() != 'true':
+        return
+    try:
+        from services.mongo import warm_pool
+        result = warm_pool()
+        worker.log.info('Mongo pool warmed: %s connection(s) in %sms', result['connections'], result['elapsed_ms'])
+    except Exception as e:  # Mongo down at boot must not stop the worker
+        logging.getLogger(__name__).warning('Mongo pool warm-up failed: %s', e)
@@ -1,7 +1,18 @@
 from django.http import JsonResponse
 from django.conf import settings
-from services.mongo import get_client
-from services.ai import chat_complete
+from services.mongo import get_client, pool_stats
+from documents.engine import engine_stats
+from documents.export_cache import export_cache_stats
+from services.ai import probe
+from services.ai_cache import cache_stats
+from services.ai_hedge import hedge_stats
+from services.ai_limits import limits_stats
+from services.chat_writer import writer_stats
+from services.memory import memory_totals
+from services.raw_store import raw_stats
+from services.conversations import session_stats
+from services.ai_router import router_state
+from services.transport import transport_stats
 import time
 
 
@@ -31,14 +42,14 @@ def health_view(_request):
 
     # OpenAI minimal check (only if key configured)
     if settings.OPENAI_API_KEY:
-        test = chat_complete([{"role": "user", "content": "ping"}], temperature=0)
+        test = probe('openai')
         if 'error' in test:
             openai_status = f"error: {test['error'][:120]}"
         else:
             openai_status = 'ok'
     # Gemini minimal check
     if getattr(settings, 'GEMINI_API_KEY', ''):
-        test = chat_complete([{"role": "user", "content": "ping"}], temperature=0, provider='gemini')
+        test = probe('gemini')
         if 'error' in test:
             gemini_status = f"error: {test['error'][:120]}"
         else:
@@ -61,3 +72,27 @@ def health_view(_request):
     if isinstance(payload.get('gemini'), str) and '503' in payload['gemini']:
         payload['gemini_hint'] = "Gemini service unavailable (503). This is often transient. Retry shortly; if persistent, check API quota/billing, model availability in your region, and firewall/proxy settings."
     return JsonResponse(payload)
+
+
+def metrics_view(_request):
+    """Runtime counters for monitoring (provider connection pools, ...)."""
+    return JsonResponse({
+        'version': getattr(settings, 'APP_VERSION', 'unknown'),
+        'ai_transport': transport_stats(),
+        'ai_cache': cache_stats(),
+        'ai_router': router_state(),
+        'ai_hedge': hedge_stats(),
+        'ai_limits': limits_stats(),
+        'chat_writer': writer_stats(),
+        'chat_sessions': session_stats(),
+        'ai_memory': memory_totals(),
+        'chat_raw': raw_stats(),
+        'mongo_pool': pool_stats(),
+        'document_exports': export_cache_stats(),
+        'conversion_jobs': engine_stats(),
+    })
+
+
+def mongo_pool_view(_request):
+    """Mongo client pool settings and connection counters for this worker process."""
+    return JsonResponse(pool_stats())
@@ -1,6 +1,8 @@
 import traceback
 import logging
 import os
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from whitenoise.middleware import WhiteNoiseMiddleware
 
 logger = logging.getLogger('exception_logger')
 
@@ -8,35 +10,93 @@ class ExceptionLoggingMiddleware:
     """Middleware that logs full tracebacks of unhandled exceptions to server-exceptions.log
     to aid debugging on development machines where stdout may be redirected.
     """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
         try:
             return self.get_response(request)
-        except Exception as exc:
-            tb = traceback.format_exc()
-            try:
-                with open('server-exceptions.log', 'a', encoding='utf-8') as f:
-                    f.write('\n' + ('='*80) + '\n')
-                    f.write(tb)
-            except Exception:
-                logger.exception('Failed to write server-exceptions.log')
+        except Exception:
+            self._log_traceback()
             # re-raise so normal Django error handling continues
             raise
 
+    async def __acall__(self, request):
+        try:
+            return await self.get_response(request)
+        except Exception:
+            self._log_traceback()
+            raise
+
+    @staticmethod
+    def _log_traceback():
+        tb = traceback.format_exc()
+        try:
+            with open('server-exceptions.log', 'a', encoding='utf-8') as f:
+                f.write('\n' + ('='*80) + '\n')
+                f.write(tb)
+        except Exception:
+            logger.exception('Failed to write server-exceptions.log')
+
 class SecurityHeadersMiddleware:
     """Add additional security headers (CSP, Referrer-Policy, Permissions-Policy).
     CSP value can be overridden with the CSP_HEADER env var.
     """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
         self.csp = os.getenv('CSP_HEADER', "default-src 'self'; img-src 'self' data:; media-src 'self' data:; object-src 'none'; frame-ancestors 'none'; base-uri 'self'; form-action 'self'")
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        response = self.get_response(request)
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self._add_headers(self.get_response(request))
+
+    async def __acall__(self, request):
+        return self._add_headers(await self.get_response(request))
+
+    def _add_headers(self, response):
         response.headers.setdefault('Content-Security-Policy', self.csp)
         response.headers.setdefault('Referrer-Policy', 'strict-origin-when-cross-origin')
         response.headers.setdefault('Permissions-Policy', 'camera=(), microphone=(), geolocation=()')
         response.headers.setdefault('X-Content-Type-Options', 'nosniff')
         return response
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoise with an async code path.
+    Stock WhiteNoiseMiddleware is sync-only, which under ASGI forces Django to run the whole
+    request chain through its single sync thread. Here only actual static file hits touch a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        return await self.get_response(request)
@@ -45,7 +45,7 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  # <-- must be first after SecurityMiddleware
     'django.middleware.common.CommonMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'novabot_backend.middleware.StaticFilesMiddleware',  # WhiteNoise, async-capable for ASGI
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -132,8 +132,36 @@ MONGODB_HOST = os.getenv('MONGODB_HOST', 'localhost')  # e.g. cluster0.xxxxx.mon
 MONGODB_PARAMS = os.getenv('MONGODB_PARAMS', 'retryWrites=true&w=majority')
 MONGODB_DB_NAME = os.getenv('MONGODB_DB_NAME', 'novabot')
 MONGODB_COLLECTION_DOCUMENTS = os.getenv('MONGODB_COLLECTION_DOCUMENTS', 'documents')
-MONGODB_COLLECTION_CHATS = os.getenv('MONGODB_COLLECTION_CHATS', 'chat_sessions')
+MONGODB_COLLECTION_CHATS = os.getenv('MONGODB_COLLECTION_CHATS', 'chat_sessions')  # one document per chat turn
+MONGODB_COLLECTION_CONVERSATIONS = os.getenv('MONGODB_COLLECTION_CONVERSATIONS', 'conversations')
+MONGODB_COLLECTION_CHAT_RAW = os.getenv('MONGODB_COLLECTION_CHAT_RAW', 'chat_raw')  # provider payloads, keyed by chat record id
+CONVERSATION_CACHE_SIZE = int(os.getenv('CONVERSATION_CACHE_SIZE', '10000'))  # hot conversations/sessions kept in memory per process
+CONVERSATION_CACHE_TTL = float(os.getenv('CONVERSATION_CACHE_TTL', '3600'))
 MONGODB_AUTH_SOURCE = os.getenv('MONGODB_AUTH_SOURCE', '')  # e.g., 'admin' or your DB name
+# Client pool (one MongoClient per process, rebuilt after fork; see services/mongo.py)
+MONGODB_MAX_POOL_SIZE = int(os.getenv('MONGODB_MAX_POOL_SIZE', '100'))
+MONGODB_MIN_POOL_SIZE = int(os.getenv('MONGODB_MIN_POOL_SIZE', '0'))  # connections kept open per worker
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv('MONGODB_MAX_IDLE_TIME_MS', '0'))  # 0 = never close idle connections
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGODB_WAIT_QUEUE_TIMEOUT_MS', '0'))  # 0 = wait for a free connection indefinitely
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv('MONGODB_CONNECT_TIMEOUT_MS', '20000'))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', '30000'))
+MONGODB_COMPRESSORS = os.getenv('MONGODB_COMPRESSORS', '')  # wire compression, e.g. 'zstd,zlib' (zstd requires zstandard, pinned in requirements.txt)
+MONGODB_ZLIB_LEVEL = int(os.getenv('MONGODB_ZLIB_LEVEL', '1'))
+MONGODB_WARM_CONNECTIONS = int(os.getenv('MONGODB_WARM_CONNECTIONS', '2'))  # opened at gunicorn worker boot
+MONGODB_ASYNC_FALLBACK_WORKERS = int(os.getenv('MONGODB_ASYNC_FALLBACK_WORKERS', '8'))  # async views without motor/AsyncMongoClient
+CHAT_EXPORT_BATCH_SIZE = int(os.getenv('CHAT_EXPORT_BATCH_SIZE', '500'))  # documents per cursor round trip for /api/chat/export/
+
+# Write-behind chat persistence (services/chat_writer.py)
+CHAT_WRITE_BEHIND = os.getenv('CHAT_WRITE_BEHIND', 'true').lower() == 'true'  # false = insert_one in the request
+CHAT_WRITE_BATCH_SIZE = int(os.getenv('CHAT_WRITE_BATCH_SIZE', '100'))
+CHAT_WRITE_FLUSH_INTERVAL = float(os.getenv('CHAT_WRITE_FLUSH_INTERVAL', '0.5'))  # seconds
+CHAT_WRITE_QUEUE_MAX = int(os.getenv('CHAT_WRITE_QUEUE_MAX', '10000'))
+CHAT_WRITE_QUEUE_POLICY = os.getenv('CHAT_WRITE_QUEUE_POLICY', 'block')  # block | spill | drop when the queue is full
+CHAT_WRITE_BLOCK_TIMEOUT = float(os.getenv('CHAT_WRITE_BLOCK_TIMEOUT', '0.5'))  # 'block': wait this long, then spill
+CHAT_WRITE_SPILL_PATH = os.getenv('CHAT_WRITE_SPILL_PATH', str(BASE_DIR / 'chat-spill.jsonl'))  # each process appends to <path>.<pid>; '' = no spill file
+CHAT_WRITE_SPILL_MAX_BYTES = int(os.getenv('CHAT_WRITE_SPILL_MAX_BYTES', str(50 * 1024 * 1024)))
+CHAT_WRITE_REPLAY_INTERVAL = float(os.getenv('CHAT_WRITE_REPLAY_INTERVAL', '30'))  # seconds between spill replays
+CHAT_WRITE_SHUTDOWN_TIMEOUT = float(os.getenv('CHAT_WRITE_SHUTDOWN_TIMEOUT', '10'))
 
 # OpenAI / AI settings
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
@@ -142,6 +170,75 @@ AI_DEFAULT_TEMPERATURE = float(os.getenv('AI_DEFAULT_TEMPERATURE', '0.7'))
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
 GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')
 
+# Provider HTTP transport: one pooled keep-alive session per provider per process
+AI_HTTP_POOL_CONNECTIONS = int(os.getenv('AI_HTTP_POOL_CONNECTIONS', '4'))  # distinct hosts cached per provider
+AI_HTTP_POOL_MAXSIZE = int(os.getenv('AI_HTTP_POOL_MAXSIZE', '20'))  # sockets kept alive per host
+AI_HTTP_POOL_BLOCK = os.getenv('AI_HTTP_POOL_BLOCK', 'false').lower() == 'true'  # wait for a free socket instead of overflowing
+AI_HTTP_CONNECT_TIMEOUT = float(os.getenv('AI_HTTP_CONNECT_TIMEOUT', '5'))
+AI_HTTP_READ_TIMEOUT = float(os.getenv('AI_HTTP_READ_TIMEOUT', '60'))
+AI_HTTP_KEEPALIVE = os.getenv('AI_HTTP_KEEPALIVE', 'true').lower() == 'true'
+AI_HTTP_HTTP2 = os.getenv('AI_HTTP_HTTP2', 'false').lower() == 'true'  # requires httpx[http2]
+AI_HTTP_COMPRESS_MIN_BYTES = int(os.getenv('AI_HTTP_COMPRESS_MIN_BYTES', '0'))  # gzip request bodies >= N bytes; 0 disables
+
+# Completion cache (services/ai_cache.py): on by default only for temperature == 0 requests
+AI_CACHE_ENABLED = os.getenv('AI_CACHE_ENABLED', 'true').lower() == 'true'
+AI_CACHE_MAX_ENTRIES = int(os.getenv('AI_CACHE_MAX_ENTRIES', '1024'))
+AI_CACHE_TTL = float(os.getenv('AI_CACHE_TTL', '3600'))  # seconds
+AI_CACHE_BACKEND = os.getenv('AI_CACHE_BACKEND', '')  # '' (in-process only) | 'sqlite' | dotted path to a backend class
+AI_CACHE_SQLITE_PATH = os.getenv('AI_CACHE_SQLITE_PATH', str(BASE_DIR / 'ai-cache.sqlite3'))
+
+# provider='auto' router (services/ai_router.py): EWMA latency/error tracking + circuit breakers
+AI_ROUTER_EWMA_ALPHA = float(os.getenv('AI_ROUTER_EWMA_ALPHA', '0.2'))
+AI_ROUTER_FAILURE_THRESHOLD = int(os.getenv('AI_ROUTER_FAILURE_THRESHOLD', '5'))  # consecutive failures that open the breaker
+AI_ROUTER_ERROR_RATE_THRESHOLD = float(os.getenv('AI_ROUTER_ERROR_RATE_THRESHOLD', '0.5'))
+AI_ROUTER_MIN_REQUESTS = int(os.getenv('AI_ROUTER_MIN_REQUESTS', '10'))  # before the error-rate rule applies
+AI_ROUTER_COOLDOWN = float(os.getenv('AI_ROUTER_COOLDOWN', '30'))  # seconds an open breaker waits before a probe
+
+# Hedged requests (services/ai_hedge.py): race a secondary provider when the primary is slow
+AI_HEDGE_ENABLED = os.getenv('AI_HEDGE_ENABLED', 'false').lower() == 'true'  # per-request 'hedge' flag overrides
+AI_HEDGE_PERCENTILE = float(os.getenv('AI_HEDGE_PERCENTILE', '95'))  # primary latency percentile used as the hedge delay
+AI_HEDGE_MIN_SAMPLES = int(os.getenv('AI_HEDGE_MIN_SAMPLES', '20'))
+AI_HEDGE_MIN_DELAY_MS = float(os.getenv('AI_HEDGE_MIN_DELAY_MS', '500'))
+AI_HEDGE_DEFAULT_DELAY_MS = float(os.getenv('AI_HEDGE_DEFAULT_DELAY_MS', '2000'))  # until enough samples exist
+AI_HEDGE_MAX_WORKERS = int(os.getenv('AI_HEDGE_MAX_WORKERS', '32'))  # threads for hedged calls, primaries and secondaries alike
+
+# Context packing (services/context.py): fit system prompt + most recent turns into the model window
+AI_CONTEXT_MAX_PROMPT_TOKENS = int(os.getenv('AI_CONTEXT_MAX_PROMPT_TOKENS', '32000'))  # cost cap, below the model window
+AI_CONTEXT_RESERVE_TOKENS = int(os.getenv('AI_CONTEXT_RESERVE_TOKENS', '1024'))  # left free for the completion
+AI_CONTEXT_DEFAULT_WINDOW = int(os.getenv('AI_CONTEXT_DEFAULT_WINDOW', '8192'))  # models missing from the table
+AI_CONTEXT_MAX_MESSAGES = int(os.getenv('AI_CONTEXT_MAX_MESSAGES', '500'))
+
+# Provider raw payload retention (services/raw_store.py)
+AI_RAW_RETENTION = os.getenv('AI_RAW_RETENTION', 'compress')  # drop | sample | compress
+AI_RAW_SAMPLE_RATE = float(os.getenv('AI_RAW_SAMPLE_RATE', '0.01'))  # 'sample': fraction of payloads kept
+AI_RAW_ZSTD_LEVEL = int(os.getenv('AI_RAW_ZSTD_LEVEL', '3'))  # zstandard is in requirements.txt; zlib is only the fallback
+
+# Rolling-summary conversation memory (services/memory.py)
+AI_MEMORY_ENABLED = os.getenv('AI_MEMORY_ENABLED', 'false').lower() == 'true'  # default when a request omits `memory`
+AI_MEMORY_TRIGGER_TOKENS = int(os.getenv('AI_MEMORY_TRIGGER_TOKENS', '3000'))  # summarize once turns exceed this
+AI_MEMORY_KEEP_TOKENS = int(os.getenv('AI_MEMORY_KEEP_TOKENS', '1500'))  # newest turns always sent verbatim
+AI_MEMORY_SUMMARY_WORDS = int(os.getenv('AI_MEMORY_SUMMARY_WORDS', '250'))
+AI_MEMORY_PROVIDER = os.getenv('AI_MEMORY_PROVIDER', '')  # summarizer provider/model; empty = same as the chat
+AI_MEMORY_MODEL = os.getenv('AI_MEMORY_MODEL', '')
+AI_MEMORY_CACHE_SIZE = int(os.getenv('AI_MEMORY_CACHE_SIZE', '10000'))
+AI_MEMORY_TTL = float(os.getenv('AI_MEMORY_TTL', '86400'))
+AI_MEMORY_WORKERS = int(os.getenv('AI_MEMORY_WORKERS', '2'))
+
+# Batch document generation (documents/generate/batch/)
+AI_BATCH_CONCURRENCY = int(os.getenv('AI_BATCH_CONCURRENCY', '8'))  # concurrent provider calls per batch request
+AI_BATCH_MAX_ITEMS = int(os.getenv('AI_BATCH_MAX_ITEMS', '50'))
+
+# Client-side admission control per provider API key (services/ai_limits.py); 0 = unlimited
+AI_LIMITS_ENABLED = os.getenv('AI_LIMITS_ENABLED', 'true').lower() == 'true'
+AI_LIMIT_OPENAI_RPM = float(os.getenv('AI_LIMIT_OPENAI_RPM', '500'))
+AI_LIMIT_OPENAI_TPM = float(os.getenv('AI_LIMIT_OPENAI_TPM', '200000'))
+AI_LIMIT_GEMINI_RPM = float(os.getenv('AI_LIMIT_GEMINI_RPM', '300'))
+AI_LIMIT_GEMINI_TPM = float(os.getenv('AI_LIMIT_GEMINI_TPM', '1000000'))
+AI_LIMIT_MAX_IN_FLIGHT = int(os.getenv('AI_LIMIT_MAX_IN_FLIGHT', '32'))  # concurrent calls per key
+AI_LIMIT_QUEUE_TIMEOUT = float(os.getenv('AI_LIMIT_QUEUE_TIMEOUT', '10'))  # seconds a call may queue before a local 429
+AI_LIMIT_COMPLETION_TOKENS = int(os.getenv('AI_LIMIT_COMPLETION_TOKENS', '512'))  # reserved per call, refunded from usage
+AI_LIMIT_429_PAUSE = float(os.getenv('AI_LIMIT_429_PAUSE', '2'))  # pause after an upstream 429 without Retry-After
+
 # DRF defaults
 REST_FRAMEWORK.update({
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
@@ -170,6 +267,22 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Rendered PDF/DOCX/PPTX exports cached on disk (documents/export_cache.py)
+DOCUMENT_EXPORT_CACHE_ENABLED = os.getenv('DOCUMENT_EXPORT_CACHE_ENABLED', 'true').lower() == 'true'
+DOCUMENT_EXPORT_CACHE_DIR = os.getenv('DOCUMENT_EXPORT_CACHE_DIR', str(MEDIA_ROOT / 'export-cache'))
+DOCUMENT_EXPORT_CACHE_MAX_BYTES = int(os.getenv('DOCUMENT_EXPORT_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))  # LRU eviction beyond this
+
+# Uploads to /api/documents/convert/ (documents/converters.py)
+CONVERT_MAX_UPLOAD_BYTES = int(os.getenv('CONVERT_MAX_UPLOAD_BYTES', str(50 * 1024 * 1024)))  # larger uploads get a 413
+CONVERT_CHUNK_SIZE = int(os.getenv('CONVERT_CHUNK_SIZE', str(64 * 1024)))  # bytes read/decoded per step
+CONVERT_MAX_LINE_CHARS = int(os.getenv('CONVERT_MAX_LINE_CHARS', str(64 * 1024)))  # longer input lines are cut into pieces of this size
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(os.getenv('FILE_UPLOAD_MAX_MEMORY_SIZE', str(2621440)))  # larger uploads spool to a temp file
+# Conversion jobs run on a process pool per web process (documents/engine.py)
+CONVERT_WORKERS = int(os.getenv('CONVERT_WORKERS', '0'))  # 0 = one per CPU core
+CONVERT_START_METHOD = os.getenv('CONVERT_START_METHOD', 'spawn')  # spawn | forkserver | fork
+CONVERT_JOB_TIMEOUT = int(os.getenv('CONVERT_JOB_TIMEOUT', '600'))  # seconds without a heartbeat from its owning process before a queued job is reported failed
+CONVERT_HEARTBEAT_INTERVAL = int(os.getenv('CONVERT_HEARTBEAT_INTERVAL', '30'))  # keep well below CONVERT_JOB_TIMEOUT
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Application version (can be overridden via environment for deploy automation)
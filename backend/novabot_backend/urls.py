@@ -19,7 +19,7 @@ from django.urls import path, include, re_path
 from django.http import JsonResponse, HttpResponse
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 from django.conf import settings
-from .health import health_view
+from .health import health_view, metrics_view, mongo_pool_view
 
 
 def root_view(_request):
@@ -32,6 +32,8 @@ def root_view(_request):
             'api_root': '/api/',
             'api_v1_root': '/api/v1/',  # version alias pointing to same routes (future-proof)
             'health': '/api/health/',
+            'metrics': '/api/health/metrics/',
+            'mongo_pool': '/api/health/mongo/',
             'schema': '/api/schema/',
             'docs': '/api/docs/',
             'auth': {
@@ -67,6 +69,8 @@ urlpatterns = [
     path('api/v1/', include('documents.urls')),
     path('api/v1/', include('chatbot.urls')),
     path('api/health/', health_view, name='health'),
+    path('api/health/metrics/', metrics_view, name='health-metrics'),
+    path('api/health/mongo/', mongo_pool_view, name='health-mongo'),
     # API schema & docs (unversioned for now)
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='docs'),
@@ -1,8 +1,17 @@
 import os
+import json
 import time
+import asyncio
+from functools import partial
 from django.conf import settings
 import requests
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterator, Optional, Tuple
+from services.ai_cache import cache_key, get_cache, should_cache
+from services.ai_limits import aacquire, acquire, get_limiter, limits_enabled, rejection, request_cost, retry_after, used_tokens
+from services.ai_hedge import ahedged_call, hedge_delay, hedge_enabled, hedged_call
+from services.ai_router import get_router, is_transient
+from services.memory import apply_memory, record_call, schedule_update
+from services.transport import AsyncProviderTransport, ProviderTransport, get_async_transport, get_transport
 
 OPENAI_API_BASE = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
 GEMINI_API_BASE = os.getenv('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com/v1beta')
@@ -18,115 +27,578 @@ def openai_chat(messages: List[Dict], model: str, temperature: float):
         return {"error": "OPENAI_API_KEY not configured"}
     url = f"{OPENAI_API_BASE}/chat/completions"
     try:
-        r = requests.post(url, json={"model": model, "messages": messages, "temperature": temperature}, headers={"Authorization": f"Bearer {api_key}"}, timeout=60)
+        r = get_transport('openai').post(url, json={"model": model, "messages": messages, "temperature": temperature}, headers={"Authorization": f"Bearer {api_key}"})
         r.raise_for_status()
-        data = r.json()
-        return {
-            'provider': 'openai',
-            'id': data.get('id'),
-            'model': data.get('model'),
-            'content': data.get('choices', [{}])[0].get('message', {}).get('content', ''),
-            'raw': data,
-            'usage': data.get('usage', {})
-        }
+        return _openai_result(r.json())
     except Exception as e:
-        return {"provider": "openai", "error": str(e)}
+        return {"provider": "openai", "error": str(e), "status_code": _error_status(e), "retry_after": _retry_after(e)}
 
 
-def _post_with_retries(url: str, payload: dict, headers: Optional[dict] = None, timeout: int = 60, retries: int = 2, backoff_base: float = 0.5):
+def _openai_result(data: dict) -> dict:
+    return {
+        'provider': 'openai',
+        'id': data.get('id'),
+        'model': data.get('model'),
+        'content': data.get('choices', [{}])[0].get('message', {}).get('content', ''),
+        'raw': data,
+        'usage': data.get('usage', {})
+    }
+
+
+def _post_with_retries(url: str, payload: dict, headers: Optional[dict] = None, timeout: Optional[float] = None, retries: int = 2, backoff_base: float = 0.5, transport: Optional[ProviderTransport] = None):
     """POST with simple exponential backoff for transient HTTP errors.
-    Retries on 429, 500, 502, 503, 504 and common request exceptions.
+    Retries on 429, 500, 502, 503, 504 and connection-level request exceptions; other HTTP errors
+    raise at once. With admission control on, a 429 is raised without retrying: the limiter pauses
+    the key from its Retry-After instead.
+    Uses the pooled provider transport (falls back to the 'default' one) so retries reuse connections.
     """
-    last_exc = None
+    transport = transport or get_transport('default')
     for attempt in range(retries + 1):
         try:
-            r = requests.post(url, json=payload, headers=headers or {}, timeout=timeout)
-            if r.status_code in (429, 500, 502, 503, 504):
-                last_exc = requests.HTTPError(f"{r.status_code} {r.reason}", response=r)
-                if attempt < retries:
-                    time.sleep(backoff_base * (2 ** attempt))
-                    continue
-                r.raise_for_status()
-            r.raise_for_status()
-            return r
-        except requests.RequestException as e:
-            last_exc = e
+            r = transport.post(url, json=payload, headers=headers or {}, timeout=timeout)
+        except requests.RequestException:
             if attempt < retries:
                 time.sleep(backoff_base * (2 ** attempt))
                 continue
             raise
-    # Should not reach here; raise the last exception to satisfy type checkers
-    if last_exc:
-        raise last_exc
+        if r.status_code == 429 and limits_enabled():
+            r.raise_for_status()
+        if r.status_code in (429, 500, 502, 503, 504) and attempt < retries:
+            time.sleep(backoff_base * (2 ** attempt))
+            continue
+        r.raise_for_status()
+        return r
 
 
-def gemini_chat(messages: List[Dict], model: str, temperature: float):
-    api_key = getattr(settings, 'GEMINI_API_KEY', '')
-    if not api_key:
-        return {"error": "GEMINI_API_KEY not configured"}
+def _gemini_payload(messages: List[Dict], temperature: float) -> dict:
     # Gemini expects a different structure
-    url = f"{GEMINI_API_BASE}/models/{model}:generateContent?key={api_key}"
     payload = {
         "contents": [
             {"parts": [{"text": m.get('content', '')}]} for m in messages if m.get('role') != 'system'
         ],
         "generationConfig": {"temperature": temperature}
     }
+    # System prompts (incl. conversation summaries) go to systemInstruction rather than being dropped
+    system_text = '\n\n'.join(m.get('content', '') for m in messages if m.get('role') == 'system' and m.get('content'))
+    if system_text:
+        payload["systemInstruction"] = {"parts": [{"text": system_text}]}
+    return payload
+
+
+def gemini_chat(messages: List[Dict], model: str, temperature: float):
+    api_key = getattr(settings, 'GEMINI_API_KEY', '')
+    if not api_key:
+        return {"error": "GEMINI_API_KEY not configured"}
+    url = f"{GEMINI_API_BASE}/models/{model}:generateContent?key={api_key}"
+    payload = _gemini_payload(messages, temperature)
     try:
-        r = _post_with_retries(url, payload, timeout=60, retries=2)
-        data = r.json()
+        r = _post_with_retries(url, payload, retries=2, transport=get_transport('gemini'))
+        return _gemini_result(r.json(), model)
+    except Exception as e:
+        return {"provider": "gemini", "error": str(e), "status_code": _error_status(e), "retry_after": _retry_after(e)}
+
+
+def _gemini_result(data: dict, model: str) -> dict:
+    text = ''
+    try:
+        text = data['candidates'][0]['content']['parts'][0]['text']
+    except Exception:
         text = ''
+    return {
+        'provider': 'gemini',
+        'model': model,
+        'content': text,
+        'raw': data
+    }
+
+
+def _error_status(exc: Exception) -> Optional[int]:
+    # Some request exceptions include a response attribute; access it safely.
+    resp = getattr(exc, 'response', None)
+    if resp is None:
+        return None
+    try:
+        return getattr(resp, 'status_code', None)
+    except Exception:
+        return None
+
+
+def _retry_after(exc: Exception) -> Optional[str]:
+    resp = getattr(exc, 'response', None)
+    try:
+        return resp.headers.get('Retry-After') if resp is not None else None
+    except Exception:
+        return None
+
+
+def _sse_data(resp: requests.Response) -> Iterator[dict]:
+    """Yield the JSON payload of each server-sent `data:` line until `[DONE]`."""
+    for line in resp.iter_lines(decode_unicode=True):
+        if not line or not line.startswith('data:'):
+            continue
+        data = line[5:].strip()
+        if data == '[DONE]':
+            return
         try:
-            text = data['candidates'][0]['content']['parts'][0]['text']
-        except Exception:
-            text = ''
-        return {
-            'provider': 'gemini',
-            'model': model,
-            'content': text,
-            'raw': data
-        }
+            yield json.loads(data)
+        except ValueError:
+            continue
+
+
+def openai_chat_stream(messages: List[Dict], model: str, temperature: float) -> Iterator[Dict]:
+    """Streamed variant of openai_chat.
+    Yields {'type': 'delta', 'content': ...} events, then one {'type': 'done', 'response': {...}}
+    shaped like openai_chat's result, or a single {'type': 'error', ...} event.
+    """
+    api_key = settings.OPENAI_API_KEY
+    if not api_key:
+        yield {'type': 'error', 'provider': 'openai', 'error': 'OPENAI_API_KEY not configured'}
+        return
+    url = f"{OPENAI_API_BASE}/chat/completions"
+    payload = {"model": model, "messages": messages, "temperature": temperature, "stream": True, "stream_options": {"include_usage": True}}
+    parts: List[str] = []
+    meta: Dict = {'id': None, 'model': model, 'usage': {}}
+    try:
+        with get_transport('openai').post(url, json=payload, headers={"Authorization": f"Bearer {api_key}"}, stream=True) as r:
+            r.raise_for_status()
+            for chunk in _sse_data(r):
+                meta['id'] = chunk.get('id') or meta['id']
+                meta['model'] = chunk.get('model') or meta['model']
+                if chunk.get('usage'):
+                    meta['usage'] = chunk['usage']
+                for choice in chunk.get('choices') or []:
+                    delta = (choice.get('delta') or {}).get('content')
+                    if delta:
+                        parts.append(delta)
+                        yield {'type': 'delta', 'content': delta}
+    except Exception as e:
+        yield {'type': 'error', 'provider': 'openai', 'error': str(e), 'status_code': _error_status(e), 'content': ''.join(parts)}
+        return
+    yield {'type': 'done', 'response': {'provider': 'openai', 'id': meta['id'], 'model': meta['model'], 'content': ''.join(parts), 'usage': meta['usage']}}
+
+
+def gemini_chat_stream(messages: List[Dict], model: str, temperature: float) -> Iterator[Dict]:
+    """Streamed variant of gemini_chat using streamGenerateContent with SSE framing."""
+    api_key = getattr(settings, 'GEMINI_API_KEY', '')
+    if not api_key:
+        yield {'type': 'error', 'provider': 'gemini', 'error': 'GEMINI_API_KEY not configured'}
+        return
+    url = f"{GEMINI_API_BASE}/models/{model}:streamGenerateContent?alt=sse&key={api_key}"
+    parts: List[str] = []
+    usage: Dict = {}
+    try:
+        with get_transport('gemini').post(url, json=_gemini_payload(messages, temperature), stream=True) as r:
+            r.raise_for_status()
+            for chunk in _sse_data(r):
+                usage = chunk.get('usageMetadata') or usage
+                for cand in (chunk.get('candidates') or [])[:1]:
+                    for part in (cand.get('content') or {}).get('parts') or []:
+                        delta = part.get('text')
+                        if delta:
+                            parts.append(delta)
+                            yield {'type': 'delta', 'content': delta}
     except Exception as e:
-        status = None
-        # Some request exceptions include a response attribute; access it safely.
-        resp = getattr(e, 'response', None)
-        if resp is not None:
-            try:
-                status = getattr(resp, 'status_code', None)
-            except Exception:
-                status = None
-        return {"provider": "gemini", "error": str(e), "status_code": status}
-
-
-def chat_complete(messages: List[Dict], model: Optional[str] = None, temperature: Optional[float] = None, provider: Optional[str] = None):
+        yield {'type': 'error', 'provider': 'gemini', 'error': str(e), 'status_code': _error_status(e), 'content': ''.join(parts)}
+        return
+    yield {'type': 'done', 'response': {'provider': 'gemini', 'model': model, 'content': ''.join(parts), 'usage': usage}}
+
+
+def _default_model(provider: str) -> str:
+    if provider == 'gemini':
+        return getattr(settings, 'GEMINI_MODEL', 'gemini-pro')
+    return settings.OPENAI_MODEL
+
+
+def _provider_configured(provider: str) -> bool:
+    if provider == 'gemini':
+        return bool(getattr(settings, 'GEMINI_API_KEY', ''))
+    return bool(settings.OPENAI_API_KEY)
+
+
+def _auto_candidates(messages: List[Dict], model: Optional[str] = None) -> List[Tuple[str, str]]:
+    """Configured (provider, model) targets for provider='auto', ranked by the router.
+    The old length heuristic (long prompts prefer Gemini) only breaks ties between equally-good targets.
+    An explicit model is applied to the provider it belongs to.
+    """
+    user_text = ' '.join(m.get('content','') for m in messages if m.get('role') == 'user')
+    order = ['gemini', 'openai'] if len(user_text) > 4000 else ['openai', 'gemini']
+    model_provider = ('gemini' if str(model).startswith('gemini') else 'openai') if model else None
+    candidates = [(p, model if p == model_provider else _default_model(p)) for p in order if _provider_configured(p)]
+    if not candidates:
+        # Nothing configured: let the preferred provider report its own configuration error
+        candidates = [(order[0], _default_model(order[0]))]
+    return get_router().rank(candidates)
+
+
+def _provider_fn(provider: str, stream: bool = False):
+    if provider == 'gemini':
+        return gemini_chat_stream if stream else gemini_chat
+    return openai_chat_stream if stream else openai_chat
+
+
+def probe(provider: str) -> Dict:
+    """A one-token health check straight to the provider: no completion cache, hedging,
+    admission control or router bookkeeping, so it reports the provider itself right now.
+    """
+    return _provider_fn(provider)([{"role": "user", "content": "ping"}], _default_model(provider), 0)
+
+
+def _record(provider: str, model: str, started: float, response: Dict):
+    """Report a finished call to the router; configuration errors and local throttling say nothing about provider health."""
+    if response.get('local_limit'):
+        return
+    ok = not response.get('error')
+    if ok or is_transient(response):
+        get_router().record(provider, model, (time.monotonic() - started) * 1000, ok, response.get('status_code'))
+
+
+def _release(limiter, ticket, response: Optional[Dict]):
+    response = response or {}
+    limiter.release(ticket, used_tokens=used_tokens(response), retry_after=retry_after(response))
+
+
+def _observed(provider: str, model: str, messages: List[Dict], temperature: float) -> Dict:
+    """One provider call behind the per-key admission controller, reported to the router."""
+    limiter = get_limiter(provider)
+    ticket = acquire(limiter, request_cost(messages)) if limiter is not None else None
+    if limiter is not None and ticket is None:
+        return rejection(provider, model)
+    response = None
+    try:
+        started = time.monotonic()
+        response = _provider_fn(provider)(messages, model, temperature)
+        _record(provider, model, started, response)
+        return response
+    finally:
+        if ticket is not None:
+            _release(limiter, ticket, response)
+
+
+def _all_open_error(attempts: List[Dict]) -> Dict:
+    return {'error': 'All AI providers are temporarily unavailable (circuit breakers open)', 'status_code': 503, 'routing': {'attempts': attempts}}
+
+
+def _route(candidates: List[Tuple[str, str]], messages: List[Dict], temperature: float) -> Dict:
+    """Try targets in router order, failing over to the next one on transient errors."""
+    router = get_router()
+    attempts: List[Dict] = []
+    response = None
+    for provider, model in candidates:
+        if not router.allow(provider, model):
+            attempts.append({'provider': provider, 'model': model, 'skipped': 'circuit_open'})
+            continue
+        try:
+            response = _observed(provider, model, messages, temperature)
+        finally:
+            router.release_probe(provider, model)
+        attempts.append({'provider': provider, 'model': model, 'ok': not response.get('error'), 'status_code': response.get('status_code')})
+        if not is_transient(response):
+            break
+    if response is None:
+        return _all_open_error(attempts)
+    response['routing'] = {'attempts': attempts}
+    return response
+
+
+def _observed_stream(provider: str, model: str, events: Iterator[Dict]) -> Iterator[Dict]:
+    started = time.monotonic()
+    for event in events:
+        if event.get('type') == 'done':
+            _record(provider, model, started, event.get('response') or {})
+        elif event.get('type') == 'error':
+            _record(provider, model, started, event)
+        yield event
+
+
+def _limited_stream(provider: str, model: str, messages: List[Dict], events: Iterator[Dict]) -> Iterator[Dict]:
+    """Admit a streamed call before its first event; the in-flight slot is held until the stream ends."""
+    limiter = get_limiter(provider)
+    if limiter is None:
+        yield from events
+        return
+    ticket = acquire(limiter, request_cost(messages))
+    if ticket is None:
+        events.close()
+        yield dict(rejection(provider, model), type='error')
+        return
+    final: Dict = {}
+    try:
+        for event in events:
+            if event.get('type') == 'done':
+                final = event.get('response') or {}
+            elif event.get('type') == 'error':
+                final = event
+            yield event
+    finally:
+        _release(limiter, ticket, final)
+
+
+def _route_stream(candidates: List[Tuple[str, str]], messages: List[Dict], temperature: float) -> Iterator[Dict]:
+    """Streamed routing: fail over only while nothing has been sent (transient error before the first delta)."""
+    router = get_router()
+    attempts: List[Dict] = []
+    for i, (provider, model) in enumerate(candidates):
+        if not router.allow(provider, model):
+            attempts.append({'provider': provider, 'model': model, 'skipped': 'circuit_open'})
+            continue
+        # The finally also covers a client that stops reading mid-stream (GeneratorExit at a yield)
+        try:
+            events = _limited_stream(provider, model, messages, _observed_stream(provider, model, _provider_fn(provider, stream=True)(messages, model, temperature)))
+            first = next(events, None)
+            attempts.append({'provider': provider, 'model': model, 'ok': not (first or {}).get('error'), 'status_code': (first or {}).get('status_code')})
+            if first is not None and first.get('type') == 'error' and is_transient(first) and i < len(candidates) - 1:
+                continue
+            if first is not None:
+                yield first
+            yield from events
+            return
+        finally:
+            router.release_probe(provider, model)
+    yield dict(_all_open_error(attempts), type='error')
+
+
+def _hedge_targets(provider: str, model: Optional[str], messages: List[Dict]) -> Optional[List[Tuple[str, str]]]:
+    """(primary, secondary) for a hedged call, or None when there is no second provider to hedge with.
+    Targets whose circuit breaker would turn the request away are left out.
+    """
+    router = get_router()
+    if provider == 'auto':
+        targets = [t for t in _auto_candidates(messages, model) if router.available(*t)]
+    else:
+        other = 'gemini' if provider == 'openai' else 'openai'
+        targets = [(provider, model or _default_model(provider))]
+        if _provider_configured(other) and router.available(other, _default_model(other)):
+            targets.append((other, _default_model(other)))
+    return targets[:2] if len(targets) >= 2 else None
+
+
+def _breaker_open(provider: str, model: str) -> Dict:
+    return {'provider': provider, 'model': model, 'error': 'circuit breaker open', 'skipped': 'circuit_open'}
+
+
+def _gated(provider: str, model: str, messages: List[Dict], temperature: float) -> Dict:
+    """_observed behind the target's circuit breaker, for hedged calls to a routed target."""
+    router = get_router()
+    if not router.allow(provider, model):
+        return _breaker_open(provider, model)
+    try:
+        return _observed(provider, model, messages, temperature)
+    finally:
+        router.release_probe(provider, model)
+
+
+def _hedged(targets: List[Tuple[str, str]], messages: List[Dict], temperature: float, routed: bool = False) -> Dict:
+    """Hedge targets[0] with targets[1]. The secondary always passes its breaker; the primary only
+    when it was routed (an explicit provider is called as asked, like an unhedged call).
+    """
+    (p1, m1), (p2, m2) = targets
+    delay = hedge_delay(get_router().stats_for(p1, m1))
+    primary = partial(_gated if routed else _observed, p1, m1, messages, temperature)
+    return hedged_call(primary, partial(_gated, p2, m2, messages, temperature), delay)
+
+
+def chat_complete_stream(messages: List[Dict], model: Optional[str] = None, temperature: Optional[float] = None, provider: Optional[str] = None) -> Iterator[Dict]:
+    """Streaming counterpart of chat_complete: yields delta events followed by a done/error event."""
+    messages = _normalize_messages(messages)
+    temp = temperature if temperature is not None else settings.AI_DEFAULT_TEMPERATURE
+    provider = provider or 'openai'
+    if provider == 'auto':
+        return _route_stream(_auto_candidates(messages, model), messages, temp)
+    if provider in ('openai', 'gemini'):
+        mdl = model or _default_model(provider)
+        return _limited_stream(provider, mdl, messages, _observed_stream(provider, mdl, _provider_fn(provider, stream=True)(messages, mdl, temp)))
+    return iter([{'type': 'error', 'error': f"Unknown provider '{provider}'"}])
+
+
+def _summarizer(provider: Optional[str], model: Optional[str]):
+    """Completion used by the memory module to fold old turns into a conversation summary."""
+    memory_provider = getattr(settings, 'AI_MEMORY_PROVIDER', '')
+    model = getattr(settings, 'AI_MEMORY_MODEL', '') or (None if memory_provider else model)
+    return partial(chat_complete, model=model, temperature=0.0, provider=memory_provider or provider, cache=False)
+
+
+def remember_turn(memory: str, messages: List[Dict], response: Dict, info: Dict, latency_ms: float, provider: Optional[str] = None, model: Optional[str] = None):
+    """Account a finished call against conversation `memory` and refresh its summary in the background.
+    `messages` is the full (unsummarized) context that was passed to apply_memory.
+    """
+    record_call(memory, info, latency_ms)
+    if response and not response.get('error') and response.get('content'):
+        schedule_update(memory, messages + [{'role': 'assistant', 'content': response['content']}], _summarizer(provider, model))
+
+
+def chat_complete(messages: List[Dict], model: Optional[str] = None, temperature: Optional[float] = None, provider: Optional[str] = None, stream: bool = False, cache: Optional[bool] = None, hedge: Optional[bool] = None, memory: Optional[str] = None):
     """Unified chat interface.
     provider: openai | gemini | auto
-    If provider is auto, route based on heuristic:
-      - If question looks like a factual query (contains 'latest' or 'according to' or '?') and PERPLEXITY key present -> perplexity
-      - Else if long context (> 4000 chars) and Gemini key present -> gemini
-      - Else openai.
+    If provider is auto, the router (services.ai_router) picks the fastest healthy configured
+    provider from its EWMA latency/error stats, skips targets whose circuit breaker is open and
+    fails over to the next target on transient errors (429/5xx/network). The response then
+    carries a 'routing' entry listing the attempts.
+    With stream=True an iterator of incremental events is returned instead (see chat_complete_stream).
+    cache: serve/store identical requests from the completion cache (default: only when temperature == 0);
+    concurrent identical calls share one upstream request.
+    hedge: if the primary provider has not answered within its latency percentile, also ask the
+    secondary one and return whichever succeeds first (default: AI_HEDGE_ENABLED; buffered calls only).
+    The response then carries a 'hedge' entry saying which path won.
+    memory: a conversation key. Turns already folded into that conversation's rolling summary
+    (services.memory) are replaced by the summary, and the summary is refreshed in the background
+    once the history crosses AI_MEMORY_TRIGGER_TOKENS. The response carries a 'memory' entry with
+    prompt tokens with/without the summary.
     """
+    if stream:
+        return chat_complete_stream(messages, model=model, temperature=temperature, provider=provider)
     messages = _normalize_messages(messages)
+    if memory:
+        sent, info = apply_memory(memory, messages)
+        started = time.monotonic()
+        response = chat_complete(sent, model=model, temperature=temperature, provider=provider, cache=cache, hedge=hedge)
+        remember_turn(memory, messages, response, info, (time.monotonic() - started) * 1000, provider, model)
+        return dict(response, memory=info)
     temp = temperature if temperature is not None else settings.AI_DEFAULT_TEMPERATURE
     provider = provider or 'openai'
 
     if provider == 'auto':
-        user_text = ' '.join(m.get('content','') for m in messages if m.get('role') == 'user')
-        if len(user_text) > 4000 and getattr(settings, 'GEMINI_API_KEY', ''):
-            provider = 'gemini'
-        else:
-            provider = 'openai'
-
-    if provider == 'openai':
-        mdl = model or settings.OPENAI_MODEL
-        return openai_chat(messages, mdl, temp)
-    if provider == 'gemini':
-        mdl = model or getattr(settings, 'GEMINI_MODEL', 'gemini-pro')
-        return gemini_chat(messages, mdl, temp)
-    # If auto-selected Gemini fails with a transient error, fall back to OpenAI
-    # Determine auto-route again
+        mdl = model or ''
+        call = partial(_route, _auto_candidates(messages, model), messages, temp)
+    elif provider in ('openai', 'gemini'):
+        mdl = model or _default_model(provider)
+        call = partial(_observed, provider, mdl, messages, temp)
+    else:
+        return {"error": f"Unknown provider '{provider}'"}
+    targets = _hedge_targets(provider, model, messages) if hedge_enabled(hedge) else None
+    if targets:
+        call = partial(_hedged, targets, messages, temp, provider == 'auto')
+    if should_cache(temp, cache):
+        return get_cache().get_or_call(cache_key(messages, provider, mdl, temp), call)
+    return call()
+
+
+# --- asyncio twins, used by the async views when served under ASGI ---
+
+async def openai_chat_async(messages: List[Dict], model: str, temperature: float):
+    api_key = settings.OPENAI_API_KEY
+    if not api_key:
+        return {"error": "OPENAI_API_KEY not configured"}
+    url = f"{OPENAI_API_BASE}/chat/completions"
+    try:
+        r = await get_async_transport('openai').post(url, json={"model": model, "messages": messages, "temperature": temperature}, headers={"Authorization": f"Bearer {api_key}"})
+        r.raise_for_status()
+        return _openai_result(r.json())
+    except Exception as e:
+        return {"provider": "openai", "error": str(e), "status_code": _error_status(e), "retry_after": _retry_after(e)}
+
+
+async def _apost_with_retries(url: str, payload: dict, headers: Optional[dict] = None, timeout: Optional[float] = None, retries: int = 2, backoff_base: float = 0.5, transport: Optional[AsyncProviderTransport] = None):
+    """Async _post_with_retries: backs off with asyncio.sleep so the event loop keeps serving other requests."""
+    import httpx  # type: ignore
+    transport = transport or get_async_transport('default')
+    for attempt in range(retries + 1):
+        try:
+            r = await transport.post(url, json=payload, headers=headers or {}, timeout=timeout)
+            if r.status_code == 429 and limits_enabled():
+                r.raise_for_status()
+            if r.status_code in (429, 500, 502, 503, 504) and attempt < retries:
+                await asyncio.sleep(backoff_base * (2 ** attempt))
+                continue
+            r.raise_for_status()
+            return r
+        except httpx.TransportError:
+            if attempt < retries:
+                await asyncio.sleep(backoff_base * (2 ** attempt))
+                continue
+            raise
+
+
+async def gemini_chat_async(messages: List[Dict], model: str, temperature: float):
+    api_key = getattr(settings, 'GEMINI_API_KEY', '')
+    if not api_key:
+        return {"error": "GEMINI_API_KEY not configured"}
+    url = f"{GEMINI_API_BASE}/models/{model}:generateContent?key={api_key}"
+    try:
+        r = await _apost_with_retries(url, _gemini_payload(messages, temperature), retries=2, transport=get_async_transport('gemini'))
+        return _gemini_result(r.json(), model)
+    except Exception as e:
+        return {"provider": "gemini", "error": str(e), "status_code": _error_status(e), "retry_after": _retry_after(e)}
+
+
+async def _aobserved(provider: str, model: str, messages: List[Dict], temperature: float) -> Dict:
+    fn = gemini_chat_async if provider == 'gemini' else openai_chat_async
+    limiter = get_limiter(provider)
+    ticket = await aacquire(limiter, request_cost(messages)) if limiter is not None else None
+    if limiter is not None and ticket is None:
+        return rejection(provider, model)
+    response = None
+    try:
+        started = time.monotonic()
+        response = await fn(messages, model, temperature)
+        _record(provider, model, started, response)
+        return response
+    finally:
+        if ticket is not None:
+            _release(limiter, ticket, response)
+
+
+async def _aroute(candidates: List[Tuple[str, str]], messages: List[Dict], temperature: float) -> Dict:
+    router = get_router()
+    attempts: List[Dict] = []
+    response = None
+    for provider, model in candidates:
+        if not router.allow(provider, model):
+            attempts.append({'provider': provider, 'model': model, 'skipped': 'circuit_open'})
+            continue
+        try:
+            response = await _aobserved(provider, model, messages, temperature)
+        finally:
+            router.release_probe(provider, model)
+        attempts.append({'provider': provider, 'model': model, 'ok': not response.get('error'), 'status_code': response.get('status_code')})
+        if not is_transient(response):
+            break
+    if response is None:
+        return _all_open_error(attempts)
+    response['routing'] = {'attempts': attempts}
+    return response
+
+
+async def _agated(provider: str, model: str, messages: List[Dict], temperature: float) -> Dict:
+    router = get_router()
+    if not router.allow(provider, model):
+        return _breaker_open(provider, model)
+    try:
+        return await _aobserved(provider, model, messages, temperature)
+    finally:
+        router.release_probe(provider, model)
+
+
+async def _ahedged(targets: List[Tuple[str, str]], messages: List[Dict], temperature: float, routed: bool = False) -> Dict:
+    (p1, m1), (p2, m2) = targets
+    delay = hedge_delay(get_router().stats_for(p1, m1))
+    primary = partial(_agated if routed else _aobserved, p1, m1, messages, temperature)
+    return await ahedged_call(primary, partial(_agated, p2, m2, messages, temperature), delay)
+
+
+async def chat_complete_async(messages: List[Dict], model: Optional[str] = None, temperature: Optional[float] = None, provider: Optional[str] = None, cache: Optional[bool] = None, hedge: Optional[bool] = None, memory: Optional[str] = None):
+    """Async twin of chat_complete: same routing and result shape, awaiting the provider call
+    on a pooled httpx.AsyncClient instead of blocking a worker thread.
+    """
+    messages = _normalize_messages(messages)
+    if memory:
+        sent, info = apply_memory(memory, messages)
+        started = time.monotonic()
+        response = await chat_complete_async(sent, model=model, temperature=temperature, provider=provider, cache=cache, hedge=hedge)
+        remember_turn(memory, messages, response, info, (time.monotonic() - started) * 1000, provider, model)
+        return dict(response, memory=info)
+    temp = temperature if temperature is not None else settings.AI_DEFAULT_TEMPERATURE
+    provider = provider or 'openai'
     if provider == 'auto':
-        # If we somehow get here, just try OpenAI as a safe default
-        mdl = model or settings.OPENAI_MODEL
-        return openai_chat(messages, mdl, temp)
-    return {"error": f"Unknown provider '{provider}'"}
+        mdl = model or ''
+        call = partial(_aroute, _auto_candidates(messages, model), messages, temp)
+    elif provider in ('openai', 'gemini'):
+        mdl = model or _default_model(provider)
+        call = partial(_aobserved, provider, mdl, messages, temp)
+    else:
+        return {"error": f"Unknown provider '{provider}'"}
+    targets = _hedge_targets(provider, model, messages) if hedge_enabled(hedge) else None
+    if targets:
+        call = partial(_ahedged, targets, messages, temp, provider == 'auto')
+    if should_cache(temp, cache):
+        return await get_cache().aget_or_call(cache_key(messages, provider, mdl, temp), call)
+    return await call()
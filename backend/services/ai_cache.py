@@ -0,0 +1,298 @@
+"""Deterministic completion cache with in-flight request coalescing.
+
+Keys are a hash of the normalized messages + provider + model + temperature.
+Entries live in an in-process LRU with TTL and, optionally, in a shared backend
+(``AI_CACHE_BACKEND``: ``sqlite`` for the bundled file-based stand-in, or a dotted
+path to any class implementing ``get(key)`` / ``set(key, value, ttl)``).
+Concurrent identical requests are coalesced: one caller runs the upstream call,
+the others wait for its result. Entries are stored without per-call metadata (hedge,
+routing, latency) and every caller gets its own deep copy.
+"""
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+# Per-call details: on a replayed answer they would describe a call that did not happen
+PER_CALL_KEYS = ('hedge', 'routing', 'memory', 'latency_ms', 'cached', 'coalesced')
+
+
+def _entry(result: Dict) -> Dict:
+    """What gets cached: a private deep copy of the result without its per-call metadata."""
+    return copy.deepcopy({k: v for k, v in result.items() if k not in PER_CALL_KEYS})
+
+
+def _served(value: Dict, **flags) -> Dict:
+    """A copy for one caller, so mutating it (e.g. its usage or raw dicts) cannot touch the cache."""
+    return dict(copy.deepcopy(value), **flags)
+
+
+def cache_key(messages: List[Dict], provider: str, model: str, temperature: float) -> str:
+    """Stable key: roles lower-cased, content stripped at both ends (inner whitespace is kept), temperature rounded."""
+    norm = [
+        [str(m.get('role', '')).strip().lower(), str(m.get('content', '')).strip()]
+        for m in messages
+    ]
+    try:
+        temp = round(float(temperature), 3)
+    except (TypeError, ValueError):
+        temp = str(temperature)
+    blob = json.dumps([provider, model, temp, norm], separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+class LRUTTLCache:
+    """Thread-safe in-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl: Optional[float] = None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCacheBackend:
+    """Local file-backed stand-in for a shared cache (e.g. Redis) usable across worker processes."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = str(path or getattr(settings, 'AI_CACHE_SQLITE_PATH', 'ai-cache.sqlite3'))
+        self._local = threading.local()
+        self._conn().execute('CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)')
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str):
+        row = self._conn().execute('SELECT value, expires FROM completions WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < time.time():
+            self._conn().execute('DELETE FROM completions WHERE key = ?', (key,))
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value, ttl: float):
+        self._conn().execute(
+            'INSERT OR REPLACE INTO completions (key, value, expires) VALUES (?, ?, ?)',
+            (key, json.dumps(value, default=str), time.time() + ttl),
+        )
+
+
+class _Flight:
+    __slots__ = ('event', 'result')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+
+class CompletionCache:
+    def __init__(self, local: LRUTTLCache, backend=None, ttl: float = 3600.0, wait_timeout: float = 120.0):
+        self.local = local
+        self.backend = backend
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._flights: Dict[str, _Flight] = {}
+        self._aflights: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Future]]' = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stores = 0
+
+    def get(self, key: str):
+        value = self.local.get(key)
+        if value is None and self.backend is not None:
+            try:
+                value = self.backend.get(key)
+            except Exception:
+                logger.exception('AI cache backend get failed')
+                value = None
+            if value is not None:
+                self.local.set(key, value, self.ttl)
+        return value
+
+    def set(self, key: str, value):
+        value = _entry(value)
+        self.local.set(key, value, self.ttl)
+        with self._lock:
+            self.stores += 1
+        if self.backend is not None:
+            try:
+                self.backend.set(key, value, self.ttl)
+            except Exception:
+                logger.exception('AI cache backend set failed')
+
+    def _store_if_ok(self, key: str, result):
+        # Never cache provider errors; the next identical request should retry upstream.
+        if isinstance(result, dict) and not result.get('error'):
+            self.set(key, result)
+
+    def _hit(self, key: str) -> Optional[Dict]:
+        value = self.get(key)
+        if value is None:
+            return None
+        with self._lock:
+            self.hits += 1
+        return _served(value, cached=True)
+
+    def get_or_call(self, key: str, fn: Callable[[], Dict]) -> Dict:
+        value = self._hit(key)
+        if value is not None:
+            return value
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            if flight.event.wait(self.wait_timeout) and flight.result is not None:
+                return _served(flight.result, coalesced=True)
+            # Leader timed out or crashed: fall through and make our own call.
+            return fn()
+        try:
+            flight.result = fn()
+            self._store_if_ok(key, flight.result)
+            return flight.result
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    async def aget_or_call(self, key: str, fn: Callable[[], Awaitable[Dict]]) -> Dict:
+        value = self._hit(key)
+        if value is not None:
+            return value
+        flights = self._aflights.setdefault(asyncio.get_running_loop(), {})
+        pending = flights.get(key)
+        if pending is not None:
+            with self._lock:
+                self.coalesced += 1
+            return _served(await asyncio.shield(pending), coalesced=True)
+        with self._lock:
+            self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        flights[key] = future
+        try:
+            result = await fn()
+            self._store_if_ok(key, result)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved so an unawaited future does not log
+            raise
+        finally:
+            flights.pop(key, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counters = {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced, 'stores': self.stores}
+        return dict(
+            counters,
+            entries=len(self.local),
+            evictions=self.local.evictions,
+            backend=type(self.backend).__name__ if self.backend is not None else None,
+        )
+
+
+_cache: Optional[CompletionCache] = None
+_cache_lock = threading.Lock()
+
+
+def _build_backend():
+    spec = getattr(settings, 'AI_CACHE_BACKEND', '')
+    if not spec:
+        return None
+    try:
+        if spec == 'sqlite':
+            return SQLiteCacheBackend()
+        return import_string(spec)()
+    except Exception:
+        logger.exception('Could not initialise AI_CACHE_BACKEND=%s; using in-process cache only', spec)
+        return None
+
+
+def get_cache() -> CompletionCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                ttl = float(getattr(settings, 'AI_CACHE_TTL', 3600))
+                _cache = CompletionCache(
+                    LRUTTLCache(max_entries=int(getattr(settings, 'AI_CACHE_MAX_ENTRIES', 1024)), ttl=ttl),
+                    backend=_build_backend(),
+                    ttl=ttl,
+                )
+    return _cache
+
+
+def should_cache(temperature: float, cache: Optional[bool]) -> bool:
+    """Opt-in per call; by default only deterministic (temperature 0) completions are cached."""
+    if not getattr(settings, 'AI_CACHE_ENABLED', True):
+        return False
+    if cache is not None:
+        return bool(cache)
+    try:
+        return float(temperature) == 0.0
+    except (TypeError, ValueError):
+        return False
+
+
+def cache_stats() -> Optional[Dict]:
+    return _cache.stats() if _cache is not None else None
@@ -0,0 +1,156 @@
+"""Hedged provider requests to trim tail latency.
+
+The primary call starts immediately. If it has not answered within a delay derived
+from the primary's observed latency percentile (``AI_HEDGE_PERCENTILE``), or it failed
+transiently, the same request is fired at the secondary provider and the first success
+wins. The sync path runs both calls on the shared hedge pool (``AI_HEDGE_MAX_WORKERS``);
+a ``requests`` call cannot be aborted, so a losing call that already started is left to
+finish in the background and ignored, while one still queued on the pool is cancelled.
+The async path races both as tasks and cancels the loser.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Dict, Optional
+
+from django.conf import settings
+
+from services.ai_router import is_transient
+
+
+class HedgeStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.fired = 0
+        self.primary_wins = 0
+        self.secondary_wins = 0
+
+    def record(self, fired: bool, winner: str):
+        with self._lock:
+            self.requests += 1
+            self.fired += int(fired)
+            if winner == 'secondary':
+                self.secondary_wins += 1
+            else:
+                self.primary_wins += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'fired': self.fired,
+                'primary_wins': self.primary_wins,
+                'secondary_wins': self.secondary_wins,
+                'fire_rate': round(self.fired / self.requests, 3) if self.requests else None,
+            }
+
+
+stats = HedgeStats()
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ThreadPoolExecutor(max_workers=int(getattr(settings, 'AI_HEDGE_MAX_WORKERS', 32)), thread_name_prefix='ai-hedge')
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def hedge_enabled(hedge: Optional[bool]) -> bool:
+    return bool(getattr(settings, 'AI_HEDGE_ENABLED', False)) if hedge is None else bool(hedge)
+
+
+def hedge_delay(target_stats) -> float:
+    """Seconds to wait on the primary before hedging: its latency percentile once enough samples exist."""
+    min_delay = float(getattr(settings, 'AI_HEDGE_MIN_DELAY_MS', 500)) / 1000.0
+    delay_ms = None
+    if target_stats is not None and len(target_stats.latencies) >= int(getattr(settings, 'AI_HEDGE_MIN_SAMPLES', 20)):
+        delay_ms = target_stats.percentile(float(getattr(settings, 'AI_HEDGE_PERCENTILE', 95)))
+    if delay_ms is None:
+        delay_ms = float(getattr(settings, 'AI_HEDGE_DEFAULT_DELAY_MS', 2000))
+    return max(min_delay, delay_ms / 1000.0)
+
+
+def _info(fired: bool, winner: str, delay: float, started: float, response: Dict) -> Dict:
+    stats.record(fired, winner)
+    return {
+        'fired': fired,
+        'winner': winner,
+        'provider': response.get('provider'),
+        'delay_ms': round(delay * 1000),
+        'elapsed_ms': round((time.monotonic() - started) * 1000),
+    }
+
+
+def _winner(results: Dict[str, Dict]) -> Optional[str]:
+    """The path whose success to return, or None while neither has succeeded."""
+    return next((path for path in ('primary', 'secondary') if path in results and not results[path].get('error')), None)
+
+
+def hedged_call(primary: Callable[[], Dict], secondary: Callable[[], Dict], delay: float) -> Dict:
+    """Run primary on the pool; after `delay` seconds (or on a transient error) also run secondary.
+    Returns the first success, else the primary's error, with a 'hedge' entry.
+    """
+    started = time.monotonic()
+    pool = _executor()
+    futures = {pool.submit(primary): 'primary'}
+    done, _ = wait(futures, timeout=delay)
+    fired = False
+    if not done or is_transient(next(iter(done)).result()):
+        fired = True
+        futures[pool.submit(secondary)] = 'secondary'
+    pending = set(futures)
+    results: Dict[str, Dict] = {}
+    winner = None
+    try:
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                results[futures[f]] = f.result()
+            winner = _winner(results)
+    finally:
+        for f in pending:
+            f.cancel()
+    winner = winner or 'primary'
+    response = dict(results[winner])
+    response['hedge'] = _info(fired, winner, delay, started, response)
+    return response
+
+
+async def ahedged_call(primary: Callable[[], Awaitable[Dict]], secondary: Callable[[], Awaitable[Dict]], delay: float) -> Dict:
+    """asyncio hedged_call: the losing request is cancelled instead of ignored."""
+    started = time.monotonic()
+    tasks = {asyncio.ensure_future(primary()): 'primary'}
+    done, _ = await asyncio.wait(tasks, timeout=delay)
+    fired = False
+    if not done or is_transient(next(iter(done)).result()):
+        fired = True
+        tasks[asyncio.ensure_future(secondary())] = 'secondary'
+    pending = set(tasks)
+    results: Dict[str, Dict] = {}
+    winner = None
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                results[tasks[t]] = t.result()
+            winner = _winner(results)
+    finally:
+        for t in pending:
+            t.cancel()
+    winner = winner or 'primary'
+    response = dict(results[winner])
+    response['hedge'] = _info(fired, winner, delay, started, response)
+    return response
+
+
+def hedge_stats() -> Dict:
+    return stats.snapshot()
@@ -0,0 +1,286 @@
+"""Client-side admission control per provider API key.
+
+Each (provider, API key) gets a requests/min and a tokens/min token bucket plus a cap on
+in-flight calls. Callers that cannot be admitted wait in a FIFO queue (so a burst is
+served in arrival order instead of whoever wakes first) until ``AI_LIMIT_QUEUE_TIMEOUT``;
+past that they get a local 429-style error instead of hitting the provider. A real 429
+from upstream pauses admission for the key (``Retry-After`` or ``AI_LIMIT_429_PAUSE``),
+so queued requests wait it out together rather than retry-storming.
+"""
+import asyncio
+import hashlib
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+from services.context import estimate_tokens
+
+
+class TokenBucket:
+    """Continuous-refill bucket; `rate_per_min` <= 0 means unlimited."""
+
+    def __init__(self, rate_per_min: float):
+        self.capacity = float(rate_per_min)
+        self.tokens = float(rate_per_min)
+        self.rate = float(rate_per_min) / 60.0
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def refill(self, now: float):
+        if not self.unlimited:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount: float) -> float:
+        """Seconds until `amount` is available (0 if it is now); call refill() first."""
+        if self.unlimited or self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        if not self.unlimited:
+            self.tokens -= amount
+
+    def give(self, amount: float):
+        if not self.unlimited:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class Ticket:
+    __slots__ = ('seq', 'cost', 'enqueued', 'admitted')
+
+    def __init__(self, seq: int, cost: int):
+        self.seq = seq
+        self.cost = cost
+        self.enqueued = time.monotonic()
+        self.admitted = 0.0
+
+
+class KeyLimiter:
+    """Admission state for one provider API key."""
+
+    def __init__(self, name: str, rpm: float, tpm: float, max_in_flight: int):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.queue: deque = deque()
+        self.cond = threading.Condition()
+        self._seq = itertools.count()
+        self.admitted = 0
+        self.rejected = 0
+        self.upstream_429 = 0
+        self.max_queue_depth = 0
+        self.waits_ms: deque = deque(maxlen=512)
+
+    def _clamp(self, cost: int) -> int:
+        # A single request larger than the whole minute budget would otherwise never be admitted
+        return int(min(cost, self.tokens.capacity)) if not self.tokens.unlimited else cost
+
+    def enqueue(self, cost: int) -> Ticket:
+        with self.cond:
+            ticket = Ticket(next(self._seq), self._clamp(cost))
+            self.queue.append(ticket)
+            self.max_queue_depth = max(self.max_queue_depth, len(self.queue))
+            return ticket
+
+    def _admit(self, ticket: Ticket) -> Optional[float]:
+        # Caller holds self.cond
+        now = time.monotonic()
+        if not self.queue or self.queue[0] is not ticket:
+            return 0.0
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.max_in_flight > 0 and self.in_flight >= self.max_in_flight:
+            return 0.0
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        wait = max(self.requests.wait_for(1), self.tokens.wait_for(ticket.cost))
+        if wait > 0:
+            return wait
+        self.requests.take(1)
+        self.tokens.take(ticket.cost)
+        self.in_flight += 1
+        self.queue.popleft()
+        ticket.admitted = now
+        self.admitted += 1
+        self.waits_ms.append((now - ticket.enqueued) * 1000)
+        self.cond.notify_all()  # the next ticket is now at the head
+        return None
+
+    def try_admit(self, ticket: Ticket) -> Optional[float]:
+        """Admit `ticket` if it is at the head of the queue and every limit allows it.
+        Returns None once admitted, else a hint of how long to wait (0 = until something is released).
+        """
+        with self.cond:
+            return self._admit(ticket)
+
+    def _abandon(self, ticket: Ticket):
+        # Caller holds self.cond
+        try:
+            self.queue.remove(ticket)
+        except ValueError:
+            pass
+        self.rejected += 1
+        self.waits_ms.append((time.monotonic() - ticket.enqueued) * 1000)
+        self.cond.notify_all()
+
+    def abandon(self, ticket: Ticket):
+        with self.cond:
+            self._abandon(ticket)
+
+    def release(self, ticket: Ticket, used_tokens: Optional[int] = None, retry_after: Optional[float] = None):
+        with self.cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            if used_tokens is not None and used_tokens < ticket.cost:
+                # Reservation was pessimistic: hand back what the provider says it did not use
+                self.tokens.give(ticket.cost - used_tokens)
+            if retry_after is not None:
+                self.upstream_429 += 1
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            self.cond.notify_all()
+
+    def snapshot(self) -> Dict:
+        with self.cond:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            waits = sorted(self.waits_ms)
+            return {
+                'queue_depth': len(self.queue),
+                'max_queue_depth': self.max_queue_depth,
+                'in_flight': self.in_flight,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'upstream_429': self.upstream_429,
+                'paused_for_s': round(max(0.0, self.paused_until - now), 2),
+                'rpm_available': None if self.requests.unlimited else round(self.requests.tokens, 1),
+                'tpm_available': None if self.tokens.unlimited else round(self.tokens.tokens),
+                'wait_ms_avg': round(sum(waits) / len(waits), 1) if waits else None,
+                'wait_ms_p95': round(waits[int(0.95 * (len(waits) - 1))], 1) if waits else None,
+                'wait_ms_max': round(waits[-1], 1) if waits else None,
+            }
+
+
+_limiters: Dict[str, KeyLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def limits_enabled() -> bool:
+    return bool(getattr(settings, 'AI_LIMITS_ENABLED', True))
+
+
+def _api_key(provider: str) -> str:
+    if provider == 'gemini':
+        return getattr(settings, 'GEMINI_API_KEY', '') or ''
+    return getattr(settings, 'OPENAI_API_KEY', '') or ''
+
+
+def get_limiter(provider: str) -> Optional[KeyLimiter]:
+    """Limiter for the provider's current API key (None when limits are off or no key is configured)."""
+    if not limits_enabled():
+        return None
+    key = _api_key(provider)
+    if not key:
+        return None
+    name = f"{provider}:{hashlib.sha256(key.encode('utf-8')).hexdigest()[:8]}"
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                prefix = 'AI_LIMIT_GEMINI' if provider == 'gemini' else 'AI_LIMIT_OPENAI'
+                limiter = _limiters[name] = KeyLimiter(
+                    name,
+                    rpm=float(getattr(settings, f'{prefix}_RPM', 0)),
+                    tpm=float(getattr(settings, f'{prefix}_TPM', 0)),
+                    max_in_flight=int(getattr(settings, 'AI_LIMIT_MAX_IN_FLIGHT', 32)),
+                )
+    return limiter
+
+
+def request_cost(messages: List[Dict]) -> int:
+    """Tokens reserved against the TPM bucket: estimated prompt plus the expected completion size."""
+    prompt = sum(estimate_tokens(m.get('content') or '') + 4 for m in messages)
+    return prompt + int(getattr(settings, 'AI_LIMIT_COMPLETION_TOKENS', 512))
+
+
+def _queue_timeout() -> float:
+    return float(getattr(settings, 'AI_LIMIT_QUEUE_TIMEOUT', 10))
+
+
+def acquire(limiter: KeyLimiter, cost: int) -> Optional[Ticket]:
+    """Block in FIFO order until admitted; None if the queue deadline passed first."""
+    ticket = limiter.enqueue(cost)
+    deadline = ticket.enqueued + _queue_timeout()
+    with limiter.cond:
+        while True:
+            wait = limiter._admit(ticket)
+            if wait is None:
+                return ticket
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                limiter._abandon(ticket)
+                return None
+            limiter.cond.wait(min(remaining, wait) if wait > 0 else remaining)
+
+
+async def aacquire(limiter: KeyLimiter, cost: int) -> Optional[Ticket]:
+    """asyncio acquire: polls instead of blocking on the condition so the event loop stays free."""
+    ticket = limiter.enqueue(cost)
+    deadline = ticket.enqueued + _queue_timeout()
+    poll = float(getattr(settings, 'AI_LIMIT_POLL_INTERVAL', 0.02))
+    try:
+        while True:
+            wait = limiter.try_admit(ticket)
+            if wait is None:
+                return ticket
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                limiter.abandon(ticket)
+                return None
+            await asyncio.sleep(min(remaining, wait if wait > 0 else poll))
+    except asyncio.CancelledError:
+        limiter.abandon(ticket)
+        raise
+
+
+def retry_after(response: Dict) -> Optional[float]:
+    """Pause to apply after an upstream 429 (None for any other outcome)."""
+    if response.get('status_code') != 429 or response.get('local_limit'):
+        return None
+    try:
+        return float(response.get('retry_after'))
+    except (TypeError, ValueError):
+        return float(getattr(settings, 'AI_LIMIT_429_PAUSE', 2))
+
+
+def used_tokens(response: Dict) -> Optional[int]:
+    usage = response.get('usage') or {}
+    total = usage.get('total_tokens') or usage.get('totalTokenCount')
+    return int(total) if total else None
+
+
+def rejection(provider: str, model: str) -> Dict:
+    return {
+        'provider': provider,
+        'model': model,
+        'error': f'Local rate limit: {provider} request queue wait exceeded {_queue_timeout():g}s',
+        'status_code': 429,
+        'local_limit': True,
+    }
+
+
+def limits_stats() -> Dict:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {l.name: l.snapshot() for l in limiters}
@@ -0,0 +1,199 @@
+"""Latency/health-aware routing for provider='auto' with per provider/model circuit breakers.
+
+Every provider call is reported to the router (latency, success, HTTP status).
+The router keeps an EWMA of latency and error rate per (provider, model), counts
+429s, and opens a circuit breaker when a target keeps failing. ``auto`` traffic is
+sent to the fastest healthy target; open breakers are skipped until their
+cooldown elapses, after which a single half-open probe decides whether to close.
+A probe that ends without a verdict is released (``release_probe``) for the next request.
+"""
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+Target = Tuple[str, str]  # (provider, model)
+
+
+def is_transient(response: Dict) -> bool:
+    """True when a provider result is an error worth failing over (rate limit, 5xx, network)."""
+    if not isinstance(response, dict) or not response.get('error'):
+        return False
+    status = response.get('status_code')
+    if status is not None:
+        return status in TRANSIENT_STATUSES
+    # No HTTP status: timeouts / connection errors are transient, configuration errors are not.
+    return 'not configured' not in str(response.get('error'))
+
+
+class TargetStats:
+    def __init__(self, alpha: float, window: int = 256):
+        self.alpha = alpha
+        self.ewma_latency_ms: Optional[float] = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.latencies: deque = deque(maxlen=window)
+
+    def observe(self, latency_ms: float, ok: bool, status: Optional[int]):
+        a = self.alpha
+        self.requests += 1
+        if ok:
+            # Only successful calls feed latency; fast failures would make a broken target look quick.
+            self.ewma_latency_ms = latency_ms if self.ewma_latency_ms is None else (a * latency_ms + (1 - a) * self.ewma_latency_ms)
+            self.latencies.append(latency_ms)
+            self.consecutive_failures = 0
+        else:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if status == 429:
+                self.rate_limited += 1
+        self.error_rate = a * (0.0 if ok else 1.0) + (1 - a) * self.error_rate
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+        return ordered[idx]
+
+    def score(self) -> float:
+        # Untried targets score 0 so they get explored; errors inflate the effective latency and
+        # add a flat penalty so a target that only ever failed does not look "fast".
+        return (self.ewma_latency_ms or 0.0) * (1.0 + 4.0 * self.error_rate) + 5000.0 * self.error_rate
+
+    def snapshot(self) -> Dict:
+        return {
+            'state': self.state,
+            'ewma_latency_ms': round(self.ewma_latency_ms, 1) if self.ewma_latency_ms is not None else None,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'error_rate': round(self.error_rate, 3),
+            'requests': self.requests,
+            'failures': self.failures,
+            'rate_limited': self.rate_limited,
+            'consecutive_failures': self.consecutive_failures,
+        }
+
+
+class ProviderRouter:
+    def __init__(self, alpha: float = 0.2, failure_threshold: int = 5, error_rate_threshold: float = 0.5,
+                 min_requests: int = 10, cooldown: float = 30.0):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self._stats: Dict[Target, TargetStats] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, target: Target) -> TargetStats:
+        st = self._stats.get(target)
+        if st is None:
+            st = self._stats[target] = TargetStats(self.alpha)
+        return st
+
+    def stats_for(self, provider: str, model: str) -> TargetStats:
+        with self._lock:
+            return self._get((provider, model))
+
+    def record(self, provider: str, model: str, latency_ms: float, ok: bool, status: Optional[int] = None):
+        with self._lock:
+            st = self._get((provider, model))
+            st.observe(latency_ms, ok, status)
+            if st.state == HALF_OPEN:
+                st.probing = False
+                if ok:
+                    st.state = CLOSED
+                    st.error_rate = 0.0
+                else:
+                    st.state, st.opened_at = OPEN, time.monotonic()
+            elif st.state == CLOSED and not ok:
+                tripped = st.consecutive_failures >= self.failure_threshold or (
+                    st.requests >= self.min_requests and st.error_rate >= self.error_rate_threshold
+                )
+                if tripped:
+                    st.state, st.opened_at = OPEN, time.monotonic()
+
+    def allow(self, provider: str, model: str) -> bool:
+        """May a request be sent to this target now? Moves open breakers to half-open after cooldown."""
+        with self._lock:
+            st = self._get((provider, model))
+            if st.state == CLOSED:
+                return True
+            if st.state == OPEN and time.monotonic() - st.opened_at >= self.cooldown:
+                st.state = HALF_OPEN
+            if st.state == HALF_OPEN and not st.probing:
+                st.probing = True
+                return True
+            return False
+
+    def _available(self, st: TargetStats) -> bool:
+        if st.state == CLOSED:
+            return True
+        if st.state == OPEN:
+            return time.monotonic() - st.opened_at >= self.cooldown
+        return not st.probing
+
+    def available(self, provider: str, model: str) -> bool:
+        """Would allow() admit a request now? Read-only: does not claim a half-open probe."""
+        with self._lock:
+            return self._available(self._get((provider, model)))
+
+    def release_probe(self, provider: str, model: str):
+        """End a half-open probe that produced no verdict (non-transient error, local throttling,
+        abandoned stream) so the next request may probe again. No-op once record() has settled it.
+        """
+        with self._lock:
+            st = self._get((provider, model))
+            if st.state == HALF_OPEN:
+                st.probing = False
+
+    def rank(self, candidates: List[Target]) -> List[Target]:
+        """Order candidates fastest-healthy-first; ties keep the caller's preference order."""
+        with self._lock:
+            scored = []
+            for i, target in enumerate(candidates):
+                st = self._get(target)
+                scored.append((not self._available(st), st.score(), i, target))
+        return [t for *_, t in sorted(scored)]
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {f'{p}:{m}': st.snapshot() for (p, m), st in self._stats.items()}
+
+
+_router: Optional[ProviderRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ProviderRouter:
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = ProviderRouter(
+                    alpha=float(getattr(settings, 'AI_ROUTER_EWMA_ALPHA', 0.2)),
+                    failure_threshold=int(getattr(settings, 'AI_ROUTER_FAILURE_THRESHOLD', 5)),
+                    error_rate_threshold=float(getattr(settings, 'AI_ROUTER_ERROR_RATE_THRESHOLD', 0.5)),
+                    min_requests=int(getattr(settings, 'AI_ROUTER_MIN_REQUESTS', 10)),
+                    cooldown=float(getattr(settings, 'AI_ROUTER_COOLDOWN', 30)),
+                )
+    return _router
+
+
+def router_state() -> Dict:
+    return get_router().snapshot()
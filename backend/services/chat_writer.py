@@ -0,0 +1,431 @@
+"""Write-behind persistence for chat records.
+
+Requests hand their record to a bounded in-process queue and return immediately; a
+background thread drains it with ``insert_many(ordered=False)`` in batches of
+``CHAT_WRITE_BATCH_SIZE`` or every ``CHAT_WRITE_FLUSH_INTERVAL`` seconds. Records get
+their ``_id`` before they are queued, so re-inserting after a partial failure is
+idempotent (duplicate-key errors are ignored).
+
+When the queue is full, ``CHAT_WRITE_QUEUE_POLICY`` decides: ``block`` waits up to
+``CHAT_WRITE_BLOCK_TIMEOUT`` and then spills, ``spill`` goes straight to the spill file,
+``drop`` discards the record (counted). Batches that cannot reach Mongo are appended to
+a local JSON-lines spill file (``bson.json_util`` so ObjectIds/datetimes survive) and
+replayed once Mongo answers again. Each process appends to its own ``<spill path>.<pid>``.
+A replay takes that file plus any left by processes that have exited. A line that does not
+parse is logged, counted as ``corrupt`` and skipped. The queue is flushed at interpreter exit.
+
+Besides inserts into the chats collection the queue carries ``update_one`` ops for other
+collections (conversation metadata). They are applied with an ordered ``bulk_write`` so
+updates to one conversation land in submission order. A spilled batch may be replayed late,
+after newer updates, so callers keep them idempotent (``$set``, no ``$inc``) and guard their
+filters so that a stale update matches nothing.
+"""
+import atexit
+import glob
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from bson import json_util
+from django.conf import settings
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+class _Flush:
+    __slots__ = ('event',)
+
+    def __init__(self):
+        self.event = threading.Event()
+
+
+_STOP = object()
+
+
+class _Op:
+    """A queued update_one against a named collection."""
+    __slots__ = ('coll', 'filter', 'update', 'upsert')
+
+    def __init__(self, coll: str, filter: Dict, update: Dict, upsert: bool = False):
+        self.coll = coll
+        self.filter = filter
+        self.update = update
+        self.upsert = upsert
+
+    def to_spill(self) -> Dict:
+        return {'__op__': {'coll': self.coll, 'filter': self.filter, 'update': self.update, 'upsert': self.upsert}}
+
+
+def _from_spill(line: str):
+    item = json_util.loads(line)
+    op = item.get('__op__') if isinstance(item, dict) else None
+    return _Op(**op) if op else item
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == 'nt':
+        return True  # os.kill(pid, 0) would signal the process there; only replay our own file
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def _is_payload(item) -> bool:
+    return item is not _STOP and not isinstance(item, _Flush)
+
+
+class WriteBehindWriter:
+    def __init__(self, collection_fn: Callable, collection_for: Optional[Callable] = None, batch_size: int = 100, flush_interval: float = 0.5,
+                 max_queue: int = 10000, policy: str = 'block', block_timeout: float = 0.5,
+                 spill_path: Optional[str] = None, spill_max_bytes: int = 50 * 1024 * 1024,
+                 replay_interval: float = 30.0):
+        self.collection_fn = collection_fn
+        self.collection_for = collection_for
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.spill_path = spill_path
+        self.spill_max_bytes = spill_max_bytes
+        self.replay_interval = replay_interval
+        self.queue: 'queue.Queue' = queue.Queue(maxsize=max_queue)
+        self.pid = os.getpid()
+        self._spill_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+        self._last_replay = 0.0
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'queued': 0, 'written': 0, 'batches': 0, 'duplicates': 0, 'failed': 0,
+            'spilled': 0, 'replayed': 0, 'dropped': 0, 'corrupt': 0, 'last_batch_ms': None, 'last_error': None,
+        }
+
+    def _bump(self, **counts):
+        with self._stats_lock:
+            for k, v in counts.items():
+                self.stats[k] = v if k in ('last_batch_ms', 'last_error') else self.stats[k] + v
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='chat-writer', daemon=True)
+                    self._thread.start()
+
+    def submit(self, doc, block: bool = True) -> str:
+        """Queue one document (or update op); returns 'queued', 'spilled' or 'dropped'.
+        block=False never waits on a full queue, whatever the policy (for callers on an event loop).
+        """
+        if self._closed:
+            return self._spill([doc])
+        self._ensure_started()
+        try:
+            if self.policy == 'block' and block:
+                self.queue.put(doc, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(doc)
+        except queue.Full:
+            if self.policy == 'drop':
+                self._bump(dropped=1)
+                return 'dropped'
+            return self._spill([doc])
+        self._bump(queued=1)
+        return 'queued'
+
+    def submit_update(self, coll: str, filter: Dict, update: Dict, upsert: bool = False, block: bool = True) -> str:
+        return self.submit(_Op(coll, filter, update, upsert), block=block)
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Wait until everything queued before this call has been written (or spilled)."""
+        if self._thread is None or not self._thread.is_alive():
+            return self.queue.empty()
+        marker = _Flush()
+        try:
+            self.queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.event.wait(timeout)
+
+    def close(self, timeout: float = 10.0):
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self.queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+        # Anything still queued (writer wedged on a dead Mongo) goes to the spill file
+        leftovers = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if _is_payload(item):
+                leftovers.append(item)
+        if leftovers:
+            self._spill(leftovers)
+
+    # --- background thread ---
+
+    def _collect(self):
+        batch: List[Dict] = []
+        waiters: List[_Flush] = []
+        stop = False
+        try:
+            item = self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return batch, waiters, stop
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if item is _STOP:
+                stop = True
+                break
+            if isinstance(item, _Flush):
+                waiters.append(item)
+                break
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+        return batch, waiters, stop
+
+    def _run(self):
+        while True:
+            batch, waiters, stop = self._collect()
+            if batch:
+                self._write(batch)
+            if stop:
+                # Drain whatever was queued ahead of shutdown
+                rest = []
+                while True:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if _is_payload(item):
+                        rest.append(item)
+                    elif isinstance(item, _Flush):
+                        waiters.append(item)
+                for i in range(0, len(rest), self.batch_size):
+                    self._write(rest[i:i + self.batch_size])
+            for w in waiters:
+                w.event.set()
+            if stop:
+                return
+            try:
+                self._maybe_replay()
+            except Exception:
+                logger.exception('Chat write-behind: spill replay failed')
+
+    def _insert(self, items: List) -> int:
+        """Apply a batch: inserts via insert_many(ordered=False), updates via ordered bulk_write per collection.
+        Returns the number of items applied. Raises PyMongoError if Mongo is unreachable.
+        """
+        docs = [i for i in items if not isinstance(i, _Op)]
+        ops = [i for i in items if isinstance(i, _Op)]
+        applied = 0
+        if docs:
+            try:
+                result = self.collection_fn().insert_many(docs, ordered=False)
+                applied += len(result.inserted_ids)
+            except BulkWriteError as e:
+                errors = e.details.get('writeErrors', [])
+                dupes = sum(1 for err in errors if err.get('code') == DUPLICATE_KEY)
+                failed = len(errors) - dupes
+                self._bump(duplicates=dupes, failed=failed)
+                if failed:
+                    logger.error('Chat write-behind: %d record(s) rejected by Mongo: %s', failed, errors[0].get('errmsg'))
+                applied += e.details.get('nInserted', 0)
+        by_coll: Dict[str, List[_Op]] = {}
+        for op in ops:
+            by_coll.setdefault(op.coll, []).append(op)
+        for coll, coll_ops in by_coll.items():
+            requests = [UpdateOne(op.filter, op.update, upsert=op.upsert) for op in coll_ops]
+            try:
+                self.collection_for(coll).bulk_write(requests, ordered=True)
+                applied += len(requests)
+            except BulkWriteError as e:
+                self._bump(failed=len(e.details.get('writeErrors', [])))
+                logger.error('Chat write-behind: update on %s failed: %s', coll, (e.details.get('writeErrors') or [{}])[0].get('errmsg'))
+        return applied
+
+    def _write(self, batch: List[Dict]):
+        started = time.monotonic()
+        try:
+            written = self._insert(batch)
+        except (PyMongoError, OSError) as e:
+            logger.warning('Chat write-behind: Mongo unavailable (%s); spilling %d record(s)', e, len(batch))
+            self._bump(last_error=str(e)[:200])
+            self._spill(batch)
+            return
+        except Exception as e:
+            logger.exception('Chat write-behind: unexpected error; spilling batch')
+            self._bump(last_error=str(e)[:200])
+            self._spill(batch)
+            return
+        self._bump(written=written, batches=1, last_batch_ms=round((time.monotonic() - started) * 1000, 1))
+
+    # --- spill file ---
+
+    def _own_spill(self) -> str:
+        return f'{self.spill_path}.{self.pid}'
+
+    def _spill(self, docs: List[Dict]) -> str:
+        if not self.spill_path:
+            self._bump(dropped=len(docs))
+            return 'dropped'
+        path = self._own_spill()
+        with self._spill_lock:
+            try:
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+                if size >= self.spill_max_bytes:
+                    logger.error('Chat spill file %s is full (%d bytes); dropping %d record(s)', path, size, len(docs))
+                    self._bump(dropped=len(docs))
+                    return 'dropped'
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(json_util.dumps(d.to_spill() if isinstance(d, _Op) else d) + '\n' for d in docs))
+            except OSError:
+                logger.exception('Chat spill write failed; dropping %d record(s)', len(docs))
+                self._bump(dropped=len(docs))
+                return 'dropped'
+        self._bump(spilled=len(docs))
+        return 'spilled'
+
+    def _spill_files(self) -> List[str]:
+        """Spill files this process may replay: its own, the pre-per-process shared file, and
+        files (or half-done replays) of processes that are gone. A live process's file is left alone.
+        """
+        files = []
+        for path in [self.spill_path] + sorted(glob.glob(glob.escape(self.spill_path) + '.*')):
+            suffix = path[len(self.spill_path) + 1:]
+            owner = suffix[len('replay-'):] if suffix.startswith('replay-') else suffix
+            if path == self.spill_path or (owner.isdigit() and (int(owner) == self.pid or not _pid_alive(int(owner)))):
+                if os.path.exists(path):
+                    files.append(path)
+        return files
+
+    def _maybe_replay(self):
+        if not self.spill_path or time.monotonic() - self._last_replay < self.replay_interval:
+            return
+        self._last_replay = time.monotonic()
+        if self._spill_files():
+            self.replay_spill()
+
+    def _parse_spill(self, path: str) -> List[tuple]:
+        """(line, item) for each readable line of a spill file; unreadable lines are skipped."""
+        items = []
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for n, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    items.append((line, _from_spill(line)))
+                except Exception as e:
+                    logger.warning('Chat spill %s line %d is unreadable (%s); skipping it', path, n, e)
+                    self._bump(corrupt=1)
+        return items
+
+    def replay_spill(self) -> int:
+        """Re-insert spilled records; whatever still cannot be written goes back to this process's spill file."""
+        if not self.spill_path:
+            return 0
+        claimed = f'{self.spill_path}.replay-{self.pid}'
+        replayed = 0
+        # A claim left over from an interrupted replay goes first, before anything is claimed over it
+        for path in sorted(self._spill_files(), key=lambda p: p != claimed):
+            if path != claimed:
+                with self._spill_lock:
+                    try:
+                        os.replace(path, claimed)  # atomic claim; other workers see no file
+                    except FileNotFoundError:
+                        continue
+            items = self._parse_spill(claimed)
+            failed = False
+            for i in range(0, len(items), self.batch_size):
+                try:
+                    replayed += self._insert([item for _, item in items[i:i + self.batch_size]])
+                except (PyMongoError, OSError) as e:
+                    self._bump(last_error=str(e)[:200])
+                    with self._spill_lock, open(self._own_spill(), 'a', encoding='utf-8') as out:
+                        out.writelines(line for line, _ in items[i:])
+                    failed = True
+                    break
+            os.remove(claimed)
+            if failed:
+                break
+        self._bump(replayed=replayed, written=replayed)
+        return replayed
+
+    def snapshot(self) -> Dict:
+        with self._stats_lock:
+            data = dict(self.stats)
+        data.update({
+            'queue_depth': self.queue.qsize(),
+            'queue_max': self.queue.maxsize,
+            'policy': self.policy,
+            'spill_bytes': os.path.getsize(self._own_spill()) if self.spill_path and os.path.exists(self._own_spill()) else 0,
+        })
+        return data
+
+
+_writer: Optional[WriteBehindWriter] = None
+_writer_lock = threading.Lock()
+
+
+def write_behind_enabled() -> bool:
+    return bool(getattr(settings, 'CHAT_WRITE_BEHIND', True))
+
+
+def get_writer() -> WriteBehindWriter:
+    """Process-wide writer; a forked worker gets its own (the parent's thread does not survive fork)."""
+    global _writer
+    if _writer is None or _writer.pid != os.getpid():
+        with _writer_lock:
+            if _writer is None or _writer.pid != os.getpid():
+                from services.mongo import chats_collection, get_db
+                _writer = WriteBehindWriter(
+                    chats_collection,
+                    collection_for=lambda name: get_db()[name],
+                    batch_size=int(getattr(settings, 'CHAT_WRITE_BATCH_SIZE', 100)),
+                    flush_interval=float(getattr(settings, 'CHAT_WRITE_FLUSH_INTERVAL', 0.5)),
+                    max_queue=int(getattr(settings, 'CHAT_WRITE_QUEUE_MAX', 10000)),
+                    policy=getattr(settings, 'CHAT_WRITE_QUEUE_POLICY', 'block'),
+                    block_timeout=float(getattr(settings, 'CHAT_WRITE_BLOCK_TIMEOUT', 0.5)),
+                    spill_path=getattr(settings, 'CHAT_WRITE_SPILL_PATH', '') or None,
+                    spill_max_bytes=int(getattr(settings, 'CHAT_WRITE_SPILL_MAX_BYTES', 50 * 1024 * 1024)),
+                    replay_interval=float(getattr(settings, 'CHAT_WRITE_REPLAY_INTERVAL', 30)),
+                )
+    return _writer
+
+
+def _close_at_exit():
+    if _writer is not None and _writer.pid == os.getpid():
+        _writer.close(timeout=float(getattr(settings, 'CHAT_WRITE_SHUTDOWN_TIMEOUT', 10)))
+
+
+atexit.register(_close_at_exit)
+
+
+def writer_stats() -> Optional[Dict]:
+    return _writer.snapshot() if _writer is not None and _writer.pid == os.getpid() else None
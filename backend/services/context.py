@@ -0,0 +1,153 @@
+"""Token-aware context window packing.
+
+Replaces "first 20 messages, 8000 chars each": the system prompt(s) are always kept,
+then the most recent turns are added newest-first until the model's prompt budget is
+used up. Token counts come from a fast character-class estimator and are memoised per
+message so re-packing a long conversation on every request stays cheap.
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+# Context window (tokens) per model family; matched by longest prefix.
+MODEL_CONTEXT_TOKENS = {
+    'gpt-4o': 128000,
+    'gpt-4o-mini': 128000,
+    'gpt-4.1': 1047576,
+    'gpt-4-turbo': 128000,
+    'gpt-4': 8192,
+    'gpt-3.5-turbo': 16385,
+    'o1': 200000,
+    'o3': 200000,
+    'gemini-pro': 32760,
+    'gemini-1.0-pro': 32760,
+    'gemini-1.5-flash': 1048576,
+    'gemini-1.5-pro': 2097152,
+    'gemini-2.0-flash': 1048576,
+    'gemini-2.5': 1048576,
+}
+
+MESSAGE_OVERHEAD_TOKENS = 4  # role/formatting tokens added per chat message
+
+
+def context_window(model: Optional[str]) -> int:
+    default = int(getattr(settings, 'AI_CONTEXT_DEFAULT_WINDOW', 8192))
+    if not model:
+        return default
+    best = None
+    for prefix in MODEL_CONTEXT_TOKENS:
+        if model.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return MODEL_CONTEXT_TOKENS[best] if best else default
+
+
+def prompt_budget(provider: str, model: Optional[str] = None) -> int:
+    """Tokens available for the prompt: the model window minus reserved output, capped by AI_CONTEXT_MAX_PROMPT_TOKENS."""
+    if model:
+        window = context_window(model)
+    elif provider == 'gemini':
+        window = context_window(getattr(settings, 'GEMINI_MODEL', 'gemini-pro'))
+    elif provider == 'auto':
+        # Unknown until routed: fit the smaller of the candidate windows
+        window = min(context_window(settings.OPENAI_MODEL), context_window(getattr(settings, 'GEMINI_MODEL', 'gemini-pro')))
+    else:
+        window = context_window(settings.OPENAI_MODEL)
+    reserve = int(getattr(settings, 'AI_CONTEXT_RESERVE_TOKENS', 1024))
+    cap = int(getattr(settings, 'AI_CONTEXT_MAX_PROMPT_TOKENS', 32000))
+    return max(256, min(window - reserve, cap))
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap upper-leaning estimate: ~4 ASCII chars per token, one token per non-ASCII char."""
+    if not text:
+        return 0
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+class TokenCountCache:
+    """LRU of per-message token counts keyed by (hash, length) so message bodies are not retained."""
+
+    def __init__(self, max_entries: int = 8192):
+        self.max_entries = max_entries
+        self._data: 'OrderedDict[tuple, int]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, message: Dict) -> int:
+        content = message.get('content') or ''
+        key = (message.get('role'), hash(content), len(content))
+        with self._lock:
+            n = self._data.get(key)
+            if n is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return n
+        n = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+        with self._lock:
+            self.misses += 1
+            self._data[key] = n
+            if len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return n
+
+
+token_counts = TokenCountCache()
+
+
+def _truncate_to(message: Dict, tokens: int) -> Dict:
+    # Keep the head of the text; estimate is >= 1 token per 4 chars, so 4*tokens chars always fits
+    chars = max(0, (tokens - MESSAGE_OVERHEAD_TOKENS) * 4)
+    content = message.get('content') or ''
+    while chars > 0 and estimate_tokens(content[:chars]) + MESSAGE_OVERHEAD_TOKENS > tokens:
+        chars = int(chars * 0.8)
+    return {'role': message.get('role'), 'content': content[:chars]}
+
+
+def pack_messages(messages: List[Dict], budget: int) -> Tuple[List[Dict], Dict]:
+    """Return (messages that fit `budget`, report). System messages first, then the newest turns in order."""
+    system = [m for m in messages if m.get('role') == 'system']
+    turns = [m for m in messages if m.get('role') != 'system']
+    total = sum(token_counts.count(m) for m in messages)
+    used = 0
+    truncated = False
+    kept_system: List[Dict] = []
+    for m in system:
+        n = token_counts.count(m)
+        if used + n > budget:
+            m = _truncate_to(m, budget - used)
+            n = estimate_tokens(m['content']) + MESSAGE_OVERHEAD_TOKENS
+            truncated = True
+        if m.get('content'):
+            kept_system.append(m)
+            used += n
+        if used >= budget:
+            break
+    kept_turns: List[Dict] = []
+    for m in reversed(turns):
+        n = token_counts.count(m)
+        if used + n > budget:
+            if not kept_turns and budget - used > MESSAGE_OVERHEAD_TOKENS:
+                # The newest turn alone is too large: send as much of it as fits rather than nothing
+                m = _truncate_to(m, budget - used)
+                n = estimate_tokens(m['content']) + MESSAGE_OVERHEAD_TOKENS
+                kept_turns.append(m)
+                used += n
+                truncated = True
+            break
+        kept_turns.append(m)
+        used += n
+    kept_turns.reverse()
+    packed = kept_system + kept_turns
+    report = {
+        'budget': budget,
+        'tokens_sent': used,
+        'tokens_dropped': max(0, total - used),
+        'messages_sent': len(packed),
+        'messages_dropped': len(messages) - len(packed),
+        'truncated': truncated,
+    }
+    return packed, report
@@ -0,0 +1,463 @@
+"""Conversation storage: one conversation document plus one small document per turn.
+
+A chat turn used to be stored as a fresh document holding the whole message list, so
+every turn re-stored the conversation. Now each turn document (in the chats collection)
+holds only the messages that are new since the previous turn plus the response, and
+references its conversation by ``conversation_id``/``seq``. The conversation document
+keeps a chained digest of every message stored so far; a request whose leading messages
+hash to that digest only contributes the remaining ones. If the client's history
+diverged (edited or truncated), the turn stores the full list and is marked ``reset``.
+
+Each turn's ``seq`` is claimed atomically from the conversation document's ``next_seq``
+counter (``find_one_and_update`` with ``$inc``), so concurrent requests served by different
+workers never share a seq. The hot per-process state is only trusted when it describes
+exactly the turns before the claimed seq. Otherwise the stored conversation is used if it
+is current, and failing that the turn is stored in full (``reset``). The conversation
+update only matches while the stored ``turn_count`` has not moved past the turn, and a
+direct write that matches nothing drops the hot state so the next turn reloads it.
+Conversation documents themselves are created synchronously, never through the write-behind
+queue, so a follow-up turn served by another worker always finds them.
+
+Session mode (``start_session_turn``) goes further: the client sends only the new
+message and the server rebuilds the context from a hot LRU/TTL session cache of recent
+conversations. It falls back to the turn documents in Mongo on a miss, or when the stored
+conversation has more turns than the cached session (another worker served it since).
+"""
+import hashlib
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from django.utils import timezone
+from pymongo import ReturnDocument
+
+from services.ai_cache import LRUTTLCache
+from services.chat_writer import get_writer, write_behind_enabled
+from services.history import decode_cursor, encode_cursor, keyset_query
+from services.mongo import achats_collection, aconversations_collection, aensure_indexes, chats_collection, conversations_collection, ensure_indexes
+
+# Hot per-conversation state (digest/counters, plus the message list for sessions) so
+# consecutive turns don't wait on (write-behind) Mongo reads
+_state = LRUTTLCache(
+    max_entries=int(getattr(settings, 'CONVERSATION_CACHE_SIZE', 10000)),
+    ttl=float(getattr(settings, 'CONVERSATION_CACHE_TTL', 3600)),
+)
+_session_stats = {'hits': 0, 'misses': 0, 'created': 0}
+
+
+def _chain(digest: str, messages: List[Dict]) -> str:
+    for m in messages:
+        digest = hashlib.sha256(f"{digest}\x1f{m.get('role')}\x1f{m.get('content')}".encode('utf-8')).hexdigest()
+    return digest
+
+
+def parse_id(conversation_id) -> Optional[ObjectId]:
+    try:
+        return ObjectId(str(conversation_id))
+    except (InvalidId, TypeError):
+        return None
+
+
+class Turn:
+    """One request's place in its conversation, from start_turn() to persist()."""
+
+    def __init__(self, user_id: int, conversation_id: ObjectId, seq: int, new_messages: List[Dict],
+                 base_digest: str, base_count: int, reset: bool = False, is_new: bool = False,
+                 history: Optional[List[Dict]] = None, system: str = ''):
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.seq = seq
+        self.new_messages = new_messages
+        self.base_digest = base_digest
+        self.base_count = base_count
+        self.reset = reset
+        self.is_new = is_new
+        self.history = history  # session mode: messages already in the conversation
+        self.system = system
+        self.memory = None  # (key, full context, info) when rolling-summary memory is applied
+
+    def context_messages(self) -> List[Dict]:
+        """Messages to send upstream: the session's system prompt and history (if any) plus the new ones."""
+        prefix = [{'role': 'system', 'content': self.system}] if self.system else []
+        return prefix + (self.history or []) + self.new_messages
+
+    def stored_messages(self, record: Dict) -> List[Dict]:
+        """What this turn adds to the conversation: the new messages plus a successful reply."""
+        response = record.get('response') or {}
+        stored = list(self.new_messages)
+        if response.get('content') and not response.get('error'):
+            stored.append({'role': 'assistant', 'content': response['content']})
+        return stored
+
+    def documents(self, record: Dict):
+        """(turn document, conversation $set fields) for a finished turn record."""
+        stored = self.stored_messages(record)
+        digest = _chain(self.base_digest, stored)
+        count = self.base_count + len(stored)
+        turn = {k: v for k, v in record.items() if k not in ('messages', '_id', 'conversation_id')}
+        turn.update({'conversation_id': self.conversation_id, 'seq': self.seq, 'messages': self.new_messages})
+        if self.reset:
+            turn['reset'] = True
+        last = stored[-1]['content'] if stored else ''
+        fields = {
+            'updated_at': record.get('created_at'),
+            'digest': digest,
+            'message_count': count,
+            'turn_count': self.seq + 1,
+            'last_message': last[:200],
+            'provider': record.get('provider'),
+        }
+        return turn, fields
+
+    def title(self) -> str:
+        first = next((m['content'] for m in self.new_messages if m.get('role') == 'user'), '')
+        return ' '.join(first.split())[:80]
+
+
+def _state_key(user_id: int, conversation_id: ObjectId) -> str:
+    return f'{user_id}:{conversation_id}'
+
+
+def _max_cached_messages() -> int:
+    return int(getattr(settings, 'AI_CONTEXT_MAX_MESSAGES', 500))
+
+
+def _state_from(conv: Dict, messages: Optional[List[Dict]] = None) -> Dict:
+    return {
+        'digest': conv.get('digest', ''),
+        'message_count': conv.get('message_count', 0),
+        'turn_count': conv.get('turn_count', 0),
+        'system': conv.get('system', ''),
+        'messages': messages[-_max_cached_messages():] if messages is not None else None,
+    }
+
+
+_CLAIM_PROJECTION = {'digest': 1, 'message_count': 1, 'turn_count': 1, 'system': 1, 'next_seq': 1}
+
+
+def _take_seq(conv_filter: Dict) -> Optional[Dict]:
+    return conversations_collection().find_one_and_update(
+        conv_filter, {'$inc': {'next_seq': 1}}, projection=_CLAIM_PROJECTION, return_document=ReturnDocument.AFTER,
+    )
+
+
+async def _atake_seq(conv_filter: Dict) -> Optional[Dict]:
+    return await aconversations_collection().find_one_and_update(
+        conv_filter, {'$inc': {'next_seq': 1}}, projection=_CLAIM_PROJECTION, return_document=ReturnDocument.AFTER,
+    )
+
+
+def _behind(conv: Dict) -> bool:
+    # The conversation predates next_seq: the counter has to be lifted past the stored turns
+    return conv['next_seq'] <= conv.get('turn_count', 0)
+
+
+def claim_seq(user_id: int, conversation_id: ObjectId):
+    """Atomically claim the next turn seq of a conversation -> (seq, stored conversation) or None if not found."""
+    conv_filter = {'_id': conversation_id, 'user_id': user_id}
+    conv = _take_seq(conv_filter)
+    if conv is None:
+        return None
+    if _behind(conv):
+        conversations_collection().update_one(conv_filter, {'$max': {'next_seq': conv.get('turn_count', 0)}})
+        conv = _take_seq(conv_filter)
+    return conv['next_seq'] - 1, conv
+
+
+async def aclaim_seq(user_id: int, conversation_id: ObjectId):
+    """Async twin of claim_seq."""
+    conv_filter = {'_id': conversation_id, 'user_id': user_id}
+    conv = await _atake_seq(conv_filter)
+    if conv is None:
+        return None
+    if _behind(conv):
+        await aconversations_collection().update_one(conv_filter, {'$max': {'next_seq': conv.get('turn_count', 0)}})
+        conv = await _atake_seq(conv_filter)
+    return conv['next_seq'] - 1, conv
+
+
+def load_state(user_id: int, conversation_id: ObjectId, seq: int, conv: Dict) -> Optional[Dict]:
+    """The state turn `seq` builds on: hot state or the stored conversation, whichever has exactly
+    `seq` turns; None when neither does (an earlier turn is still in flight or not yet written).
+    """
+    key = _state_key(user_id, conversation_id)
+    state = _state.get(key)
+    if state is not None and state['turn_count'] == seq:
+        return state
+    if conv.get('turn_count', 0) == seq:
+        state = _state_from(conv)
+        _state.set(key, state)
+        return state
+    return None
+
+
+def _cached_session(user_id: int, conversation_id: ObjectId, conv: Optional[Dict]) -> Optional[Dict]:
+    state = _state.get(_state_key(user_id, conversation_id))
+    if state is not None and state.get('messages') is not None and state['turn_count'] >= (conv or {}).get('turn_count', 0):
+        _session_stats['hits'] += 1
+        return state
+    _session_stats['misses'] += 1
+    return None
+
+
+def _cache_session(user_id: int, conversation_id: ObjectId, loaded) -> Optional[Dict]:
+    if loaded is None:
+        return None
+    conv, messages, _ = loaded
+    state = _state_from(conv, messages)
+    _state.set(_state_key(user_id, conversation_id), state)
+    return state
+
+
+def load_session(user_id: int, conversation_id: ObjectId, conv: Optional[Dict] = None) -> Optional[Dict]:
+    """Conversation state including its message list: session cache first, then Mongo.
+    The cached session is only reused while it is at least as far along as the stored
+    conversation `conv`; if another worker has stored later turns, it is rebuilt from the turn documents.
+    """
+    state = _cached_session(user_id, conversation_id, conv)
+    if state is None:
+        state = _cache_session(user_id, conversation_id, _load_thread(user_id, conversation_id))
+    return state
+
+
+async def aload_session(user_id: int, conversation_id: ObjectId, conv: Optional[Dict] = None) -> Optional[Dict]:
+    """Async twin of load_session."""
+    state = _cached_session(user_id, conversation_id, conv)
+    if state is None:
+        state = _cache_session(user_id, conversation_id, await _aload_thread(user_id, conversation_id))
+    return state
+
+
+def _insert_conversation(user_id: int, oid: ObjectId, doc: Dict):
+    """Create the conversation document now, bypassing the write-behind queue: the client's
+    next turn may be served by another worker, which has to find it.
+    """
+    conversations_collection().update_one({'_id': oid, 'user_id': user_id}, {'$setOnInsert': doc}, upsert=True)
+
+
+async def _ainsert_conversation(user_id: int, oid: ObjectId, doc: Dict):
+    await aconversations_collection().update_one({'_id': oid, 'user_id': user_id}, {'$setOnInsert': doc}, upsert=True)
+
+
+def _new_conversation(title: str, system: str, created_at: Optional[datetime], next_seq: int) -> Dict:
+    return {'title': title[:80], 'system': system, 'created_at': created_at, 'updated_at': created_at,
+            'digest': '', 'message_count': 0, 'turn_count': 0, 'next_seq': next_seq}
+
+
+def create_conversation(user_id: int, title: str = '', system: str = '', created_at: Optional[datetime] = None) -> str:
+    """Start an empty conversation for session-mode chat; returns its id."""
+    oid = ObjectId()
+    doc = _new_conversation(title, system, created_at, 0)
+    _insert_conversation(user_id, oid, doc)
+    _state.set(_state_key(user_id, oid), _state_from(doc, []))
+    _session_stats['created'] += 1
+    return str(oid)
+
+
+def _new_turn(user_id: int, messages: List[Dict]):
+    """(turn 0 of a new conversation, its conversation document)."""
+    turn = Turn(user_id, ObjectId(), 0, list(messages), '', 0, is_new=True)
+    return turn, _new_conversation(turn.title(), '', timezone.now(), 1)
+
+
+def _placed_turn(user_id: int, oid: ObjectId, claimed, messages: List[Dict]) -> Turn:
+    seq, conv = claimed
+    state = load_state(user_id, oid, seq, conv)
+    n = state['message_count'] if state is not None else -1
+    if 0 <= n <= len(messages) and _chain('', messages[:n]) == state['digest']:
+        return Turn(user_id, oid, seq, list(messages[n:]), state['digest'], n)
+    return Turn(user_id, oid, seq, list(messages), '', 0, reset=True)
+
+
+def _session_turn(user_id: int, oid: ObjectId, seq: int, state: Optional[Dict], new_messages: List[Dict]) -> Optional[Turn]:
+    if state is None:
+        return None
+    return Turn(user_id, oid, seq, list(new_messages), state['digest'], state['message_count'],
+                history=list(state['messages']), system=state.get('system', ''))
+
+
+def start_turn(user_id: int, conversation_id, messages: List[Dict]) -> Optional[Turn]:
+    """Work out which of `messages` are new for this conversation.
+    No conversation_id starts a new conversation (stored right away, holding turn 0); an unknown
+    (or someone else's) id returns None.
+    """
+    if not conversation_id:
+        turn, doc = _new_turn(user_id, messages)
+        _insert_conversation(user_id, turn.conversation_id, doc)
+        return turn
+    oid = parse_id(conversation_id)
+    claimed = claim_seq(user_id, oid) if oid is not None else None
+    return _placed_turn(user_id, oid, claimed, messages) if claimed is not None else None
+
+
+async def astart_turn(user_id: int, conversation_id, messages: List[Dict]) -> Optional[Turn]:
+    """Async twin of start_turn."""
+    if not conversation_id:
+        turn, doc = _new_turn(user_id, messages)
+        await _ainsert_conversation(user_id, turn.conversation_id, doc)
+        return turn
+    oid = parse_id(conversation_id)
+    claimed = await aclaim_seq(user_id, oid) if oid is not None else None
+    return _placed_turn(user_id, oid, claimed, messages) if claimed is not None else None
+
+
+def start_session_turn(user_id: int, conversation_id, new_messages: List[Dict]) -> Optional[Turn]:
+    """Session mode: only `new_messages` come from the client; history comes from the session cache."""
+    oid = parse_id(conversation_id)
+    claimed = claim_seq(user_id, oid) if oid is not None else None
+    if claimed is None:
+        return None
+    seq, conv = claimed
+    return _session_turn(user_id, oid, seq, load_session(user_id, oid, conv), new_messages)
+
+
+async def astart_session_turn(user_id: int, conversation_id, new_messages: List[Dict]) -> Optional[Turn]:
+    """Async twin of start_session_turn."""
+    oid = parse_id(conversation_id)
+    claimed = await aclaim_seq(user_id, oid) if oid is not None else None
+    if claimed is None:
+        return None
+    seq, conv = claimed
+    return _session_turn(user_id, oid, seq, await aload_session(user_id, oid, conv), new_messages)
+
+
+def _write_conversation(conv_filter: Dict, update: Dict, upsert: bool = True, block: bool = True) -> bool:
+    """Apply (or queue) a conversation update; False when a direct write matched nothing."""
+    if write_behind_enabled():
+        get_writer().submit_update(settings.MONGODB_COLLECTION_CONVERSATIONS, conv_filter, update, upsert=upsert, block=block)
+        return True
+    result = conversations_collection().update_one(conv_filter, update, upsert=upsert)
+    return bool(result.matched_count or result.upserted_id is not None)
+
+
+def _conflict(turn: Turn):
+    """A newer turn already updated the conversation: drop the hot state so the next turn reloads it."""
+    _state.delete(_state_key(turn.user_id, turn.conversation_id))
+
+
+def _turn_writes(turn: Turn, record: Dict):
+    """(turn document, [(conversation filter, update, upsert), ...]) for a finished turn; refreshes the hot state.
+    The metadata update only matches while the stored turn_count is not past this turn, so a late
+    (replayed or out-of-order) write cannot roll the conversation back.
+    """
+    doc, fields = turn.documents(record)
+    doc['_id'] = ObjectId()
+    key = _state_key(turn.user_id, turn.conversation_id)
+    cached = _state.get(key)
+    messages = None
+    if turn.history is not None:
+        messages = turn.history + turn.stored_messages(record)
+    elif cached is not None and cached.get('messages') is not None:
+        messages = ([] if turn.reset else cached['messages']) + turn.stored_messages(record)
+    if cached is None or cached['turn_count'] <= turn.seq:
+        # Turns can finish out of order; never move the hot state back to an older turn
+        state = dict(fields, system=turn.system or (cached or {}).get('system', ''))
+        _state.set(key, _state_from(state, messages))
+    conv_filter = {'_id': turn.conversation_id, 'user_id': turn.user_id}
+    return doc, [(dict(conv_filter, turn_count={'$lte': turn.seq}), {'$set': fields}, False)]
+
+
+def _submit_turn(doc: Dict, block: bool = True):
+    if get_writer().submit(doc, block=block) == 'dropped':
+        raise RuntimeError('chat write queue full; record dropped')
+
+
+def persist_turn(turn: Turn, record: Dict) -> str:
+    """Store the turn and update its conversation; returns the turn document id.
+    Goes through the write-behind queue unless CHAT_WRITE_BEHIND is off.
+    """
+    doc, writes = _turn_writes(turn, record)
+    if write_behind_enabled():
+        _submit_turn(doc)
+    else:
+        chats_collection().insert_one(doc)
+    for conv_filter, update, upsert in writes:
+        if not _write_conversation(conv_filter, update, upsert):
+            _conflict(turn)
+    return str(doc['_id'])
+
+
+async def apersist_turn(turn: Turn, record: Dict) -> str:
+    """Async twin of persist_turn: direct writes are awaited on the async driver."""
+    doc, writes = _turn_writes(turn, record)
+    if write_behind_enabled():
+        # Queue hand-off only: never wait on a full queue on the event loop (spill or drop instead)
+        _submit_turn(doc, block=False)
+        for conv_filter, update, upsert in writes:
+            _write_conversation(conv_filter, update, upsert, block=False)
+    else:
+        await achats_collection().insert_one(doc)
+        for conv_filter, update, upsert in writes:
+            result = await aconversations_collection().update_one(conv_filter, update, upsert=upsert)
+            if not (result.matched_count or result.upserted_id is not None):
+                _conflict(turn)
+    return str(doc['_id'])
+
+
+_THREAD_PROJECTION = {'messages': 1, 'seq': 1, 'reset': 1, 'created_at': 1, 'response.content': 1, 'response.error': 1}
+
+
+def _rebuild(conv: Dict, turn_docs):
+    messages: List[Dict] = []
+    turns = 0
+    for t in turn_docs:
+        turns += 1
+        if t.get('reset'):
+            messages = []
+        messages.extend(t.get('messages') or [])
+        response = t.get('response') or {}
+        if response.get('content') and not response.get('error'):
+            messages.append({'role': 'assistant', 'content': response['content']})
+    return conv, messages, turns
+
+
+def _load_thread(user_id: int, oid: ObjectId):
+    """(conversation doc, rebuilt message list, turn count) or None."""
+    conv = conversations_collection().find_one({'_id': oid, 'user_id': user_id})
+    if conv is None:
+        return None
+    ensure_indexes()
+    return _rebuild(conv, chats_collection().find({'conversation_id': oid, 'user_id': user_id}, _THREAD_PROJECTION).sort('seq', 1))
+
+
+async def _aload_thread(user_id: int, oid: ObjectId):
+    conv = await aconversations_collection().find_one({'_id': oid, 'user_id': user_id})
+    if conv is None:
+        return None
+    await aensure_indexes()
+    return _rebuild(conv, await achats_collection().find_list({'conversation_id': oid, 'user_id': user_id}, _THREAD_PROJECTION, sort=[('seq', 1)]))
+
+
+def thread(user_id: int, conversation_id) -> Optional[Dict]:
+    """Rebuild a conversation's message list from its turn documents (None if not found)."""
+    oid = parse_id(conversation_id)
+    loaded = _load_thread(user_id, oid) if oid is not None else None
+    if loaded is None:
+        return None
+    conv, messages, turns = loaded
+    conv['_id'] = str(conv['_id'])
+    conv.pop('digest', None)
+    conv.pop('next_seq', None)
+    return {'conversation': conv, 'messages': messages, 'turns': turns}
+
+
+def list_conversations(user_id: int, limit: int = 50, cursor: Optional[str] = None):
+    """One page of the user's conversations, most recently active first: (items, next cursor or None).
+    Raises ValueError for a malformed cursor.
+    """
+    ensure_indexes()
+    query = keyset_query({'user_id': user_id}, 'updated_at', decode_cursor(cursor) if cursor else None)
+    docs = list(conversations_collection().find(query, {'digest': 0, 'next_seq': 0})
+                .sort([('updated_at', -1), ('_id', -1)]).limit(limit + 1))
+    next_cursor = encode_cursor(docs[limit - 1]['updated_at'], docs[limit - 1]['_id']) if len(docs) > limit else None
+    items = []
+    for c in docs[:limit]:
+        c['_id'] = str(c['_id'])
+        items.append(c)
+    return items, next_cursor
+
+
+def session_stats() -> Dict:
+    return dict(_session_stats, cached=len(_state))
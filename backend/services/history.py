@@ -0,0 +1,163 @@
+"""Chat history paging: server-side projections and opaque keyset cursors.
+
+History lists are read with ``find({'user_id': ..} + keyset).sort(created_at desc, _id desc)``
+against the matching compound index (services.mongo.ensure_indexes), so every page costs
+O(page) no matter how deep it is, unlike skip/offset paging. The cursor handed to the
+client is the (created_at, _id) of the last item, base64-encoded so clients treat it as
+opaque. ``created_at`` is stored as a BSON datetime; ``migrate_string_dates`` converts
+records written when it was an ISO string. Full exports (``export_cursor``) stream from one
+batched cursor instead of re-running paged queries.
+"""
+import base64
+import json
+import zlib
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+
+from services.mongo import achats_collection, aensure_indexes, chats_collection, ensure_indexes
+
+# List views never pull the prompt or the provider payload over the wire
+LIST_PROJECTION = {'messages': 0, 'raw': 0, 'response.raw': 0}
+HISTORY_SORT = [('created_at', -1), ('_id', -1)]
+
+
+def to_utc(value: datetime) -> datetime:
+    """Naive UTC datetime, which is what pymongo stores and returns by default."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def parse_time(value: str) -> datetime:
+    """ISO-8601 string (as clients send and legacy records stored) to a naive UTC datetime."""
+    return to_utc(datetime.fromisoformat(value.strip().replace('Z', '+00:00')))
+
+
+def pack_cursor(data: Dict) -> str:
+    raw = json.dumps(data, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def unpack_cursor(cursor: str) -> Dict:
+    data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    if not isinstance(data, dict):
+        raise ValueError('invalid cursor')
+    return data
+
+
+def encode_cursor(created_at: datetime, oid) -> str:
+    return pack_cursor({'t': to_utc(created_at).isoformat(), 'id': str(oid)})
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    """(created_at, _id) from an opaque cursor; ValueError if it is malformed."""
+    try:
+        data = unpack_cursor(cursor)
+        return parse_time(data['t']), ObjectId(data['id'])
+    except (ValueError, TypeError, KeyError, InvalidId) as e:
+        raise ValueError('invalid cursor') from e
+
+
+def keyset_query(query: Dict, field: str, position: Optional[Tuple[datetime, ObjectId]]) -> Dict:
+    """`query` restricted to documents after `position` in (field desc, _id desc) order."""
+    if position is None:
+        return query
+    t, oid = position
+    return dict(query, **{'$or': [{field: {'$lt': t}}, {field: t, '_id': {'$lt': oid}}]})
+
+
+def _history_query(user_id: int, cursor: Optional[str], before: Optional[str]) -> Dict:
+    query: Dict = {'user_id': user_id}
+    if cursor:
+        query = keyset_query(query, 'created_at', decode_cursor(cursor))
+    elif before:
+        query['created_at'] = {'$lt': parse_time(before)}
+    return query
+
+
+def _history_page(docs: List[Dict], limit: int):
+    next_cursor = encode_cursor(docs[limit - 1]['created_at'], docs[limit - 1]['_id']) if len(docs) > limit else None
+    items: List[Dict] = []
+    for d in docs[:limit]:
+        d['_id'] = str(d['_id'])
+        items.append(d)
+    return items, next_cursor
+
+
+def page_history(user_id: int, limit: int = 50, cursor: Optional[str] = None, before: Optional[str] = None):
+    """One page of the user's chat records, newest first: (items, next cursor or None).
+    `before` (ISO timestamp) is the older way to page and still works for a first page.
+    Raises ValueError for a malformed cursor or timestamp.
+    """
+    ensure_indexes()
+    query = _history_query(user_id, cursor, before)
+    docs = list(chats_collection().find(query, LIST_PROJECTION).sort(HISTORY_SORT).limit(limit + 1))
+    return _history_page(docs, limit)
+
+
+async def apage_history(user_id: int, limit: int = 50, cursor: Optional[str] = None, before: Optional[str] = None):
+    """Async twin of page_history (awaits the async Mongo driver)."""
+    await aensure_indexes()
+    query = _history_query(user_id, cursor, before)
+    docs = await achats_collection().find_list(query, LIST_PROJECTION, sort=HISTORY_SORT, limit=limit + 1)
+    return _history_page(docs, limit)
+
+
+def export_cursor(user_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None, batch_size: int = 500):
+    """All of the user's chat records (oldest first, raw payloads excluded) as a lazily batched cursor.
+    `start` is inclusive, `end` exclusive.
+    """
+    ensure_indexes()
+    query: Dict = {'user_id': user_id}
+    if start or end:
+        query['created_at'] = {k: to_utc(v) for k, v in (('$gte', start), ('$lt', end)) if v}
+    return chats_collection().find(query, {'raw': 0, 'response.raw': 0}) \
+        .sort([('created_at', 1), ('_id', 1)]).batch_size(batch_size)
+
+
+def buffered(chunks: Iterable[bytes], size: int = 64 * 1024) -> Iterator[bytes]:
+    """Coalesce small chunks into ~`size` writes."""
+    buf, n = [], 0
+    for chunk in chunks:
+        buf.append(chunk)
+        n += len(chunk)
+        if n >= size:
+            yield b''.join(buf)
+            buf, n = [], 0
+    if buf:
+        yield b''.join(buf)
+
+
+def gzip_stream(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Gzip a byte stream incrementally (constant memory)."""
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+
+def migrate_string_dates(collection, fields=('created_at',), batch_size: int = 1000) -> int:
+    """Rewrite ISO-string timestamps as BSON datetimes; returns the number of documents updated.
+    Strings and dates sort apart in BSON, so unconverted records would fall out of keyset paging.
+    """
+    updated = 0
+    for field in fields:
+        ops = []
+        for doc in collection.find({field: {'$type': 'string'}}, {field: 1}).batch_size(batch_size):
+            try:
+                value = parse_time(doc[field])
+            except ValueError:
+                continue
+            ops.append(UpdateOne({'_id': doc['_id'], field: doc[field]}, {'$set': {field: value}}))
+            if len(ops) >= batch_size:
+                updated += collection.bulk_write(ops, ordered=False).modified_count
+                ops = []
+        if ops:
+            updated += collection.bulk_write(ops, ordered=False).modified_count
+    return updated
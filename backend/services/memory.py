@@ -0,0 +1,207 @@
+"""Rolling-summary memory for long conversations.
+
+Once a conversation's turns exceed ``AI_MEMORY_TRIGGER_TOKENS``, a background job folds
+the turns older than the most recent ``AI_MEMORY_KEEP_TOKENS`` into a running summary
+(incrementally: previous summary + newly aged-out turns). Later requests for the same
+conversation send system prompt(s) + summary + the turns the summary does not cover.
+The summary is only used while the request's leading turns still hash to what was
+summarized, so an edited history falls back to sending the turns as-is.
+
+Per conversation we keep prompt tokens with/without the summary and call latency so
+the savings can be inspected (``memory_stats``), plus process-wide totals for metrics.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from services.ai_cache import LRUTTLCache
+from services.context import token_counts
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PREFIX = 'Summary of the earlier conversation:\n'
+
+SUMMARIZE_INSTRUCTIONS = (
+    'You maintain a running summary of a conversation between a user and an assistant. '
+    'Merge the new messages into the existing summary. Keep facts, names, numbers, decisions, '
+    'user preferences and open questions; drop pleasantries. Write plain prose, at most {words} words. '
+    'Return only the updated summary.'
+)
+
+_summaries = LRUTTLCache(
+    max_entries=int(getattr(settings, 'AI_MEMORY_CACHE_SIZE', 10000)),
+    ttl=float(getattr(settings, 'AI_MEMORY_TTL', 86400)),
+)
+_usage = LRUTTLCache(max_entries=int(getattr(settings, 'AI_MEMORY_CACHE_SIZE', 10000)), ttl=float(getattr(settings, 'AI_MEMORY_TTL', 86400)))
+_pending: set = set()
+_lock = threading.Lock()
+_totals = {'requests': 0, 'summary_used': 0, 'tokens_full': 0, 'tokens_sent': 0,
+           'summaries_built': 0, 'summary_failures': 0, 'summary_ms_total': 0.0}
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_pid: Optional[int] = None
+
+
+def memory_enabled(memory: Optional[bool]) -> bool:
+    return bool(getattr(settings, 'AI_MEMORY_ENABLED', False)) if memory is None else bool(memory)
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ThreadPoolExecutor(max_workers=int(getattr(settings, 'AI_MEMORY_WORKERS', 2)), thread_name_prefix='ai-memory')
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _digest(turns: List[Dict]) -> str:
+    h = hashlib.sha256()
+    for m in turns:
+        h.update(f"{m.get('role')}\x1f{m.get('content')}\x1e".encode('utf-8'))
+    return h.hexdigest()
+
+
+def _split(messages: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+    return [m for m in messages if m.get('role') == 'system'], [m for m in messages if m.get('role') != 'system']
+
+
+def _tokens(messages: List[Dict]) -> int:
+    return sum(token_counts.count(m) for m in messages)
+
+
+def apply_memory(key: str, messages: List[Dict]) -> Tuple[List[Dict], Dict]:
+    """Replace summarized turns by the cached summary. Returns (messages to send, info)."""
+    systems, turns = _split(messages)
+    full = _tokens(messages)
+    info = {'summary_used': False, 'covered_messages': 0, 'tokens_full': full, 'tokens_sent': full, 'tokens_saved': 0}
+    state = _summaries.get(key)
+    if state is not None and state['covered'] <= len(turns) and _digest(turns[:state['covered']]) == state['digest']:
+        summary = {'role': 'system', 'content': SUMMARY_PREFIX + state['summary']}
+        messages = systems + [summary] + turns[state['covered']:]
+        sent = _tokens(messages)
+        info.update(summary_used=True, covered_messages=state['covered'], tokens_sent=sent, tokens_saved=max(0, full - sent))
+    return messages, info
+
+
+def record_call(key: str, info: Dict, latency_ms: float):
+    """Account one request's prompt size and latency against its conversation."""
+    with _lock:
+        _totals['requests'] += 1
+        _totals['summary_used'] += int(info.get('summary_used', False))
+        _totals['tokens_full'] += info.get('tokens_full', 0)
+        _totals['tokens_sent'] += info.get('tokens_sent', 0)
+        usage = _usage.get(key) or {'requests': 0, 'with_summary': 0, 'tokens_full': 0, 'tokens_sent': 0,
+                                    'latency_ms_with_summary': 0.0, 'latency_ms_without_summary': 0.0}
+        usage['requests'] += 1
+        usage['tokens_full'] += info.get('tokens_full', 0)
+        usage['tokens_sent'] += info.get('tokens_sent', 0)
+        if info.get('summary_used'):
+            usage['with_summary'] += 1
+            usage['latency_ms_with_summary'] += latency_ms
+        else:
+            usage['latency_ms_without_summary'] += latency_ms
+        _usage.set(key, usage)
+    info['latency_ms'] = round(latency_ms, 1)
+
+
+def memory_stats(key: str) -> Optional[Dict]:
+    """Per-conversation savings: prompt tokens saved and mean latency with vs. without the summary."""
+    usage = _usage.get(key)
+    if usage is None:
+        return None
+    without = usage['requests'] - usage['with_summary']
+    state = _summaries.get(key) or {}
+    return {
+        'requests': usage['requests'],
+        'with_summary': usage['with_summary'],
+        'tokens_full': usage['tokens_full'],
+        'tokens_sent': usage['tokens_sent'],
+        'tokens_saved': usage['tokens_full'] - usage['tokens_sent'],
+        'avg_latency_ms_with_summary': round(usage['latency_ms_with_summary'] / usage['with_summary'], 1) if usage['with_summary'] else None,
+        'avg_latency_ms_without_summary': round(usage['latency_ms_without_summary'] / without, 1) if without else None,
+        'summary_covered_messages': state.get('covered', 0),
+    }
+
+
+def _boundary(turns: List[Dict]) -> int:
+    """Number of leading turns to summarize: everything but the newest AI_MEMORY_KEEP_TOKENS worth."""
+    keep = int(getattr(settings, 'AI_MEMORY_KEEP_TOKENS', 1500))
+    used = 0
+    i = len(turns)
+    while i > 0 and used + token_counts.count(turns[i - 1]) <= keep:
+        used += token_counts.count(turns[i - 1])
+        i -= 1
+    return i
+
+
+def _summarize(key: str, turns: List[Dict], summarize: Callable[[List[Dict]], Dict]):
+    started = time.monotonic()
+    try:
+        boundary = _boundary(turns)
+        state = _summaries.get(key)
+        if state is not None and state['covered'] <= boundary and _digest(turns[:state['covered']]) == state['digest']:
+            previous, start = state['summary'], state['covered']
+        else:
+            previous, start = '', 0
+        if boundary <= start:
+            return
+        transcript = '\n'.join(f"{m.get('role')}: {m.get('content')}" for m in turns[start:boundary])
+        words = int(getattr(settings, 'AI_MEMORY_SUMMARY_WORDS', 250))
+        prompt = [
+            {'role': 'system', 'content': SUMMARIZE_INSTRUCTIONS.format(words=words)},
+            {'role': 'user', 'content': f"Existing summary:\n{previous or '(none)'}\n\nNew messages:\n{transcript}"},
+        ]
+        result = summarize(prompt)
+        if result.get('error') or not (result.get('content') or '').strip():
+            with _lock:
+                _totals['summary_failures'] += 1
+            logger.warning('Conversation summary failed for %s: %s', key, result.get('error'))
+            return
+        _summaries.set(key, {'summary': result['content'].strip(), 'covered': boundary, 'digest': _digest(turns[:boundary])})
+        with _lock:
+            _totals['summaries_built'] += 1
+            _totals['summary_ms_total'] += (time.monotonic() - started) * 1000
+    except Exception:
+        with _lock:
+            _totals['summary_failures'] += 1
+        logger.exception('Conversation summary crashed for %s', key)
+    finally:
+        with _lock:
+            _pending.discard(key)
+
+
+def schedule_update(key: str, messages: List[Dict], summarize: Callable[[List[Dict]], Dict]) -> bool:
+    """Fold aged-out turns into the summary in the background once the trigger is crossed.
+    `messages` is the full (unsummarized) history including the latest reply; `summarize` runs
+    the completion. At most one job per conversation is in flight. Returns True if a job was queued.
+    """
+    _, turns = _split(messages)
+    if _tokens(turns) <= int(getattr(settings, 'AI_MEMORY_TRIGGER_TOKENS', 3000)):
+        return False
+    state = _summaries.get(key)
+    if state is not None and _boundary(turns) <= state['covered']:
+        return False
+    with _lock:
+        if key in _pending:
+            return False
+        _pending.add(key)
+    _executor().submit(_summarize, key, list(turns), summarize)
+    return True
+
+
+def memory_totals() -> Dict:
+    with _lock:
+        data = dict(_totals)
+        data['pending'] = len(_pending)
+    full, sent = data['tokens_full'], data['tokens_sent']
+    data['tokens_saved'] = full - sent
+    data['avg_summary_ms'] = round(data.pop('summary_ms_total') / data['summaries_built'], 1) if data['summaries_built'] else None
+    data['cached_summaries'] = len(_summaries)
+    return data
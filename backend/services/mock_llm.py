@@ -0,0 +1,319 @@
+"""Stand-in LLM provider for load tests and benchmarks.
+
+Speaks the subset of the OpenAI ``/chat/completions`` and Gemini ``:generateContent`` /
+``:streamGenerateContent?alt=sse`` APIs that ``services.ai`` uses, with configurable
+time-to-first-token, token throughput, injected 5xx/429 errors and an optional RPM
+cap. Point ``OPENAI_API_BASE=http://host:port/v1`` and
+``GEMINI_API_BASE=http://host:port/v1beta`` at it to exercise the whole stack offline.
+Run it with ``python manage.py mock_llm_server``.
+"""
+import gzip
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+WORDS = (
+    'the quick team reviewed quarterly results and agreed to expand the pilot program across '
+    'regional offices while keeping costs flat and improving customer onboarding documentation'
+).split()
+
+GEMINI_PATH = re.compile(r'/models/(?P<model>[^/:]+):(?P<method>generateContent|streamGenerateContent)$')
+
+
+def parse_distribution(spec: str) -> Callable[[random.Random], float]:
+    """Sampler for a distribution spec, in the unit the caller uses (ms, tokens):
+    ``fixed:V`` | ``uniform:LO,HI`` | ``normal:MEAN,STDDEV`` | ``lognormal:MEDIAN,SIGMA`` | ``exp:MEAN``.
+    """
+    kind, _, args = spec.partition(':')
+    try:
+        vals = [float(v) for v in args.split(',') if v.strip()]
+        if kind == 'fixed':
+            return lambda rng: vals[0]
+        if kind == 'uniform':
+            return lambda rng: rng.uniform(vals[0], vals[1])
+        if kind == 'normal':
+            return lambda rng: max(0.0, rng.gauss(vals[0], vals[1]))
+        if kind == 'lognormal':
+            # MEDIAN in the caller's unit; SIGMA is the log-space spread (0.5 ~ moderate tail)
+            return lambda rng: rng.lognormvariate(math.log(max(vals[0], 1e-9)), vals[1])
+        if kind == 'exp':
+            return lambda rng: rng.expovariate(1.0 / vals[0]) if vals[0] > 0 else 0.0
+    except (IndexError, ValueError):
+        pass
+    raise ValueError(f'Bad distribution spec {spec!r}; expected fixed:V, uniform:LO,HI, normal:M,SD, lognormal:MEDIAN,SIGMA or exp:MEAN')
+
+
+class MockLLMConfig:
+    def __init__(self, latency: str = 'fixed:200', completion_tokens: str = 'fixed:64', tokens_per_sec: float = 50.0,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, retry_after: float = 1.0, rpm: float = 0.0,
+                 seed: Optional[int] = None):
+        self.latency = parse_distribution(latency)  # time to first token, ms
+        self.completion_tokens = parse_distribution(completion_tokens)
+        self.tokens_per_sec = tokens_per_sec
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.rpm = rpm
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+
+    def sample(self, dist: Callable[[random.Random], float]) -> float:
+        with self.rng_lock:
+            return dist(self.rng)
+
+    def roll(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self.rng_lock:
+            return self.rng.random() < rate
+
+
+class MockStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.statuses: Dict[int, int] = {}
+        self.streams = 0
+        self.tokens_out = 0
+        self._window: List[float] = []  # request timestamps within the last minute, for the RPM cap
+
+    def admit(self, rpm: float) -> bool:
+        with self._lock:
+            self.requests += 1
+            if rpm > 0:
+                now = time.monotonic()
+                self._window = [t for t in self._window if now - t < 60.0]
+                if len(self._window) >= rpm:
+                    return False
+                self._window.append(now)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            return True
+
+    def stream_started(self):
+        with self._lock:
+            self.streams += 1
+
+    def done(self, status: int, tokens: int = 0, admitted: bool = True):
+        with self._lock:
+            if admitted:
+                self.in_flight -= 1
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.tokens_out += tokens
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'statuses': {str(k): v for k, v in sorted(self.statuses.items())},
+                'streams': self.streams,
+                'tokens_out': self.tokens_out,
+            }
+
+
+def _estimate_prompt_tokens(texts: List[str]) -> int:
+    return sum(len(t) for t in texts) // 4 + 1
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so the pooled provider transports are exercised realistically
+    server_version = 'MockLLM/1.0'
+
+    @property
+    def config(self) -> MockLLMConfig:
+        return self.server.config  # type: ignore[attr-defined]
+
+    @property
+    def stats(self) -> MockStats:
+        return self.server.stats  # type: ignore[attr-defined]
+
+    def log_message(self, format, *args):
+        if getattr(self.server, 'verbose', False):
+            super().log_message(format, *args)
+
+    # --- plumbing ---
+
+    def _body(self) -> Dict:
+        raw = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            raw = gzip.decompress(raw)
+        try:
+            return json.loads(raw or b'{}')
+        except ValueError:
+            return {}
+
+    def _json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+    def _chunk(self, text: str):
+        data = text.encode('utf-8')
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def _tokens(self) -> List[str]:
+        n = max(1, int(self.config.sample(self.config.completion_tokens)))
+        with self.config.rng_lock:
+            start = self.config.rng.randrange(len(WORDS))
+        return [WORDS[(start + i) % len(WORDS)] + ' ' for i in range(n)]
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.config.tokens_per_sec if self.config.tokens_per_sec > 0 else 0.0
+
+    def _fault(self, error_shape: Callable[[int, str], Dict]) -> Optional[int]:
+        """Apply admission, 429 and 5xx injection; returns the status sent, or None to proceed."""
+        if not self.stats.admit(self.config.rpm):
+            self._json(429, error_shape(429, 'Rate limit reached (mock RPM cap)'), {'Retry-After': f'{self.config.retry_after:g}'})
+            self.stats.done(429, admitted=False)
+            return 429
+        if self.config.roll(self.config.rate_limit_rate):
+            self._json(429, error_shape(429, 'Rate limit reached (injected)'), {'Retry-After': f'{self.config.retry_after:g}'})
+            self.stats.done(429)
+            return 429
+        time.sleep(self.config.sample(self.config.latency) / 1000.0)
+        if self.config.roll(self.config.error_rate):
+            self._json(500, error_shape(500, 'Internal error (injected)'))
+            self.stats.done(500)
+            return 500
+        return None
+
+    # --- routes ---
+
+    def do_GET(self):
+        if self.path.rstrip('/') in ('', '/health', '/stats'):
+            self._json(200, {'status': 'ok', 'stats': self.stats.snapshot()})
+        else:
+            self._json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        path = self.path.split('?', 1)[0]
+        body = self._body()
+        if path.endswith('/chat/completions'):
+            return self._openai(body)
+        match = GEMINI_PATH.search(path)
+        if match:
+            return self._gemini(body, match.group('model'), streaming=match.group('method') == 'streamGenerateContent')
+        self._json(404, {'error': {'message': f'unknown path {path}'}})
+
+    def _openai(self, body: Dict):
+        def error_shape(status, message):
+            return {'error': {'message': message, 'type': 'rate_limit_error' if status == 429 else 'server_error', 'code': status}}
+        if self._fault(error_shape):
+            return
+        model = body.get('model') or 'mock-model'
+        prompt_tokens = _estimate_prompt_tokens([str(m.get('content', '')) for m in body.get('messages') or []])
+        tokens = self._tokens()
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(tokens), 'total_tokens': prompt_tokens + len(tokens)}
+        cid = f'chatcmpl-mock-{uuid.uuid4().hex[:12]}'
+        delay = self._token_delay()
+        if not body.get('stream'):
+            time.sleep(delay * len(tokens))
+            self._json(200, {
+                'id': cid, 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(tokens).strip()}, 'finish_reason': 'stop'}],
+                'usage': usage,
+            })
+            self.stats.done(200, len(tokens))
+            return
+        self.stats.stream_started()
+        self._start_stream()
+        try:
+            for tok in tokens:
+                chunk = {'id': cid, 'object': 'chat.completion.chunk', 'model': model, 'choices': [{'index': 0, 'delta': {'content': tok}, 'finish_reason': None}]}
+                self._chunk(f'data: {json.dumps(chunk)}\n\n')
+                time.sleep(delay)
+            final = {'id': cid, 'object': 'chat.completion.chunk', 'model': model, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+            self._chunk(f'data: {json.dumps(final)}\n\n')
+            if (body.get('stream_options') or {}).get('include_usage'):
+                self._chunk(f"data: {json.dumps({'id': cid, 'object': 'chat.completion.chunk', 'model': model, 'choices': [], 'usage': usage})}\n\n")
+            self._chunk('data: [DONE]\n\n')
+            self._end_stream()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        self.stats.done(200, len(tokens))
+
+    def _gemini(self, body: Dict, model: str, streaming: bool):
+        def error_shape(status, message):
+            return {'error': {'code': status, 'message': message, 'status': 'RESOURCE_EXHAUSTED' if status == 429 else 'INTERNAL'}}
+        if self._fault(error_shape):
+            return
+        texts = [str(p.get('text', '')) for c in body.get('contents') or [] for p in c.get('parts') or []]
+        prompt_tokens = _estimate_prompt_tokens(texts)
+        tokens = self._tokens()
+        delay = self._token_delay()
+
+        def usage(n):
+            return {'promptTokenCount': prompt_tokens, 'candidatesTokenCount': n, 'totalTokenCount': prompt_tokens + n}
+
+        def candidate(text, finished):
+            cand = {'content': {'parts': [{'text': text}], 'role': 'model'}, 'index': 0}
+            if finished:
+                cand['finishReason'] = 'STOP'
+            return cand
+        if not streaming:
+            time.sleep(delay * len(tokens))
+            self._json(200, {'candidates': [candidate(''.join(tokens).strip(), True)], 'usageMetadata': usage(len(tokens)), 'modelVersion': model})
+            self.stats.done(200, len(tokens))
+            return
+        self.stats.stream_started()
+        self._start_stream()
+        try:
+            for i, tok in enumerate(tokens):
+                last = i == len(tokens) - 1
+                chunk = {'candidates': [candidate(tok, last)], 'usageMetadata': usage(i + 1), 'modelVersion': model}
+                self._chunk(f'data: {json.dumps(chunk)}\n\n')
+                time.sleep(delay)
+            self._end_stream()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        self.stats.done(200, len(tokens))
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # accept bursts from load generators without SYN drops
+
+    def __init__(self, address, config: MockLLMConfig, verbose: bool = False):
+        super().__init__(address, MockLLMHandler)
+        self.config = config
+        self.stats = MockStats()
+        self.verbose = verbose
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+def start_in_thread(config: Optional[MockLLMConfig] = None, host: str = '127.0.0.1', port: int = 0) -> MockLLMServer:
+    """Start a server on a background thread (port 0 = any free port); call .shutdown() to stop."""
+    server = MockLLMServer((host, port), config or MockLLMConfig())
+    threading.Thread(target=server.serve_forever, name='mock-llm', daemon=True).start()
+    return server
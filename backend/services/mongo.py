@@ -1,8 +1,20 @@
+import asyncio
+import inspect
+import logging
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional
 from django.conf import settings
-from pymongo import MongoClient
-from functools import lru_cache
+from pymongo import ASCENDING, DESCENDING, TEXT, MongoClient
+from pymongo.monitoring import ConnectionPoolListener
 from urllib.parse import quote_plus
 
+logger = logging.getLogger(__name__)
+
 
 def _build_uri():
     if settings.MONGODB_URI:
@@ -21,9 +33,185 @@ def _build_uri():
     # Fallback to localhost
     return "mongodb://localhost:27017"
 
-@lru_cache(maxsize=1)
+
+class PoolStats(ConnectionPoolListener):
+    """Connection pool counters (per process) fed by pymongo's CMAP events."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counts = {'pools_created': 0, 'pools_cleared': 0, 'created': 0, 'closed': 0, 'checked_out': 0,
+                       'checked_in': 0, 'checkout_failed': 0, 'in_use': 0, 'max_in_use': 0}
+        self.checkout_ms_total = 0.0
+        self.checkout_ms_max = 0.0
+
+    def _bump(self, key, n=1):
+        with self.lock:
+            self.counts[key] += n
+
+    def pool_created(self, event):
+        self._bump('pools_created')
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._bump('pools_cleared')
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._bump('created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._bump('closed')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._bump('checkout_failed')
+
+    def connection_checked_out(self, event):
+        duration = getattr(event, 'duration', None)  # seconds, pymongo >= 4.7
+        with self.lock:
+            self.counts['checked_out'] += 1
+            self.counts['in_use'] += 1
+            self.counts['max_in_use'] = max(self.counts['max_in_use'], self.counts['in_use'])
+            if duration is not None:
+                self.checkout_ms_total += duration * 1000
+                self.checkout_ms_max = max(self.checkout_ms_max, duration * 1000)
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.counts['checked_in'] += 1
+            self.counts['in_use'] = max(0, self.counts['in_use'] - 1)
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            data = dict(self.counts)
+            data['checkout_ms_avg'] = round(self.checkout_ms_total / data['checked_out'], 2) if data['checked_out'] else None
+            data['checkout_ms_max'] = round(self.checkout_ms_max, 2)
+        return data
+
+
+_client: Optional[MongoClient] = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+_pool_stats = PoolStats()
+
+
+def _compressors() -> str:
+    """MONGODB_COMPRESSORS minus codecs whose Python package is missing (zstd needs zstandard)."""
+    wanted = [c.strip() for c in str(getattr(settings, 'MONGODB_COMPRESSORS', '') or '').split(',') if c.strip()]
+    available = []
+    for name in wanted:
+        module = {'zstd': 'zstandard', 'snappy': 'snappy'}.get(name)
+        if module:
+            try:
+                __import__(module)
+            except ImportError:
+                logger.warning('Mongo wire compressor %s unavailable (%s is missing; install requirements.txt); skipping', name, module)
+                continue
+        available.append(name)
+    return ','.join(available)
+
+
+def client_options() -> Dict:
+    """MongoClient keyword arguments from settings."""
+    options = {
+        'maxPoolSize': int(getattr(settings, 'MONGODB_MAX_POOL_SIZE', 100)),
+        'minPoolSize': int(getattr(settings, 'MONGODB_MIN_POOL_SIZE', 0)),
+        'maxIdleTimeMS': int(getattr(settings, 'MONGODB_MAX_IDLE_TIME_MS', 0)) or None,
+        'waitQueueTimeoutMS': int(getattr(settings, 'MONGODB_WAIT_QUEUE_TIMEOUT_MS', 0)) or None,
+        'connectTimeoutMS': int(getattr(settings, 'MONGODB_CONNECT_TIMEOUT_MS', 20000)),
+        'serverSelectionTimeoutMS': int(getattr(settings, 'MONGODB_SERVER_SELECTION_TIMEOUT_MS', 30000)),
+        'event_listeners': [_pool_stats],
+    }
+    compressors = _compressors()
+    if compressors:
+        options['compressors'] = compressors
+        if 'zlib' in compressors.split(','):
+            options['zlibCompressionLevel'] = int(getattr(settings, 'MONGODB_ZLIB_LEVEL', 1))
+    return {k: v for k, v in options.items() if v is not None}
+
+
 def get_client() -> MongoClient:
-    return MongoClient(_build_uri())
+    """The process's MongoClient, created lazily.
+    A client inherited across fork() (gunicorn --preload) is dropped, not reused: its sockets
+    and monitor threads belong to the parent, so each worker builds its own pool.
+    """
+    global _client, _client_pid
+    client = _client
+    if client is not None and _client_pid == os.getpid():
+        return client
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            if _client is not None:
+                _pool_stats.reset()
+            _client = MongoClient(_build_uri(), **client_options())
+            _client_pid = os.getpid()
+        return _client
+
+
+def reset_client():
+    """Forget the current client (after fork, or when settings change). Closed only if this process owns it."""
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            try:
+                _client.close()
+            except Exception:
+                pass
+        _client, _client_pid = None, None
+        _pool_stats.reset()
+
+
+def _after_fork_in_child():
+    # The lock may have been held by another thread at fork time; replace rather than acquire it
+    global _client, _client_pid, _client_lock
+    _client_lock = threading.Lock()
+    _client, _client_pid = None, None
+    _pool_stats.lock = threading.Lock()
+    _pool_stats.reset()
+    _reset_async_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def warm_pool(connections: Optional[int] = None) -> Dict:
+    """Open `connections` (default MONGODB_WARM_CONNECTIONS) pooled sockets now, e.g. at worker boot,
+    so the first requests don't pay DNS/TLS/auth setup. Returns what was done.
+    """
+    n = max(1, int(connections if connections is not None else getattr(settings, 'MONGODB_WARM_CONNECTIONS', 2)))
+    started = time.monotonic()
+    client = get_client()
+    client.admin.command('ping')  # server selection + first connection
+    if n > 1:
+        # Concurrent pings force the pool to open that many connections
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            list(pool.map(lambda _: client.admin.command('ping'), range(n)))
+    return {'connections': n, 'elapsed_ms': round((time.monotonic() - started) * 1000, 1)}
+
+
+def pool_stats() -> Dict:
+    options = client_options()
+    options.pop('event_listeners', None)
+    return {
+        'pid': os.getpid(),
+        'connected': _client is not None and _client_pid == os.getpid(),
+        'options': options,
+        'pool': _pool_stats.snapshot(),
+        'async_driver': _async_driver()[0] or 'executor',
+    }
 
 
 def get_db():
@@ -37,5 +225,190 @@ def documents_collection():
 def chats_collection():
     return get_db()[settings.MONGODB_COLLECTION_CHATS]
 
+def conversations_collection():
+    return get_db()[settings.MONGODB_COLLECTION_CONVERSATIONS]
+
+def chat_raw_collection():
+    return get_db()[settings.MONGODB_COLLECTION_CHAT_RAW]
+
 def profiles_collection():
     return get_db()['profiles']
+
+
+# --- async access -----------------------------------------------------------
+# Async views await Mongo through AsyncCollection. It uses pymongo's native AsyncMongoClient
+# (pymongo >= 4.10) or motor when either is installed, with one client per event loop (both are
+# loop-bound). Without an async driver the same calls run the sync client on a small dedicated
+# executor, which keeps the event loop free but does hop threads.
+
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> (pid, client)
+_async_lock = threading.Lock()
+_fallback_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _async_driver():
+    """(name, client class) of the installed async driver, or (None, None)."""
+    try:
+        from pymongo import AsyncMongoClient  # type: ignore
+        return 'pymongo', AsyncMongoClient
+    except ImportError:
+        pass
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient  # type: ignore
+        return 'motor', AsyncIOMotorClient
+    except ImportError:
+        return None, None
+
+
+def _fallback_executor() -> ThreadPoolExecutor:
+    global _fallback_pool
+    if _fallback_pool is None:
+        with _async_lock:
+            if _fallback_pool is None:
+                _fallback_pool = ThreadPoolExecutor(max_workers=int(getattr(settings, 'MONGODB_ASYNC_FALLBACK_WORKERS', 8)),
+                                                    thread_name_prefix='mongo-async')
+    return _fallback_pool
+
+
+def _reset_async_after_fork():
+    global _async_lock, _fallback_pool
+    _async_lock = threading.Lock()
+    _async_clients.clear()
+    _fallback_pool = None
+
+
+def get_async_db():
+    """The running event loop's async database handle, or None when no async driver is installed."""
+    name, client_cls = _async_driver()
+    if client_cls is None:
+        return None
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(loop)
+    if entry is None or entry[0] != os.getpid():
+        with _async_lock:
+            entry = _async_clients.get(loop)
+            if entry is None or entry[0] != os.getpid():
+                options = client_options()
+                if name == 'motor':
+                    options['io_loop'] = loop
+                entry = _async_clients[loop] = (os.getpid(), client_cls(_build_uri(), **options))
+    return entry[1][settings.MONGODB_DB_NAME]
+
+
+class AsyncCollection:
+    """The awaitable subset of a collection the async views need, the same across drivers."""
+
+    def __init__(self, name: str):
+        self.name = name
+        db = get_async_db()
+        self.native = db[name] if db is not None else None
+
+    async def _sync(self, method: str, *args, **kwargs):
+        collection = get_db()[self.name]
+        return await asyncio.get_running_loop().run_in_executor(
+            _fallback_executor(), partial(getattr(collection, method), *args, **kwargs))
+
+    async def find_one(self, filter: Dict, projection: Optional[Dict] = None):
+        if self.native is None:
+            return await self._sync('find_one', filter, projection)
+        return await self.native.find_one(filter, projection)
+
+    async def insert_one(self, document: Dict):
+        if self.native is None:
+            return await self._sync('insert_one', document)
+        return await self.native.insert_one(document)
+
+    async def update_one(self, filter: Dict, update: Dict, upsert: bool = False):
+        if self.native is None:
+            return await self._sync('update_one', filter, update, upsert=upsert)
+        return await self.native.update_one(filter, update, upsert=upsert)
+
+    async def find_one_and_update(self, filter: Dict, update: Dict, projection: Optional[Dict] = None, return_document=False):
+        if self.native is None:
+            return await self._sync('find_one_and_update', filter, update, projection=projection, return_document=return_document)
+        return await self.native.find_one_and_update(filter, update, projection=projection, return_document=return_document)
+
+    async def create_index(self, keys, **kwargs):
+        if self.native is None:
+            return await self._sync('create_index', keys, **kwargs)
+        return await self.native.create_index(keys, **kwargs)
+
+    async def find_list(self, filter: Dict, projection: Optional[Dict] = None, sort=None, limit: int = 0) -> List[Dict]:
+        if self.native is None:
+            def run():
+                cursor = get_db()[self.name].find(filter, projection)
+                if sort:
+                    cursor = cursor.sort(sort)
+                return list(cursor.limit(limit) if limit else cursor)
+            return await asyncio.get_running_loop().run_in_executor(_fallback_executor(), run)
+        cursor = self.native.find(filter, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        return await cursor.to_list(length=limit or None)
+
+    async def aggregate_list(self, pipeline: List[Dict]) -> List[Dict]:
+        if self.native is None:
+            return await asyncio.get_running_loop().run_in_executor(
+                _fallback_executor(), lambda: list(get_db()[self.name].aggregate(pipeline)))
+        cursor = self.native.aggregate(pipeline)
+        if inspect.isawaitable(cursor):  # pymongo's async driver returns a coroutine, motor a cursor
+            cursor = await cursor
+        return await cursor.to_list(length=None)
+
+
+def achats_collection() -> AsyncCollection:
+    return AsyncCollection(settings.MONGODB_COLLECTION_CHATS)
+
+
+def aconversations_collection() -> AsyncCollection:
+    return AsyncCollection(settings.MONGODB_COLLECTION_CONVERSATIONS)
+
+
+def achat_raw_collection() -> AsyncCollection:
+    return AsyncCollection(settings.MONGODB_COLLECTION_CHAT_RAW)
+
+
+def aprofiles_collection() -> AsyncCollection:
+    return AsyncCollection('profiles')
+
+
+# Indexes the chat endpoints rely on: (collection setting, keys, options). History and
+# conversation listing page by (created_at/updated_at, _id) keysets, so each has a matching
+# compound index. The text index is prefixed by user_id, so every search is scoped to one user
+# and only touches that user's index entries; Mongo maintains it on each insert.
+CHAT_INDEXES = (
+    ('MONGODB_COLLECTION_CHATS', [('user_id', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)], {}),
+    ('MONGODB_COLLECTION_CHATS', [('conversation_id', ASCENDING), ('seq', ASCENDING)], {}),
+    ('MONGODB_COLLECTION_CHATS', [('user_id', ASCENDING), ('messages.content', TEXT), ('response.content', TEXT)],
+     {'name': 'chat_text', 'weights': {'messages.content': 2, 'response.content': 1}, 'default_language': 'english'}),
+    ('MONGODB_COLLECTION_CONVERSATIONS', [('user_id', ASCENDING), ('updated_at', DESCENDING), ('_id', DESCENDING)], {}),
+)
+_indexes_ready = False
+_indexes_lock = threading.Lock()
+
+
+async def aensure_indexes():
+    """Async twin of ensure_indexes for async views (no-op once the indexes exist)."""
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    for setting, keys, options in CHAT_INDEXES:
+        await AsyncCollection(getattr(settings, setting)).create_index(keys, **options)
+    _indexes_ready = True
+
+
+def ensure_indexes(force: bool = False):
+    """Create the chat indexes (idempotent; once per process unless `force`). Returns the index names."""
+    global _indexes_ready
+    if _indexes_ready and not force:
+        return []
+    with _indexes_lock:
+        names = []
+        if force or not _indexes_ready:
+            db = get_db()
+            for setting, keys, options in CHAT_INDEXES:
+                names.append(db[getattr(settings, setting)].create_index(keys, **options))
+            _indexes_ready = True
+        return names
@@ -0,0 +1,139 @@
+"""Provider raw payloads, kept out of the hot chat document.
+
+``openai_chat``/``gemini_chat`` attach the full provider JSON as ``raw``. It is split off the
+record before persisting (and before the response goes back to the client) and handled per
+``AI_RAW_RETENTION``:
+
+- ``drop``: discarded.
+- ``sample``: a random ``AI_RAW_SAMPLE_RATE`` fraction is stored, the rest dropped.
+- ``compress``: every payload is stored.
+
+Stored payloads go to their own collection (``MONGODB_COLLECTION_CHAT_RAW``) keyed by the
+chat record id, compressed with zstd (``zstandard`` is a pinned requirement; zlib only if it is missing), and
+are only read when a client asks for them (``GET /api/chat/history/<id>/raw/``).
+"""
+import json
+import random
+import zlib
+from typing import Dict, Optional
+
+from bson import Binary, ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+
+from services.chat_writer import get_writer, write_behind_enabled
+from services.mongo import achat_raw_collection, chat_raw_collection
+
+POLICIES = ('drop', 'sample', 'compress')
+_stats = {'dropped': 0, 'stored': 0, 'bytes_in': 0, 'bytes_stored': 0}
+
+
+def _zstd():
+    try:
+        import zstandard  # type: ignore
+        return zstandard
+    except ImportError:
+        return None
+
+
+def policy() -> str:
+    value = str(getattr(settings, 'AI_RAW_RETENTION', 'compress')).lower()
+    return value if value in POLICIES else 'compress'
+
+
+def take_raw(record: Dict) -> Optional[Dict]:
+    """Detach the provider payload from `record` and return it."""
+    raw = record.pop('raw', None)
+    response = record.get('response')
+    if isinstance(response, dict) and 'raw' in response:
+        # Copy rather than pop: the response dict may also sit in the completion cache
+        raw = response['raw'] or raw
+        record['response'] = {k: v for k, v in response.items() if k != 'raw'}
+    return raw
+
+
+def should_store() -> bool:
+    mode = policy()
+    if mode == 'compress':
+        return True
+    if mode == 'sample':
+        return random.random() < float(getattr(settings, 'AI_RAW_SAMPLE_RATE', 0.01))
+    return False
+
+
+def compress(payload: Dict):
+    """(codec, compressed bytes, uncompressed size) for a JSON-serializable payload."""
+    data = json.dumps(payload, separators=(',', ':'), default=str).encode('utf-8')
+    zstd = _zstd()
+    if zstd is not None:
+        return 'zstd', zstd.ZstdCompressor(level=int(getattr(settings, 'AI_RAW_ZSTD_LEVEL', 3))).compress(data), len(data)
+    return 'zlib', zlib.compress(data, 6), len(data)
+
+
+def decompress(codec: str, data: bytes) -> Dict:
+    if codec == 'zstd':
+        zstd = _zstd()
+        if zstd is None:
+            raise RuntimeError('payload is zstd-compressed but zstandard is not installed')
+        data = zstd.ZstdDecompressor().decompress(data)
+    elif codec == 'zlib':
+        data = zlib.decompress(data)
+    return json.loads(data)
+
+
+def _raw_write(record_id: str, user_id: int, raw: Optional[Dict], created_at=None):
+    """(filter, update) to store one payload, or None when the policy drops it."""
+    if not raw:
+        return None
+    if not should_store():
+        _stats['dropped'] += 1
+        return None
+    codec, blob, size = compress(raw)
+    doc = {'user_id': user_id, 'codec': codec, 'data': Binary(blob), 'size': size, 'created_at': created_at}
+    _stats['stored'] += 1
+    _stats['bytes_in'] += size
+    _stats['bytes_stored'] += len(blob)
+    # Upsert by record id so a replayed spill file cannot duplicate it
+    return {'_id': ObjectId(record_id)}, {'$set': doc}
+
+
+def store_raw(record_id: str, user_id: int, raw: Optional[Dict], created_at=None) -> bool:
+    """Apply the retention policy to one payload; returns True if it was stored."""
+    write = _raw_write(record_id, user_id, raw, created_at)
+    if write is None:
+        return False
+    if write_behind_enabled():
+        get_writer().submit_update(settings.MONGODB_COLLECTION_CHAT_RAW, *write, upsert=True)
+    else:
+        chat_raw_collection().update_one(*write, upsert=True)
+    return True
+
+
+async def astore_raw(record_id: str, user_id: int, raw: Optional[Dict], created_at=None) -> bool:
+    """Async twin of store_raw."""
+    write = _raw_write(record_id, user_id, raw, created_at)
+    if write is None:
+        return False
+    if write_behind_enabled():
+        get_writer().submit_update(settings.MONGODB_COLLECTION_CHAT_RAW, *write, upsert=True, block=False)
+    else:
+        await achat_raw_collection().update_one(*write, upsert=True)
+    return True
+
+
+def load_raw(user_id: int, record_id: str) -> Optional[Dict]:
+    """The stored payload for one of the user's chat records (None if absent or not theirs)."""
+    try:
+        oid = ObjectId(record_id)
+    except (InvalidId, TypeError):
+        return None
+    doc = chat_raw_collection().find_one({'_id': oid, 'user_id': user_id})
+    if doc is None:
+        return None
+    return decompress(doc.get('codec'), bytes(doc['data']))
+
+
+def raw_stats() -> Dict:
+    data = dict(_stats, policy=policy(), codec='zstd' if _zstd() is not None else 'zlib')
+    data['ratio'] = round(data['bytes_stored'] / data['bytes_in'], 3) if data['bytes_in'] else None
+    return data
@@ -0,0 +1,89 @@
+"""Full-text search over a user's chat records.
+
+Backed by the ``chat_text`` index (services.mongo.CHAT_INDEXES) over message and reply text,
+prefixed by ``user_id`` so a query can only ever match the caller's own records. Results
+are ranked by text score, with ``_id`` as a tiebreak. Pages are keyset cursors over
+(score, _id), so paging never re-ranks or skips. Snippets are cut around the first matching
+term on the server, so results never carry whole message lists.
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from services.history import pack_cursor, unpack_cursor
+from services.mongo import chats_collection, ensure_indexes
+
+SNIPPET_CHARS = 160
+_TERM_RE = re.compile(r'"([^"]+)"|(-?\w+)', re.UNICODE)
+
+
+def query_terms(q: str) -> List[str]:
+    """Words and quoted phrases from a search string, without negated terms."""
+    terms = []
+    for phrase, word in _TERM_RE.findall(q):
+        if phrase:
+            terms.append(phrase)
+        elif word and not word.startswith('-'):
+            terms.append(word)
+    return terms
+
+
+def snippet(text: str, terms: List[str], width: int = SNIPPET_CHARS) -> Optional[str]:
+    """~`width` characters around the first occurrence of any term (None if none occurs)."""
+    lowered = text.lower()
+    hits = [i for i in (lowered.find(t.lower()) for t in terms) if i >= 0]
+    if not hits:
+        return None
+    start = max(0, min(hits) - width // 3)
+    end = min(len(text), start + width)
+    out = ' '.join(text[start:end].split())
+    return ('…' if start > 0 else '') + out + ('…' if end < len(text) else '')
+
+
+def encode_cursor(score: float, oid) -> str:
+    return pack_cursor({'s': score, 'id': str(oid)})
+
+
+def decode_cursor(cursor: str) -> Tuple[float, ObjectId]:
+    try:
+        data = unpack_cursor(cursor)
+        return float(data['s']), ObjectId(data['id'])
+    except (ValueError, TypeError, KeyError, InvalidId) as e:
+        raise ValueError('invalid cursor') from e
+
+
+def search_chats(user_id: int, q: str, limit: int = 20, cursor: Optional[str] = None):
+    """One page of ranked matches: (results, next cursor or None). ValueError for a bad cursor."""
+    ensure_indexes()
+    pipeline: List[Dict] = [
+        {'$match': {'user_id': user_id, '$text': {'$search': q}}},
+        {'$addFields': {'score': {'$meta': 'textScore'}}},
+    ]
+    if cursor:
+        score, oid = decode_cursor(cursor)
+        pipeline.append({'$match': {'$or': [{'score': {'$lt': score}}, {'score': score, '_id': {'$lt': oid}}]}})
+    pipeline += [
+        {'$sort': {'score': -1, '_id': -1}},
+        {'$limit': limit + 1},
+        {'$project': {'score': 1, 'created_at': 1, 'conversation_id': 1, 'seq': 1,
+                      'messages.role': 1, 'messages.content': 1, 'response.content': 1}},
+    ]
+    docs = list(chats_collection().aggregate(pipeline))
+    next_cursor = encode_cursor(docs[limit - 1]['score'], docs[limit - 1]['_id']) if len(docs) > limit else None
+    terms = query_terms(q)
+    results = []
+    for d in docs[:limit]:
+        texts = [(m.get('role'), m.get('content') or '') for m in d.get('messages') or []]
+        texts.append(('assistant', (d.get('response') or {}).get('content') or ''))
+        snippets = [{'role': role, 'text': s} for role, s in ((r, snippet(t, terms)) for r, t in texts) if s]
+        results.append({
+            '_id': str(d['_id']),
+            'conversation_id': str(d['conversation_id']) if d.get('conversation_id') else None,
+            'seq': d.get('seq'),
+            'created_at': d.get('created_at'),
+            'score': round(d['score'], 4),
+            'snippets': snippets[:3],
+        })
+    return results, next_cursor
@@ -0,0 +1,438 @@
+"""Pooled, keep-alive HTTP transport shared by the LLM provider clients.
+
+Every provider (openai, gemini, ...) gets one long-lived ``requests.Session``
+per process, so chat/generate/regenerate/finalize calls reuse warm TCP+TLS
+connections instead of paying a fresh handshake on every request.
+Pool sizing, timeouts, keep-alive, optional HTTP/2 (via ``httpx[http2]``)
+and gzip request bodies are driven by the ``AI_HTTP_*`` settings.
+
+``get_async_transport`` provides the asyncio equivalent (an ``httpx.AsyncClient``
+per provider per event loop) for the async views served under ASGI. Its pool usage
+(new connections, pooled reuse, waits for a free connection) is counted from
+httpcore's request trace. Every transport a process opened is closed at exit, the
+same way the chat writer flushes.
+"""
+import asyncio
+import atexit
+import contextlib
+import gzip
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import weakref
+from typing import Dict, Optional, Tuple, Union
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+logger = logging.getLogger(__name__)
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+class PoolStats:
+    """Thread-safe counters describing how a provider's connection pool is used."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.checkouts = 0
+        self.new_connections = 0
+        self.waits = 0
+        self.wait_ms = 0.0
+        self.compressed_requests = 0
+        self.bytes_saved = 0
+
+    def incr(self, field: str, amount: float = 1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            hits = max(0, self.checkouts - self.new_connections)
+            return {
+                'requests': self.requests,
+                'checkouts': self.checkouts,
+                'hits': hits,
+                'new_connections': self.new_connections,
+                'waits': self.waits,
+                'wait_ms': round(self.wait_ms, 2),
+                'hit_ratio': round(hits / self.checkouts, 3) if self.checkouts else None,
+                'compressed_requests': self.compressed_requests,
+                'bytes_saved': self.bytes_saved,
+            }
+
+
+class _StatsPoolMixin:
+    """Connection pool hook counting checkouts, new sockets and pool waits."""
+    _pool_stats: PoolStats
+
+    def _get_conn(self, timeout=None):
+        stats = self._pool_stats
+        stats.incr('checkouts')
+        pool = getattr(self, 'pool', None)
+        if pool is not None and pool.empty():
+            # Every connection is checked out: we either block (pool_block) or overflow.
+            stats.incr('waits')
+            start = time.monotonic()
+            try:
+                return super()._get_conn(timeout)
+            finally:
+                stats.incr('wait_ms', (time.monotonic() - start) * 1000)
+        return super()._get_conn(timeout)
+
+    def _new_conn(self):
+        self._pool_stats.incr('new_connections')
+        return super()._new_conn()
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools report into a PoolStats and enable TCP keep-alive."""
+
+    def __init__(self, stats: PoolStats, tcp_keepalive: bool = True, **kwargs):
+        self._stats = stats
+        self._tcp_keepalive = tcp_keepalive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        if self._tcp_keepalive:
+            pool_kwargs.setdefault(
+                'socket_options',
+                HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)],
+            )
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        attrs = {'_pool_stats': self._stats}
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('StatsHTTPConnectionPool', (_StatsPoolMixin, HTTPConnectionPool), attrs),
+            'https': type('StatsHTTPSConnectionPool', (_StatsPoolMixin, HTTPSConnectionPool), attrs),
+        }
+
+
+def _load_httpx():
+    """Return the httpx module when HTTP/2 support is installed, else None."""
+    try:
+        import httpx  # type: ignore
+        import h2  # type: ignore  # noqa: F401  (httpx needs it for http2=True)
+        return httpx
+    except ImportError:
+        return None
+
+
+class ProviderTransport:
+    """Per-provider HTTP client: a pooled session plus connection statistics."""
+
+    def __init__(self, name: str, pool_connections: int = 4, pool_maxsize: int = 20, pool_block: bool = False,
+                 connect_timeout: float = 5.0, read_timeout: float = 60.0, keepalive: bool = True,
+                 http2: bool = False, compress_min_bytes: int = 0):
+        self.name = name
+        self.pid = os.getpid()
+        self.timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+        self.keepalive = keepalive
+        self.compress_min_bytes = compress_min_bytes
+        self.pool_maxsize = pool_maxsize
+        self.stats = PoolStats()
+        self.session = requests.Session()
+        adapter = PooledAdapter(
+            self.stats,
+            tcp_keepalive=keepalive,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            max_retries=0,
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        if not keepalive:
+            self.session.headers['Connection'] = 'close'
+        self._h2 = None
+        if http2:
+            httpx = _load_httpx()
+            if httpx is None:
+                logger.warning('AI_HTTP_HTTP2 enabled but httpx[http2] is not installed; using HTTP/1.1 for %s', name)
+            else:
+                self._h2 = httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize if keepalive else 0),
+                    timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                )
+
+    @property
+    def http2(self) -> bool:
+        return self._h2 is not None
+
+    def _encode(self, payload, headers: Dict[str, str]) -> bytes:
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        headers.setdefault('Content-Type', 'application/json')
+        if self.compress_min_bytes and len(body) >= self.compress_min_bytes:
+            compressed = gzip.compress(body, compresslevel=5)
+            if len(compressed) < len(body):
+                self.stats.incr('compressed_requests')
+                self.stats.incr('bytes_saved', len(body) - len(compressed))
+                headers['Content-Encoding'] = 'gzip'
+                body = compressed
+        return body
+
+    def post(self, url: str, json=None, headers: Optional[Dict[str, str]] = None, timeout: Optional[Timeout] = None,
+             stream: bool = False) -> requests.Response:
+        """POST a JSON payload over the pooled connection and return a ``requests.Response``."""
+        hdrs = dict(headers or {})
+        body = self._encode(json, hdrs)
+        self.stats.incr('requests')
+        timeout = timeout if timeout is not None else self.timeout
+        if self._h2 is not None and not stream:
+            return self._post_h2(url, body, hdrs, timeout)
+        return self.session.post(url, data=body, headers=hdrs, timeout=timeout, stream=stream)
+
+    def _post_h2(self, url: str, body: bytes, headers: Dict[str, str], timeout: Timeout) -> requests.Response:
+        import httpx  # type: ignore
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        try:
+            r = self._h2.post(url, content=body, headers=headers, timeout=httpx.Timeout(read, connect=connect))
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(str(e)) from e
+        except httpx.HTTPError as e:
+            raise requests.ConnectionError(str(e)) from e
+        # Present the httpx result as a requests.Response so callers stay transport-agnostic
+        resp = requests.Response()
+        resp.status_code = r.status_code
+        resp.reason = r.reason_phrase
+        resp.headers = CaseInsensitiveDict(r.headers)
+        resp.url = str(r.url)
+        resp._content = r.content
+        resp.encoding = r.encoding
+        return resp
+
+    def close(self):
+        self.session.close()
+        if self._h2 is not None:
+            self._h2.close()
+
+    def snapshot(self) -> Dict:
+        data = self.stats.snapshot()
+        data.update({
+            'pool_maxsize': self.pool_maxsize,
+            'connect_timeout': self.timeout[0],
+            'read_timeout': self.timeout[1],
+            'keepalive': self.keepalive,
+            'http2': self.http2,
+        })
+        return data
+
+
+class AsyncProviderTransport:
+    """asyncio twin of ProviderTransport built on httpx.AsyncClient (bound to one event loop)."""
+
+    def __init__(self, name: str, pool_maxsize: int = 20, connect_timeout: float = 5.0, read_timeout: float = 60.0,
+                 keepalive: bool = True, http2: bool = False, compress_min_bytes: int = 0):
+        import httpx  # type: ignore
+        self.name = name
+        self.pid = os.getpid()
+        self.timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+        self.keepalive = keepalive
+        self.compress_min_bytes = compress_min_bytes
+        self.pool_maxsize = pool_maxsize
+        self.stats = PoolStats()
+        self.in_use = 0  # requests holding (or waiting for) a connection; only touched on the client's loop
+        self.peak_in_use = 0
+        self.http2 = bool(http2 and _load_httpx() is not None)
+        self.client = httpx.AsyncClient(
+            http2=self.http2,
+            limits=httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize if keepalive else 0),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+
+    _encode = ProviderTransport._encode
+
+    def _timeout(self, timeout: Optional[Timeout]):
+        import httpx  # type: ignore
+        connect, read = self.timeout if timeout is None else (timeout if isinstance(timeout, tuple) else (timeout, timeout))
+        return httpx.Timeout(read, connect=connect)
+
+    def _checkout(self):
+        """Start one request: (httpcore trace hook, release callback).
+        The hook counts new connections, and the wait for a connection when every pooled one was busy.
+        """
+        busy = self.in_use >= self.pool_maxsize
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        started = time.monotonic()
+        sent = []
+
+        async def trace(event: str, info: Dict):
+            if event == 'connection.connect_tcp.complete':
+                self.stats.incr('new_connections')
+            elif event.endswith('.send_request_headers.started') and not sent:
+                sent.append(True)
+                self.stats.incr('checkouts')
+                if busy:
+                    self.stats.incr('waits')
+                    self.stats.incr('wait_ms', (time.monotonic() - started) * 1000)
+
+        def release():
+            self.in_use -= 1
+
+        return trace, release
+
+    async def post(self, url: str, json=None, headers: Optional[Dict[str, str]] = None, timeout: Optional[Timeout] = None):
+        """POST a JSON payload and return the (fully read) ``httpx.Response``."""
+        hdrs = dict(headers or {})
+        body = self._encode(json, hdrs)
+        self.stats.incr('requests')
+        trace, release = self._checkout()
+        try:
+            return await self.client.post(url, content=body, headers=hdrs, timeout=self._timeout(timeout), extensions={'trace': trace})
+        finally:
+            release()
+
+    @contextlib.asynccontextmanager
+    async def stream(self, url: str, json=None, headers: Optional[Dict[str, str]] = None, timeout: Optional[Timeout] = None):
+        """Async context manager yielding a streamed ``httpx.Response``."""
+        hdrs = dict(headers or {})
+        body = self._encode(json, hdrs)
+        self.stats.incr('requests')
+        trace, release = self._checkout()
+        try:
+            async with self.client.stream('POST', url, content=body, headers=hdrs, timeout=self._timeout(timeout), extensions={'trace': trace}) as r:
+                yield r
+        finally:
+            release()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def snapshot(self) -> Dict:
+        data = self.stats.snapshot()
+        data.update({'pool_maxsize': self.pool_maxsize, 'in_use': self.in_use, 'peak_in_use': self.peak_in_use,
+                     'http2': self.http2, 'async': True})
+        return data
+
+
+_transports: Dict[str, ProviderTransport] = {}
+# loop -> {provider: transport}; weak so clients die with their event loop
+_async_transports: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, AsyncProviderTransport]]' = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def _build_transport(name: str) -> ProviderTransport:
+    return ProviderTransport(
+        name,
+        pool_connections=getattr(settings, 'AI_HTTP_POOL_CONNECTIONS', 4),
+        pool_maxsize=getattr(settings, 'AI_HTTP_POOL_MAXSIZE', 20),
+        pool_block=getattr(settings, 'AI_HTTP_POOL_BLOCK', False),
+        connect_timeout=getattr(settings, 'AI_HTTP_CONNECT_TIMEOUT', 5.0),
+        read_timeout=getattr(settings, 'AI_HTTP_READ_TIMEOUT', 60.0),
+        keepalive=getattr(settings, 'AI_HTTP_KEEPALIVE', True),
+        http2=getattr(settings, 'AI_HTTP_HTTP2', False),
+        compress_min_bytes=getattr(settings, 'AI_HTTP_COMPRESS_MIN_BYTES', 0),
+    )
+
+
+def get_transport(name: str) -> ProviderTransport:
+    """Return the process-wide transport for a provider, creating it lazily.
+    Transports inherited across fork() are discarded so workers never share sockets.
+    """
+    t = _transports.get(name)
+    if t is not None and t.pid == os.getpid():
+        return t
+    with _lock:
+        t = _transports.get(name)
+        if t is None or t.pid != os.getpid():
+            t = _build_transport(name)
+            _transports[name] = t
+        return t
+
+
+def get_async_transport(name: str) -> AsyncProviderTransport:
+    """Return the async transport for a provider on the running event loop (httpx clients are loop-bound)."""
+    loop = asyncio.get_running_loop()
+    t = _async_transports.get(loop, {}).get(name)
+    if t is not None and t.pid == os.getpid():
+        return t
+    with _lock:
+        per_loop = _async_transports.setdefault(loop, {})
+        t = per_loop.get(name)
+        if t is None or t.pid != os.getpid():
+            t = AsyncProviderTransport(
+                name,
+                pool_maxsize=getattr(settings, 'AI_HTTP_POOL_MAXSIZE', 20),
+                connect_timeout=getattr(settings, 'AI_HTTP_CONNECT_TIMEOUT', 5.0),
+                read_timeout=getattr(settings, 'AI_HTTP_READ_TIMEOUT', 60.0),
+                keepalive=getattr(settings, 'AI_HTTP_KEEPALIVE', True),
+                http2=getattr(settings, 'AI_HTTP_HTTP2', False),
+                compress_min_bytes=getattr(settings, 'AI_HTTP_COMPRESS_MIN_BYTES', 0),
+            )
+            per_loop[name] = t
+        return t
+
+
+def _close_async(loop: asyncio.AbstractEventLoop, transport: AsyncProviderTransport, timeout: float = 5.0):
+    """Close an async client on its own loop: run it there if the loop is idle, hand it over if it is running."""
+    if loop.is_closed():
+        return  # its sockets go with the process
+    if loop.is_running():
+        if loop is not _running_loop():
+            asyncio.run_coroutine_threadsafe(transport.aclose(), loop).result(timeout)
+        else:
+            loop.create_task(transport.aclose())
+    else:
+        loop.run_until_complete(transport.aclose())
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def close_transports():
+    """Close and forget every transport this process opened, sync sessions and async clients alike."""
+    with _lock:
+        sync = [t for t in _transports.values() if t.pid == os.getpid()]
+        loops = [(loop, t) for loop, per_loop in list(_async_transports.items()) for t in per_loop.values() if t.pid == os.getpid()]
+        _transports.clear()
+        _async_transports.clear()
+    for t in sync:
+        try:
+            t.close()
+        except Exception:
+            logger.exception('Could not close %s transport', t.name)
+    for loop, t in loops:
+        try:
+            _close_async(loop, t)
+        except Exception:
+            logger.exception('Could not close async %s transport', t.name)
+
+
+def reset_transports():
+    """Close and forget all transports (tests / settings changes)."""
+    close_transports()
+
+
+_SUMMED = ('requests', 'checkouts', 'hits', 'new_connections', 'waits', 'wait_ms', 'compressed_requests', 'bytes_saved', 'in_use', 'peak_in_use')
+
+
+def transport_stats() -> Dict[str, Dict]:
+    stats = {name: t.snapshot() for name, t in list(_transports.items()) if t.pid == os.getpid()}
+    for per_loop in list(_async_transports.values()):
+        for name, t in list(per_loop.items()):
+            if t.pid != os.getpid():
+                continue
+            # Several loops may hold clients for the same provider; report them summed under '<name>:async'
+            snap = t.snapshot()
+            agg = stats.setdefault(f'{name}:async', {'loops': 0, 'pool_maxsize': snap['pool_maxsize'], 'http2': snap['http2'], 'async': True})
+            agg['loops'] += 1
+            for field in _SUMMED:
+                agg[field] = agg.get(field, 0) + snap[field]
+            agg['hit_ratio'] = round(agg['hits'] / agg['checkouts'], 3) if agg['checkouts'] else None
+    return stats
+
+
+atexit.register(close_transports)
@@ -1,5 +1,10 @@
 from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
+from django.http import JsonResponse
 from typing import Optional, Tuple, Any
 from services.firebase_auth import verify_id_token
 
@@ -25,3 +30,49 @@ class FirebaseAuthentication(BaseAuthentication):
             defaults['email'] = email
         user, _ = User.objects.get_or_create(username=uid or email or f'user_{payload.get("sub")}', defaults=defaults)
         return (user, None)
+
+
+def _authenticate_plain_request(request):
+    drf_request = Request(request, authenticators=[cls() for cls in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        user = drf_request.user
+    except exceptions.APIException:
+        return None
+    return user if user is not None and user.is_authenticated else None
+
+
+async def aauthenticate(request):
+    """Run the configured DRF authentication classes for a plain async Django view.
+    DRF's APIView is sync-only, so async endpoints authenticate through this helper;
+    returns the authenticated user or None.
+    """
+    return await sync_to_async(_authenticate_plain_request)(request)
+
+
+def _throttle_wait(request, user):
+    """Apply DEFAULT_THROTTLE_CLASSES as DRF views do; None if allowed, else seconds to wait (0 if unknown)."""
+    drf_request = Request(request)
+    drf_request.user = user
+    waits = []
+    for cls in api_settings.DEFAULT_THROTTLE_CLASSES:
+        throttle = cls()
+        if not throttle.allow_request(drf_request, None):
+            waits.append(throttle.wait() or 0)
+    return max(waits) if waits else None
+
+
+async def aauthorize(request):
+    """Authenticate and throttle a plain async view -> (user, error response or None).
+    Async endpoints reach the same paid provider calls as the DRF ones, so they are held to the
+    same throttles (and count against the same per-user budget); 401 or 429 otherwise.
+    """
+    user = await aauthenticate(request)
+    if user is None:
+        return None, JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    wait = await sync_to_async(_throttle_wait)(request, user)
+    if wait is not None:
+        resp = JsonResponse({'detail': 'Request was throttled.'}, status=429)
+        if wait:
+            resp['Retry-After'] = str(int(wait) + 1)
+        return None, resp
+    return user, None
@@ -14,6 +14,11 @@ class HealthEndpointTests(TestCase):
 		self.assertIn('status', data)
 		self.assertIn('mongo', data)  # field present even if error/degraded
 
+	def test_metrics_exposes_transport_stats(self):
+		resp = self.client.get('/api/health/metrics/', secure=True)
+		self.assertEqual(resp.status_code, 200, f"Unexpected status {resp.status_code}")
+		self.assertIn('ai_transport', resp.json())
+
 	def test_root_lists_versioned_alias(self):
 		resp = self.client.get('/', secure=True)
 		self.assertEqual(resp.status_code, 200, f"Unexpected status {resp.status_code}")
@@ -36,3 +41,35 @@ class RootViewTests(TestCase):
 		self.assertIn('auth', data['endpoints'])
 		self.assertIn('documents', data['endpoints'])
 		self.assertIn('chat', data['endpoints'])
+
+
+class AsyncProfileTests(TestCase):
+	def test_async_profile_awaits_collection(self):
+		from unittest import mock
+		from django.contrib.auth import get_user_model
+		from rest_framework_simplejwt.tokens import RefreshToken
+		user = get_user_model().objects.create_user(username='profiled', password='pw-12345678')
+		auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(user).access_token}'}
+		coll = mock.Mock(update_one=mock.AsyncMock(), find_one=mock.AsyncMock(return_value={'_id': 'p1', 'user_id': user.id, 'bio': 'hi'}))
+		with mock.patch('users.views.aprofiles_collection', return_value=coll):
+			resp = Client().post('/api/profile/async/', {'bio': 'hi', 'is_staff': True}, content_type='application/json', secure=True, **auth)
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resp.json()['bio'], 'hi')
+		coll.update_one.assert_awaited_once_with({'user_id': user.id}, {'$set': {'bio': 'hi', 'user_id': user.id}}, upsert=True)
+		self.assertEqual(Client().get('/api/profile/async/', secure=True).status_code, 401)
+
+	def test_async_profile_is_throttled_like_drf_views(self):
+		from unittest import mock
+		from django.contrib.auth import get_user_model
+		from django.core.cache import cache
+		from rest_framework.throttling import UserRateThrottle
+		from rest_framework_simplejwt.tokens import RefreshToken
+		user = get_user_model().objects.create_user(username='profile-throttled', password='pw-12345678')
+		auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(user).access_token}'}
+		coll = mock.Mock(find_one=mock.AsyncMock(return_value={'_id': 'p1', 'user_id': user.id}))
+		cache.clear()
+		self.addCleanup(cache.clear)
+		with mock.patch.object(UserRateThrottle, 'THROTTLE_RATES', {'user': '1/min', 'anon': '1/min'}), \
+			mock.patch('users.views.aprofiles_collection', return_value=coll):
+			codes = [Client().get('/api/profile/async/', secure=True, **auth).status_code for _ in range(2)]
+		self.assertEqual(codes, [200, 429])
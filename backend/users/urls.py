@@ -1,6 +1,6 @@
 from django.urls import path
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from .views import RegisterView, MeView, ApiRootView, ProfileView
+from .views import RegisterView, MeView, ApiRootView, ProfileView, AsyncProfileView
 from .views import FirebaseExchangeView
 
 urlpatterns = [
@@ -13,4 +13,5 @@ urlpatterns = [
     path('users/me/', MeView.as_view(), name='users-me'),
     path('auth/firebase/', FirebaseExchangeView.as_view(), name='auth-firebase-exchange'),
     path('profile/', ProfileView.as_view(), name='profile'),
+    path('profile/async/', AsyncProfileView.as_view(), name='profile-async'),
 ]
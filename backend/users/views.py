@@ -4,13 +4,19 @@ from rest_framework.views import APIView
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from .serializers import RegisterSerializer, UserSerializer
-from services.mongo import profiles_collection
+from services.mongo import aprofiles_collection, profiles_collection
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 from services.firebase_auth import verify_id_token
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from .authentication import aauthorize
+import json
 
 User = get_user_model()
 
@@ -47,6 +53,38 @@ class ProfileView(generics.GenericAPIView):
 		return Response(doc)
 
 
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncProfileView(View):
+	"""Async twin of ProfileView: profile reads/writes are awaited on the async Mongo driver."""
+	http_method_names = ['get', 'post', 'options']
+
+	async def get(self, request):
+		user, error = await aauthorize(request)
+		if error:
+			return error
+		doc = await aprofiles_collection().find_one({'user_id': user.id}) or {}
+		doc['_id'] = str(doc.get('_id', ''))
+		return JsonResponse(doc)
+
+	async def post(self, request):
+		user, error = await aauthorize(request)
+		if error:
+			return error
+		try:
+			body = json.loads(request.body or b'{}')
+		except ValueError:
+			return JsonResponse({'error': 'invalid JSON body'}, status=400)
+		if not isinstance(body, dict):
+			return JsonResponse({'error': 'expected a JSON object'}, status=400)
+		coll = aprofiles_collection()
+		data = {k: v for k, v in body.items() if k in ['display_name', 'bio', 'avatar']}
+		data['user_id'] = user.id
+		await coll.update_one({'user_id': user.id}, {'$set': data}, upsert=True)
+		doc = await coll.find_one({'user_id': user.id}) or {}
+		doc['_id'] = str(doc.get('_id', ''))
+		return JsonResponse(doc)
+
+
 class ApiRootView(APIView):
 	permission_classes = [permissions.AllowAny]
 